@@ -0,0 +1,254 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from filtros import docs_dos_itens, mapear_valores, normalizar_cnpj
+from indice_busca import dobrar_texto
+
+# Dimensões pelas quais as compras podem ser agrupadas e as colunas do
+# resultado de cada uma
+DIMENSOES = {
+    'produto': ['cProd', 'xProd'],
+    'ncm': ['NCM'],
+    'emitente': ['cnpj_emitente'],
+    'mes': ['mes'],
+}
+
+# Dimensões guardadas com códigos (a nota entra só para contar as notas)
+_CODIFICADAS = ['nota', 'produto', 'ncm', 'emitente']
+
+_TIPOS_TABELA = {
+    'doc': np.int64, 'mes': np.int32, **{nome: np.int32 for nome in _CODIFICADAS},
+    'quantidade': np.float64, 'valor': np.float64, 'itens': np.int64,
+}
+
+
+def _sem_nulos(serie):
+    """
+    Valores da coluna com None no lugar de NaN, para que os pares
+    (cProd, xProd) incompletos sejam comparáveis
+    """
+    serie = serie.astype(object)
+    return serie.where(serie.notna(), None)
+
+
+def _pares(primeira, segunda):
+    """
+    Array de tuplas (primeira, segunda) com None no lugar de NaN. Um
+    MultiIndex voltaria a trocar None por NaN, e os pares com NaN de
+    segmentos diferentes não se encontrariam no vocabulário
+    """
+    pares = np.empty(len(primeira), dtype=object)
+    pares[:] = list(zip(_sem_nulos(primeira), _sem_nulos(segunda)))
+    return pares
+
+
+class _Vocabulario:
+    """
+    Valores distintos de uma dimensão e o código inteiro de cada um; os
+    códigos só crescem, então os já atribuídos continuam válidos
+    """
+
+    def __init__(self):
+        self.valores = []
+        self._codigos = {}
+
+    def __len__(self):
+        return len(self.valores)
+
+    def codigo(self, valor):
+        codigo = self._codigos.get(valor)
+        if codigo is None:
+            codigo = self._codigos[valor] = len(self.valores)
+            self.valores.append(valor)
+        return codigo
+
+    def codificar(self, codigos, unicos):
+        """
+        Converte os códigos locais de pd.factorize (com -1 para ausentes)
+        nos códigos deste vocabulário
+        """
+        mapa = np.array([self.codigo(valor) for valor in unicos] + [self.codigo(None)], dtype=np.int32)
+        return mapa[codigos]
+
+    @classmethod
+    def de_valores(cls, valores):
+        vocabulario = cls()
+        vocabulario.valores = list(valores)
+        for codigo, valor in enumerate(vocabulario.valores):
+            vocabulario._codigos.setdefault(valor, codigo)
+        return vocabulario
+
+    def memoria(self):
+        return sys.getsizeof(self.valores) + sys.getsizeof(self._codigos) + sum(
+            sys.getsizeof(valor) for valor in self.valores
+        )
+
+
+class AgregadosCompras:
+    """
+    Totais de compra dos itens das NFes para a análise por produto (cProd e
+    xProd), NCM, fornecedor (CNPJ do emitente) e mês. Guarda uma linha por
+    nota e produto, já somada, com as dimensões em códigos inteiros; os
+    segmentos novos são acrescentados sem recalcular os anteriores e as
+    consultas são groupbys vetorizados sobre essas linhas
+    """
+
+    def __init__(self):
+        self._vocabularios = {nome: _Vocabulario() for nome in _CODIFICADAS}
+        self._partes = []
+
+    @classmethod
+    def construir(cls, df_index, df_itens):
+        """
+        Agrega os itens; os documentos são as linhas de df_index e os itens
+        são associados a eles pelo nome do arquivo
+        """
+        agregados = cls()
+        if df_itens is None or len(df_itens) == 0:
+            return agregados
+
+        itens = df_itens.assign(doc=docs_dos_itens(df_index, df_itens))
+        itens = itens[itens['doc'] >= 0]
+        if len(itens) == 0:
+            return agregados
+
+        datas = itens['data_emissao']
+        colunas = {
+            'doc': itens['doc'].to_numpy(dtype=np.int64),
+            'mes': (datas.dt.year * 100 + datas.dt.month).fillna(0).to_numpy(dtype=np.int32),
+            'quantidade': itens['qCom'].fillna(0).to_numpy(dtype=np.float64),
+            'valor': itens['vProd'].fillna(0).to_numpy(dtype=np.float64),
+        }
+        valores = {
+            'nota': itens['chave'].astype(object),
+            'produto': _pares(itens['cProd'], itens['xProd']),
+            'ncm': itens['NCM'].astype(object),
+            'emitente': mapear_valores(itens['cnpj_emitente'], normalizar_cnpj),
+        }
+        for nome, serie in valores.items():
+            codigos, unicos = pd.factorize(serie)
+            colunas[nome] = agregados._vocabularios[nome].codificar(codigos, list(unicos))
+
+        linhas = pd.DataFrame(colunas).groupby(['doc', 'mes'] + _CODIFICADAS, sort=False).agg(
+            quantidade=('quantidade', 'sum'), valor=('valor', 'sum'), itens=('valor', 'size')
+        ).reset_index()
+        agregados._partes.append(linhas)
+        return agregados
+
+    def mesclar(self, outro, deslocamento):
+        """
+        Acrescenta os agregados de outro segmento, cujos documentos passam a
+        começar em deslocamento; só os códigos do segmento são convertidos
+        """
+        for parte in outro._partes:
+            parte = parte.copy()
+            parte['doc'] += deslocamento
+            for nome in _CODIFICADAS:
+                vocabulario = outro._vocabularios[nome]
+                mapa = np.array([self._vocabularios[nome].codigo(valor) for valor in vocabulario.valores],
+                                dtype=np.int32)
+                parte[nome] = mapa[parte[nome].to_numpy()]
+            self._partes.append(parte)
+
+    def tabela(self):
+        """
+        Linhas agregadas (uma por nota e produto), juntando as partes
+        acrescentadas desde a última consulta
+        """
+        if len(self._partes) > 1:
+            self._partes = [pd.concat(self._partes, ignore_index=True)]
+        if not self._partes:
+            return pd.DataFrame({coluna: np.array([], dtype=tipo) for coluna, tipo in _TIPOS_TABELA.items()})
+        return self._partes[0]
+
+    def produtos(self, texto):
+        """
+        Códigos dos produtos cujo código ou descrição contém o texto
+        (sem diferenciar maiúsculas e acentos)
+        """
+        texto = dobrar_texto(texto.strip())
+        return np.array([
+            codigo for codigo, valor in enumerate(self._vocabularios['produto'].valores)
+            if valor is not None and any(texto in dobrar_texto(str(parte)) for parte in valor if isinstance(parte, str))
+        ], dtype=np.int32)
+
+    def resumir(self, por=('produto', 'emitente'), docs=None, produto=None):
+        """
+        Totais agrupados pelas dimensões de por (nomes de DIMENSOES), das
+        notas em docs (todas, se None) e dos produtos que contêm o texto
+        produto. Retorna uma tabela com as colunas das dimensões, notas,
+        itens, quantidade, valor e preço médio (valor / quantidade), da
+        maior compra para a menor
+        """
+        por = list(por)
+        desconhecidas = [dimensao for dimensao in por if dimensao not in DIMENSOES]
+        if desconhecidas:
+            raise ValueError(f"Dimensão desconhecida: {', '.join(desconhecidas)}")
+
+        tabela = self.tabela()
+        if docs is not None:
+            tabela = tabela[np.isin(tabela['doc'].to_numpy(), docs)]
+        if produto:
+            tabela = tabela[np.isin(tabela['produto'].to_numpy(), self.produtos(produto))]
+
+        totais = {'quantidade': ('quantidade', 'sum'), 'valor': ('valor', 'sum'),
+                  'itens': ('itens', 'sum'), 'notas': ('nota', 'nunique')}
+        if por:
+            resumo = tabela.groupby(por, sort=False).agg(**totais).reset_index()
+        else:
+            resumo = pd.DataFrame({nome: [tabela[coluna].agg(funcao)] for nome, (coluna, funcao) in totais.items()})
+
+        # Troca os códigos pelos valores de cada dimensão
+        colunas = []
+        for dimensao in por:
+            codigos = resumo.pop(dimensao).to_numpy()
+            if dimensao == 'mes':
+                resumo['mes'] = [f"{mes // 100:04d}-{mes % 100:02d}" if mes else None for mes in codigos]
+            elif dimensao == 'produto':
+                valores = self._vocabularios['produto'].valores
+                pares = [valores[codigo] or (None, None) for codigo in codigos]
+                resumo['cProd'] = [par[0] for par in pares]
+                resumo['xProd'] = [par[1] for par in pares]
+            else:
+                valores = np.array(self._vocabularios[dimensao].valores + [None], dtype=object)
+                resumo[DIMENSOES[dimensao][0]] = valores[codigos]
+            colunas.extend(DIMENSOES[dimensao])
+
+        quantidade = resumo['quantidade'].to_numpy(dtype=np.float64)
+        resumo['preco_medio'] = np.divide(
+            resumo['valor'].to_numpy(dtype=np.float64), quantidade,
+            out=np.full(len(resumo), np.nan), where=quantidade != 0
+        )
+        resumo = resumo[colunas + ['notas', 'itens', 'quantidade', 'valor', 'preco_medio']]
+        return resumo.sort_values('valor', ascending=False, kind='stable').reset_index(drop=True)
+
+    def colunas(self):
+        """
+        As linhas agregadas e os valores de cada vocabulário (na ordem dos
+        códigos), para gravação
+        """
+        return {
+            'tabela': self.tabela(),
+            'vocabularios': {nome: vocabulario.valores for nome, vocabulario in self._vocabularios.items()},
+        }
+
+    @classmethod
+    def de_colunas(cls, tabela, vocabularios):
+        """
+        Reabre os agregados a partir do que colunas() retornou
+        """
+        agregados = cls()
+        agregados._vocabularios = {nome: _Vocabulario.de_valores(vocabularios.get(nome, [])) for nome in _CODIFICADAS}
+        if len(tabela):
+            agregados._partes.append(tabela.astype(_TIPOS_TABELA)[list(_TIPOS_TABELA)])
+        return agregados
+
+    def memoria(self):
+        """
+        Bytes ocupados pelas linhas agregadas e pelos vocabulários
+        """
+        return sum(int(parte.memory_usage(deep=True).sum()) for parte in self._partes) + sum(
+            vocabulario.memoria() for vocabulario in self._vocabularios.values()
+        )
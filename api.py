@@ -0,0 +1,514 @@
+"""
+API HTTP/JSON local para consultar as notas fiscais a partir de outros
+sistemas (o ERP, por exemplo), sobre o índice gerado pelo indexador.
+
+Uso:
+    python api.py [--indice notas.idx] [--host 127.0.0.1] [--porta 8765]
+
+Rotas (GET):
+    /buscar?q=parafuso&pagina=1&por_pagina=50
+        Aceita a mesma linguagem de consulta do app e os filtros
+        cnpj_emitente, cnpj_destinatario, ncm, chave, data_inicio e data_fim
+        (AAAA-MM-DD), valor_minimo e valor_maximo; aproximada=1 ativa a
+        busca aproximada
+    /documentos/N                 dados, itens e texto do documento N
+    /documentos/N/arquivo         arquivo original (nome=... para um vinculado)
+    /documentos/N/danfe           DANFE em PDF do XML da nota
+    /zip?q=...                    ZIP com os arquivos encontrados e os DANFEs
+                                  (falhas listadas em ERROS_DANFE.txt)
+    /compras?q=...&por=produto,emitente&produto=...
+        Totais de compra (notas, quantidade, valor e preço médio) das notas
+        encontradas, agrupados por produto, ncm, emitente e/ou mes; sem q
+        nem filtros, de todas as notas
+    /saude                        quantidade de documentos do índice
+
+As respostas são enviadas em partes (chunked) conforme são geradas, e cada
+requisição é atendida em uma thread própria. O índice é reaberto quando o
+arquivo muda (por exemplo, depois de uma nova execução do indexador).
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from armazem import mapear_arquivo
+from danfe_nfe import cache_danfe
+from exportacao import iterar_zip, membros_resultado
+from indice_notas import IndiceNotas
+
+# Resultados por página da busca (padrão e máximo)
+POR_PAGINA_PADRAO = 50
+POR_PAGINA_MAXIMO = 1000
+
+# Notas devolvidas pela busca aproximada
+LIMITE_BUSCA_APROXIMADA = 50
+
+# Contexto (em caracteres) em volta de cada trecho encontrado e trechos
+# devolvidos por nota
+TAMANHO_CONTEXTO = 80
+MAXIMO_TRECHOS = 3
+
+# Tamanho dos blocos em que os arquivos são enviados
+TAMANHO_BLOCO = 1024 * 1024
+
+# Buscas recentes guardadas por índice (consultas repetidas e troca de
+# página), limitadas pela quantidade e pelo total de bytes
+TAMANHO_CACHE_BUSCAS = int(os.environ.get('BUSCA_NF_API_CACHE', 256))
+TAMANHO_CACHE_BUSCAS_MB = int(os.environ.get('BUSCA_NF_API_CACHE_MB', 64))
+
+# Conexões aguardando atendimento; com o padrão (5), rajadas de requisições
+# simultâneas são recusadas e o cliente só tenta de novo depois de 1 s
+TAMANHO_FILA_CONEXOES = 128
+
+FILTROS_TEXTO = ('cnpj_emitente', 'cnpj_destinatario', 'ncm', 'chave')
+
+
+class ErroRequisicao(Exception):
+    """
+    Erro que vira uma resposta JSON com o status HTTP indicado
+    """
+
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+        self.mensagem = mensagem
+
+
+class OcorrenciasCompactas:
+    """
+    As ocorrências {doc: [(início, fim), ...]} dos documentos encontrados em
+    arrays: as posições de todos, na ordem dos documentos, e onde terminam
+    as de cada um. Ocupam uma fração do dicionário e dizem o próprio
+    tamanho, que limita o cache de buscas
+    """
+
+    def __init__(self, docs, ocorrencias):
+        docs = np.asarray(docs, dtype=np.int64)
+        self._ordem = np.argsort(docs, kind='stable')
+        self._docs = docs[self._ordem]
+        self._fins = np.cumsum([len(ocorrencias.get(doc, ())) for doc in docs.tolist()], dtype=np.int64)
+        self._posicoes = np.array(
+            [posicao for doc in docs.tolist() for trecho in ocorrencias.get(doc, ()) for posicao in trecho],
+            dtype=np.int64
+        ).reshape(-1, 2)
+
+    def get(self, doc, padrao=None):
+        i = np.searchsorted(self._docs, doc)
+        if i == len(self._docs) or self._docs[i] != doc:
+            return padrao
+        linha = self._ordem[i]
+        inicio = self._fins[linha - 1] if linha else 0
+        return [tuple(trecho) for trecho in self._posicoes[inicio:self._fins[linha]].tolist()]
+
+    @property
+    def nbytes(self):
+        return self._ordem.nbytes + self._docs.nbytes + self._fins.nbytes + self._posicoes.nbytes
+
+
+class CacheBuscas:
+    """
+    Cache LRU limitado das últimas buscas de um índice: (docs, ocorrencias)
+    pelos parâmetros da busca, sem os de paginação. As ocorrências ficam em
+    OcorrenciasCompactas, e o cache é limitado também pelo total de bytes,
+    para não crescer com o corpus
+    """
+
+    def __init__(self, tamanho_maximo=TAMANHO_CACHE_BUSCAS, bytes_maximo=TAMANHO_CACHE_BUSCAS_MB * 1024 * 1024):
+        self.tamanho_maximo = tamanho_maximo
+        self.bytes_maximo = bytes_maximo
+        self.bytes = 0
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._itens)
+
+    def obter(self, chave, calcular):
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                return self._itens[chave][0]
+
+        resultado = calcular()
+        if resultado is None:
+            return None
+        docs, ocorrencias = resultado
+        resultado = docs, OcorrenciasCompactas(docs, ocorrencias)
+        tamanho = docs.nbytes + resultado[1].nbytes
+
+        with self._lock:
+            if chave in self._itens:
+                self.bytes -= self._itens.pop(chave)[1]
+            self._itens[chave] = (resultado, tamanho)
+            self.bytes += tamanho
+            while self._itens and (len(self._itens) > self.tamanho_maximo or self.bytes > self.bytes_maximo):
+                self.bytes -= self._itens.popitem(last=False)[1][1]
+        return resultado
+
+
+class FonteIndice:
+    """
+    Índice servido pela API: um IndiceNotas fixo ou o arquivo gravado pelo
+    indexador, reaberto quando muda. Cada índice aberto tem o seu cache de
+    buscas; as requisições em andamento continuam com o que pegaram
+    """
+
+    def __init__(self, indice=None, caminho=None):
+        self.caminho = caminho
+        self._atual = (indice, CacheBuscas())
+        self._modificado_em = None
+        self._lock = threading.Lock()
+
+    def obter(self):
+        """
+        Retorna (índice, cache de buscas do índice)
+        """
+        if self.caminho is None:
+            return self._atual
+        try:
+            modificado_em = os.stat(self.caminho).st_mtime_ns
+        except OSError:
+            raise ErroRequisicao(503, f"Índice não encontrado: {self.caminho}")
+        if modificado_em != self._modificado_em:
+            with self._lock:
+                if modificado_em != self._modificado_em:
+                    self._atual = (IndiceNotas.carregar(self.caminho), CacheBuscas())
+                    self._modificado_em = modificado_em
+        return self._atual
+
+
+def _valor(valor):
+    """
+    Converte os valores ausentes do pandas (NaN, NaT) em None para o JSON
+    """
+    if valor is None or (not isinstance(valor, (list, dict)) and pd.isna(valor)):
+        return None
+    return valor
+
+
+def _inteiro(parametros, nome, padrao, minimo=1, maximo=None):
+    try:
+        valor = int(parametros.get(nome, padrao))
+    except ValueError:
+        raise ErroRequisicao(400, f"Parâmetro {nome} deve ser um número inteiro")
+    if valor < minimo:
+        raise ErroRequisicao(400, f"Parâmetro {nome} deve ser no mínimo {minimo}")
+    return min(valor, maximo) if maximo else valor
+
+
+def filtros_da_requisicao(parametros):
+    """
+    Converte os parâmetros da URL nos argumentos de IndiceFiltros.filtrar
+    """
+    filtros = {nome: parametros.get(nome) or None for nome in FILTROS_TEXTO}
+    for nome in ('data_inicio', 'data_fim'):
+        filtros[nome] = None
+        if parametros.get(nome):
+            try:
+                filtros[nome] = date.fromisoformat(parametros[nome])
+            except ValueError:
+                raise ErroRequisicao(400, f"Data inválida em {nome} (use AAAA-MM-DD): {parametros[nome]}")
+    for nome in ('valor_minimo', 'valor_maximo'):
+        filtros[nome] = None
+        if parametros.get(nome):
+            try:
+                filtros[nome] = float(parametros[nome].replace(',', '.'))
+            except ValueError:
+                raise ErroRequisicao(400, f"Valor inválido em {nome}: {parametros[nome]}")
+    return filtros
+
+
+def pesquisar(indice, buscas, parametros):
+    """
+    Executa a busca da requisição, ou a reaproveita do cache; retorna
+    (docs, ocorrencias)
+    """
+    filtros = filtros_da_requisicao(parametros)
+    termo = parametros.get('q', '').strip()
+    aproximada = parametros.get('aproximada', '') in ('1', 'true', 'sim')
+    chave = (termo, aproximada, tuple(sorted(filtros.items())))
+    try:
+        encontrados = buscas.obter(chave, lambda: indice.pesquisar(
+            termo, aproximada=aproximada, limite_aproximada=LIMITE_BUSCA_APROXIMADA, **filtros
+        ))
+    except ValueError as e:
+        # Erro na sintaxe da consulta
+        raise ErroRequisicao(400, str(e))
+    if encontrados is None:
+        raise ErroRequisicao(400, "Informe o termo de busca (q) ou algum filtro")
+    return encontrados
+
+
+def trechos(texto, ocorrencias, contexto=TAMANHO_CONTEXTO, maximo=MAXIMO_TRECHOS):
+    """
+    Trechos de texto em volta das primeiras ocorrências
+    """
+    return [
+        {'inicio': inicio, 'fim': fim, 'texto': texto[max(0, inicio - contexto):fim + contexto]}
+        for inicio, fim in ocorrencias[:maximo]
+    ]
+
+
+def resumos(indice, docs):
+    """
+    Gera os dados principais de cada documento; as linhas são selecionadas
+    da tabela de uma vez, não uma a uma
+    """
+    linhas = indice.df_index.iloc[docs]
+    for doc, arquivo, tipo, chave, hash_arquivo, copias in zip(
+            docs, linhas['arquivo'], linhas['tipo'], linhas['chave'], linhas['hash'], linhas['copias']):
+        yield {
+            'doc': int(doc),
+            'arquivo': arquivo,
+            'tipo': _valor(tipo),
+            'chave': _valor(chave),
+            'hash': _valor(hash_arquivo),
+            'vinculados': [copia['arquivo'] for copia in copias],
+        }
+
+
+def gerar_busca(indice, docs, ocorrencias, pagina, por_pagina):
+    """
+    Gera a resposta JSON da busca em partes, uma nota por vez; o texto só é
+    descomprimido para as notas da página
+    """
+    yield f'{{"total": {len(docs)}, "pagina": {pagina}, "por_pagina": {por_pagina}, "resultados": ['.encode('utf-8')
+    for n, resultado in enumerate(resumos(indice, docs[(pagina - 1) * por_pagina:pagina * por_pagina])):
+        encontrados = ocorrencias.get(resultado['doc'], [])
+        resultado['ocorrencias'] = len(encontrados)
+        resultado['trechos'] = trechos(indice.texto(resultado['doc']), encontrados)
+        yield (b', ' if n else b'') + json.dumps(resultado, ensure_ascii=False).encode('utf-8')
+    yield b']}'
+
+
+def _documento(indice, numero):
+    try:
+        doc = int(numero)
+    except ValueError:
+        raise ErroRequisicao(404, f"Documento inexistente: {numero}")
+    if not 0 <= doc < len(indice) or doc in indice.ocultos:
+        raise ErroRequisicao(404, f"Documento inexistente: {numero}")
+    return doc
+
+
+def dados_documento(indice, doc):
+    """
+    Metadados, itens (das NFes em XML) e texto do documento
+    """
+    documento = next(resumos(indice, [doc]))
+    itens = indice.df_itens[indice.df_itens['arquivo'] == documento['arquivo']]
+    documento['itens'] = json.loads(itens.to_json(orient='records', date_format='iso', force_ascii=False))
+    documento['texto'] = indice.texto(doc)
+    return documento
+
+
+def abrir_arquivo(registro):
+    """
+    Conteúdo do arquivo indexado (os dados de IndiceNotas.arquivos_das_notas())
+    mapeado do disco, ou None
+    """
+    caminho = registro.get('caminho')
+    if not caminho:
+        return None
+    try:
+        return mapear_arquivo(caminho)
+    except OSError:
+        return None
+
+
+def _blocos(dados):
+    """
+    Entrega o conteúdo em blocos e fecha o mapeamento no fim
+    """
+    try:
+        for inicio in range(0, len(dados), TAMANHO_BLOCO):
+            yield dados[inicio:inicio + TAMANHO_BLOCO]
+    finally:
+        if hasattr(dados, 'close'):
+            dados.close()
+
+
+def _xml_do_documento(indice, doc):
+    """
+    Dados do XML da nota: o próprio documento ou um arquivo vinculado
+    """
+    for registro in indice.arquivos_das_notas([doc])[0]:
+        if registro['arquivo'].lower().endswith('.xml'):
+            return registro
+    raise ErroRequisicao(404, "A nota não tem XML para gerar o DANFE")
+
+
+class ManipuladorApi(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'BuscaNotasFiscais'
+
+    def log_message(self, formato, *args):
+        if self.server.registrar:
+            super().log_message(formato, *args)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parametros = {nome: valores[-1] for nome, valores in parse_qs(url.query).items()}
+        partes = [parte for parte in url.path.split('/') if parte]
+        try:
+            indice, buscas = self.server.fonte.obter()
+            tipo, corpo, cabecalhos = self._rotear(indice, buscas, partes, parametros)
+        except ErroRequisicao as e:
+            self._enviar_json(e.status, {'erro': e.mensagem})
+            return
+        except Exception as e:
+            self._enviar_json(500, {'erro': str(e)})
+            return
+        self._enviar_em_partes(tipo, corpo, cabecalhos)
+
+    def _rotear(self, indice, buscas, partes, parametros):
+        """
+        Retorna (tipo do conteúdo, partes do corpo, cabeçalhos extras)
+        """
+        json_utf8 = 'application/json; charset=utf-8'
+        if partes == ['saude']:
+            return json_utf8, [json.dumps({'documentos': len(indice)}).encode('utf-8')], {}
+
+        if partes == ['buscar']:
+            docs, ocorrencias = pesquisar(indice, buscas, parametros)
+            pagina = _inteiro(parametros, 'pagina', 1)
+            por_pagina = _inteiro(parametros, 'por_pagina', POR_PAGINA_PADRAO, maximo=POR_PAGINA_MAXIMO)
+            return json_utf8, gerar_busca(indice, docs, ocorrencias, pagina, por_pagina), {}
+
+        if partes == ['compras']:
+            por = [dimensao for dimensao in parametros.get('por', 'produto,emitente').split(',') if dimensao]
+            docs = None
+            if parametros.get('q') or any(parametros.get(nome) for nome in filtros_da_requisicao(parametros)):
+                docs, _ = pesquisar(indice, buscas, parametros)
+            elif indice.ocultos:
+                docs = indice.visiveis(np.arange(len(indice)))
+            try:
+                resumo = indice.agregados.resumir(por, docs=docs, produto=parametros.get('produto'))
+            except ValueError as e:
+                raise ErroRequisicao(400, str(e))
+            corpo = resumo.to_json(orient='records', force_ascii=False).encode('utf-8')
+            return json_utf8, [corpo], {}
+
+        if partes == ['zip']:
+            docs, _ = pesquisar(indice, buscas, parametros)
+            arquivos = [registro for registros in indice.arquivos_das_notas(docs) for registro in registros]
+            corpo = iterar_zip(membros_resultado(arquivos, abrir_arquivo))
+            return 'application/zip', corpo, _anexo('notas_fiscais.zip')
+
+        if len(partes) >= 2 and partes[0] == 'documentos':
+            doc = _documento(indice, partes[1])
+            if len(partes) == 2:
+                corpo = json.dumps(dados_documento(indice, doc), ensure_ascii=False).encode('utf-8')
+                return json_utf8, [corpo], {}
+
+            if partes[2:] == ['arquivo']:
+                registros = indice.arquivos_das_notas([doc])[0]
+                nome = parametros.get('nome', registros[0]['arquivo'])
+                registro = next((registro for registro in registros if registro['arquivo'] == nome), None)
+                if registro is None:
+                    raise ErroRequisicao(404, f"Arquivo não vinculado ao documento: {nome}")
+                dados = abrir_arquivo(registro)
+                if dados is None:
+                    raise ErroRequisicao(404, f"Arquivo indisponível: {nome}")
+                tipo = 'application/pdf' if nome.lower().endswith('.pdf') else 'application/xml'
+                return tipo, _blocos(dados), _anexo(os.path.basename(nome))
+
+            if partes[2:] == ['danfe']:
+                registro = _xml_do_documento(indice, doc)
+                nome = registro['arquivo']
+                dados = abrir_arquivo(registro)
+                if dados is None:
+                    raise ErroRequisicao(404, f"Arquivo indisponível: {nome}")
+                try:
+                    pdf = cache_danfe.obter(bytes(dados))
+                finally:
+                    if hasattr(dados, 'close'):
+                        dados.close()
+                return 'application/pdf', [pdf], _anexo(os.path.basename(nome).rsplit('.', 1)[0] + '_danfe.pdf')
+
+        raise ErroRequisicao(404, f"Rota inexistente: {self.path}")
+
+    def _enviar_json(self, status, dados):
+        corpo = json.dumps(dados, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _enviar_em_partes(self, tipo, corpo, cabecalhos):
+        self.send_response(200)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Transfer-Encoding', 'chunked')
+        for nome, valor in cabecalhos.items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        try:
+            for parte in corpo:
+                if parte:
+                    self.wfile.write(f"{len(parte):x}\r\n".encode('ascii'))
+                    self.wfile.write(parte)
+                    self.wfile.write(b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        except Exception:
+            # O status já foi enviado (ou o cliente desconectou): encerra a
+            # conexão sem o fim do corpo, para que a resposta fique incompleta
+            self.close_connection = True
+
+
+def _anexo(nome):
+    return {'Content-Disposition': f"attachment; filename*=UTF-8''{quote(nome)}"}
+
+
+class ServidorApi(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = TAMANHO_FILA_CONEXOES
+
+    def __init__(self, endereco, fonte, registrar=True):
+        super().__init__(endereco, ManipuladorApi)
+        self.fonte = fonte
+        self.registrar = registrar
+
+
+def criar_servidor(indice=None, caminho_indice=None, host='127.0.0.1', porta=8765, registrar=True):
+    """
+    Cria o servidor sobre um IndiceNotas ou sobre o arquivo do índice. Com
+    porta 0, o sistema escolhe uma porta livre (server_address[1])
+    """
+    return ServidorApi((host, porta), FonteIndice(indice, caminho_indice), registrar)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--indice', default=os.environ.get('BUSCA_NF_INDICE', 'notas.idx'),
+                        help='arquivo do índice (padrão: BUSCA_NF_INDICE ou notas.idx)')
+    parser.add_argument('--host', default='127.0.0.1', help='endereço (padrão: 127.0.0.1)')
+    parser.add_argument('--porta', type=int, default=8765, help='porta (padrão: 8765)')
+    parser.add_argument('--silencioso', action='store_true', help='não registra as requisições')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.indice):
+        parser.error(f"índice não encontrado: {args.indice}")
+
+    servidor = criar_servidor(caminho_indice=args.indice, host=args.host, porta=args.porta,
+                              registrar=not args.silencioso)
+    print(f"API em http://{args.host}:{servidor.server_address[1]} (índice {args.indice})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,44 @@
 import streamlit as st
 import pandas as pd
-from PyPDF2 import PdfReader
-import pytesseract
-from PIL import Image
-import pdf2image
-import io
+import numpy as np
+import contextlib
+import itertools
 import os
 import tempfile
-import xml.etree.ElementTree as ET
-from pathlib import Path
 import zipfile
 import base64
-import streamlit.components.v1 as components
-from pynfe.processamento.danfe import danfe
-from pynfe.processamento.xml import XML
+import html
+from urllib.parse import urlencode
+from indice_notas import IndiceNotas
+from indice_compartilhado import IndiceCompartilhado
+from danfe_nfe import cache_danfe
+from exportacao import iterar_zip, membros_resultado
+from armazem import mapear_arquivo, membros_zip
+from instrumentacao import arquivos_mais_lentos, medir, registros, resumo_por_etapa, tabela_medicoes
+
+# Intervalo (em segundos) da atualização do andamento da indexação
+INTERVALO_ANDAMENTO = 2
+
+# Quantidade máxima de notas devolvidas pela busca aproximada
+LIMITE_BUSCA_APROXIMADA = 50
+
+# Opções de resultados por página, trecho de contexto (em caracteres) em
+# volta de cada ocorrência e ocorrências destacadas por resultado
+TAMANHOS_PAGINA = [10, 25, 50, 100]
+TAMANHO_CONTEXTO = 80
+MAXIMO_OCORRENCIAS_TRECHO = 3
+
+# Notas por arquivo ZIP baixado: o Streamlit guarda cada download inteiro na
+# memória, então resultados maiores são divididos em partes. A rota /zip da
+# API envia o ZIP em blocos, sem esse limite
+NOTAS_POR_ZIP = int(os.environ.get('BUSCA_NF_NOTAS_POR_ZIP', 500))
+
+# Endereço da API (api.py) que serve o mesmo índice pré-construído do app;
+# com ele, o ZIP dos resultados é baixado da rota /zip, em um só arquivo
+URL_API = os.environ.get('BUSCA_NF_API_URL')
+
+# Dimensões do resumo das compras
+ROTULOS_DIMENSOES = {'produto': 'Produto', 'ncm': 'NCM', 'emitente': 'Fornecedor (CNPJ)', 'mes': 'Mês'}
 
 # Configuração da página
 st.set_page_config(
@@ -28,14 +53,6 @@ if 'key' not in st.session_state:
 if 'mostrar_confirmacao' not in st.session_state:
     st.session_state.mostrar_confirmacao = False
 
-def normalizar_cnpj(cnpj):
-    """
-    Remove caracteres especiais do CNPJ
-    """
-    if cnpj:
-        return ''.join(filter(str.isdigit, cnpj))
-    return ''
-
 def reiniciar_sistema():
     """
     Reinicia o sistema limpando a sessão
@@ -79,240 +96,506 @@ def get_theme_colors():
             'button_hover': '#F8F9FA',
         }
 
-def xml_para_danfe(xml_content):
+@medir('criar_zip_resultado')
+def criar_zip_resultado(arquivos_encontrados, obter_arquivo):
+    """
+    Cria um arquivo ZIP com os arquivos encontrados na busca e suas versões em DANFE.
+    O ZIP é montado em blocos em um arquivo temporário em disco, mas o
+    Streamlit lê o arquivo inteiro para a memória ao servir o download; por
+    isso os resultados grandes são divididos em partes (NOTAS_POR_ZIP)
+    """
+    zip_temp = tempfile.TemporaryFile()
+    for bloco in iterar_zip(membros_resultado(arquivos_encontrados, obter_arquivo)):
+        zip_temp.write(bloco)
+    
+    zip_temp.seek(0)
+    return zip_temp
+
+def gerar_zip_sob_demanda(arquivos_encontrados, obter_arquivo):
+    """
+    Retorna uma função que monta o ZIP apenas quando o download é solicitado
+    """
+    return lambda: criar_zip_resultado(arquivos_encontrados, obter_arquivo)
+
+def url_zip_api(termo, aproximada, filtros):
+    """
+    Endereço da rota /zip da API com a mesma busca, ou None. Só vale para o
+    índice pré-construído, que a API também serve; os arquivos carregados
+    no app ficam no índice compartilhado, que só o app conhece
     """
-    Converte XML de NFe para DANFE usando PyNFe
+    if not URL_API or st.session_state.get('origem_indice') != 'preconstruido':
+        return None
+    parametros = {nome: valor for nome, valor in filtros.items() if valor not in (None, '')}
+    if termo:
+        parametros['q'] = termo
+    if aproximada:
+        parametros['aproximada'] = '1'
+    return f"{URL_API.rstrip('/')}/zip?{urlencode(parametros)}"
+
+def abridor_de_arquivos(armazem):
     """
+    Retorna uma função que devolve o conteúdo do arquivo (os dados de
+    IndiceNotas.arquivos_das_notas()) mapeado do disco: os carregados no app
+    vêm do armazém, pelo hash, e os do índice pré-construído, da pasta
+    indexada
+    """
+    def obter(registro):
+        if armazem is not None and registro.get('hash') in armazem:
+            return armazem.ler(registro['hash'])
+        caminho = registro.get('caminho')
+        if caminho and os.path.exists(caminho):
+            return mapear_arquivo(caminho)
+        return None
+    return obter
+
+@st.cache_resource(show_spinner="Abrindo o índice pré-construído...")
+def carregar_indice_preconstruido(caminho, modificado_em):
+    """
+    Abre o índice gerado pelo indexador; recarrega quando o arquivo muda
+    """
+    return IndiceNotas.carregar(caminho)
+
+def obter_indice_preconstruido():
+    """
+    Retorna o índice configurado em BUSCA_NF_INDICE, se houver
+    """
+    caminho = os.environ.get('BUSCA_NF_INDICE')
+    if not caminho or not os.path.exists(caminho):
+        return None
     try:
-        # Cria arquivos temporários para o XML e PDF
-        with tempfile.NamedTemporaryFile(suffix='.xml', delete=False) as xml_temp:
-            # Salva o XML em um arquivo temporário
-            xml_temp.write(xml_content.encode('utf-8'))
-            xml_temp.flush()
-            
-            # Processa o XML
-            nfe = XML(xml_temp.name)
-            
-            # Cria o DANFE
-            pdf_buffer = io.BytesIO()
-            danfe_nfe = danfe(nfe.nfe, template=False)
-            danfe_nfe.gerar_pdf(pdf_buffer)
-            
-            # Limpa o arquivo temporário
-            os.unlink(xml_temp.name)
-            
-            # Retorna o buffer do PDF
-            pdf_buffer.seek(0)
-            return pdf_buffer
-            
+        return carregar_indice_preconstruido(caminho, os.path.getmtime(caminho))
     except Exception as e:
-        st.error(f"Erro ao converter XML para DANFE: {str(e)}")
+        st.error(f"Erro ao abrir o índice pré-construído: {str(e)}")
         return None
 
-def extrair_texto_xml(conteudo):
+@st.cache_resource
+def obter_indice_compartilhado():
     """
-    Extrai informações relevantes de arquivos XML de NFe
+    Índice único do processo: os arquivos carregados em qualquer sessão
+    ficam visíveis para todas, e cada sessão guarda só o andamento do seu
+    envio
+    """
+    return IndiceCompartilhado()
+
+def usar_indice(origem):
+    """
+    Define o índice usado pela sessão ('compartilhado' ou 'preconstruido');
+    ao trocar de índice, o resultado da busca anterior é descartado
+    """
+    if st.session_state.get('origem_indice') != origem:
+        st.session_state.pop('resultado_busca', None)
+        st.session_state.origem_indice = origem
+
+@contextlib.contextmanager
+def indice_da_sessao():
+    """
+    Entrega o índice usado pela sessão; o compartilhado fica com a trava de
+    leitura até o fim do bloco
+    """
+    if st.session_state.get('origem_indice') == 'preconstruido':
+        yield obter_indice_preconstruido()
+        return
+    compartilhado = obter_indice_compartilhado()
+    with compartilhado.leitura():
+        yield compartilhado.indice
+
+def get_individual_download_link(dados, nome_arquivo):
+    """
+    Cria o link de download para o arquivo original
     """
     try:
-        root = ET.fromstring(conteudo)
-        
-        # Define o namespace padrão da NFe
-        ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-        
-        # Lista para armazenar todas as informações
-        info = []
-        
-        # Informações da nota
-        nfe_info = root.find('.//nfe:infNFe', ns)
-        if nfe_info is not None:
-            chave = nfe_info.get('Id', '')
-            info.append(f"Chave: {chave}")
-        
-        # Dados do emitente
-        emit = root.find('.//nfe:emit', ns)
-        if emit is not None:
-            nome_emit = emit.find('nfe:xNome', ns)
-            cnpj_emit = emit.find('nfe:CNPJ', ns)
-            if nome_emit is not None:
-                info.append(f"Emitente: {nome_emit.text}")
-            if cnpj_emit is not None:
-                cnpj_formatado = f"{cnpj_emit.text}"  # CNPJ sem formatação
-                cnpj_com_formato = f"{cnpj_emit.text[:2]}.{cnpj_emit.text[2:5]}.{cnpj_emit.text[5:8]}/{cnpj_emit.text[8:12]}-{cnpj_emit.text[12:]}"  # CNPJ formatado
-                info.append(f"CNPJ Emitente: {cnpj_formatado}")
-                info.append(f"CNPJ Emitente Formatado: {cnpj_com_formato}")
-        
-        # Dados do destinatário
-        dest = root.find('.//nfe:dest', ns)
-        if dest is not None:
-            nome_dest = dest.find('nfe:xNome', ns)
-            cnpj_dest = dest.find('nfe:CNPJ', ns)
-            if nome_dest is not None:
-                info.append(f"Destinatário: {nome_dest.text}")
-            if cnpj_dest is not None:
-                cnpj_formatado = f"{cnpj_dest.text}"  # CNPJ sem formatação
-                cnpj_com_formato = f"{cnpj_dest.text[:2]}.{cnpj_dest.text[2:5]}.{cnpj_dest.text[5:8]}/{cnpj_dest.text[8:12]}-{cnpj_dest.text[12:]}"  # CNPJ formatado
-                info.append(f"CNPJ Destinatário: {cnpj_formatado}")
-                info.append(f"CNPJ Destinatário Formatado: {cnpj_com_formato}")
-        
-        # Dados dos produtos
-        produtos = root.findall('.//nfe:det', ns)
-        for prod in produtos:
-            prod_info = prod.find('nfe:prod', ns)
-            if prod_info is not None:
-                codigo = prod_info.find('nfe:cProd', ns)
-                descricao = prod_info.find('nfe:xProd', ns)
-                ncm = prod_info.find('nfe:NCM', ns)
-                quantidade = prod_info.find('nfe:qCom', ns)
-                valor = prod_info.find('nfe:vUnCom', ns)
-                
-                prod_text = []
-                if codigo is not None:
-                    prod_text.append(f"Código: {codigo.text}")
-                if descricao is not None:
-                    prod_text.append(f"Produto: {descricao.text}")
-                if ncm is not None:
-                    prod_text.append(f"NCM: {ncm.text}")
-                if quantidade is not None:
-                    prod_text.append(f"Qtd: {quantidade.text}")
-                if valor is not None:
-                    prod_text.append(f"Valor: {valor.text}")
-                    
-                info.append(" | ".join(prod_text))
-        
-        # Adiciona valores totais
-        total = root.find('.//nfe:ICMSTot', ns)
-        if total is not None:
-            vnf = total.find('nfe:vNF', ns)
-            if vnf is not None:
-                info.append(f"Valor Total NF: {vnf.text}")
+        b64 = base64.b64encode(dados).decode()
+        mime_type = 'application/pdf' if nome_arquivo.lower().endswith('.pdf') else 'application/xml'
         
-        return "\n".join(info)
+        return f'<a href="data:{mime_type};base64,{b64}" download="{nome_arquivo}" class="download-button-small">⬇️ Baixar arquivo</a>'
     except Exception as e:
-        st.error(f"Erro ao processar XML: {str(e)}")
-        return ""
+        return f"Erro ao gerar link: {str(e)}"
 
-def extrair_texto_pdf(arquivo):
+def gerar_danfe_sob_demanda(dados):
     """
-    Extrai texto de arquivos PDF, sejam eles digitais ou escaneados
+    Retorna uma função que gera o DANFE do XML apenas quando o download
+    é solicitado
     """
-    try:
-        reader = PdfReader(arquivo)
-        texto = ""
-        for pagina in reader.pages:
-            texto += pagina.extract_text()
-            
-        if not texto.strip():
-            with tempfile.NamedTemporaryFile(suffix='.pdf') as tmp:
-                tmp.write(arquivo.getvalue())
-                tmp.flush()
-                imagens = pdf2image.convert_from_path(tmp.name)
-                
-            texto = ""
-            for imagem in imagens:
-                texto += pytesseract.image_to_string(imagem, lang='por')
-                
-        return texto
-    except Exception as e:
-        st.error(f"Erro ao processar PDF: {str(e)}")
-        return ""
+    return lambda: cache_danfe.obter(bytes(dados))
 
-def criar_zip_resultado(arquivos_encontrados, todos_arquivos):
+def expandir_arquivos(arquivos_uploaded):
     """
-    Cria um arquivo ZIP com os arquivos encontrados na busca e suas versões em DANFE
+    Retorna [(nome, arquivo carregado, membro do ZIP ou None)] dos arquivos
+    carregados, com os PDFs e XMLs de cada ZIP no lugar do próprio ZIP. A
+    lista de membros de cada ZIP é lida uma vez por upload e guardada na
+    sessão, e não a cada interação com a página
     """
-    zip_buffer = io.BytesIO()
+    membros_por_upload = st.session_state.get('membros_zip', {})
+    entradas = []
+    for arquivo in arquivos_uploaded:
+        if not arquivo.name.lower().endswith('.zip'):
+            entradas.append((arquivo.name, arquivo, None))
+            continue
+        if arquivo.file_id not in membros_por_upload:
+            try:
+                membros_por_upload[arquivo.file_id] = membros_zip(arquivo, prefixo=arquivo.name.rsplit('.', 1)[0])
+            except zipfile.BadZipFile:
+                membros_por_upload[arquivo.file_id] = None
+        membros = membros_por_upload[arquivo.file_id]
+        if membros is None:
+            st.warning(f"Arquivo ZIP inválido: {arquivo.name}")
+            continue
+        entradas.extend((nome, arquivo, membro) for nome, membro in membros)
+    # Só os uploads ainda presentes continuam na sessão
+    st.session_state.membros_zip = {
+        arquivo.file_id: membros_por_upload[arquivo.file_id]
+        for arquivo in arquivos_uploaded if arquivo.file_id in membros_por_upload
+    }
+    return entradas
+
+def processar_arquivos(arquivos_uploaded, progress_bar, status_text):
+    """
+    Grava os arquivos carregados (lista de expandir_arquivos) e os envia
+    para o índice compartilhado, que os extrai e indexa em segundo plano.
+    Os que já estão no índice não são extraídos de novo
+    """
+    total_arquivos = len(arquivos_uploaded)
+    compartilhado = obter_indice_compartilhado()
     
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for arquivo_nome in arquivos_encontrados:
-            arquivo_original = next(
-                (arq for arq in todos_arquivos if arq.name == arquivo_nome),
-                None
+    # Os arquivos (e os membros dos ZIPs, um por vez) são gravados em disco
+    # e os processos de extração leem de lá, sem cópias dos bytes na
+    # memória da sessão
+    armazem = compartilhado.armazem
+    entradas = []
+    hashes = []
+    i = 0
+    # Cada ZIP é aberto uma vez para os seus membros e fechado em seguida
+    for arquivo, grupo in itertools.groupby(arquivos_uploaded, key=lambda entrada: entrada[1]):
+        with contextlib.ExitStack() as abertos:
+            zip_file = None
+            for nome, _, membro in grupo:
+                i += 1
+                progress_bar.progress(i / total_arquivos)
+                status_text.text(f'Gravando: {nome} ({i} de {total_arquivos})')
+                try:
+                    if membro is None:
+                        chave = armazem.guardar(arquivo)
+                    else:
+                        if zip_file is None:
+                            zip_file = abertos.enter_context(zipfile.ZipFile(arquivo))
+                        with zip_file.open(membro) as dados:
+                            chave = armazem.guardar(dados)
+                except (OSError, zipfile.BadZipFile) as e:
+                    st.warning(f"Erro ao ler {nome}: {str(e)}")
+                    continue
+                hashes.append(chave)
+                entradas.append((nome, armazem.caminho(chave)))
+    
+    # A sessão guarda só o lote enviado, para acompanhar o andamento
+    st.session_state.indexacao, st.session_state.ja_indexados = compartilhado.enviar(entradas, hashes)
+    compartilhado.limpar_armazem()
+
+def acompanhar_indexacao():
+    """
+    Mostra o andamento da indexação dos arquivos enviados pela sessão; os
+    documentos são mesclados no índice compartilhado pela thread escritora
+    """
+    indexacao = st.session_state.get('indexacao')
+    if indexacao is None:
+        return
+    
+    compartilhado = obter_indice_compartilhado()
+    if not compartilhado.concluida(indexacao):
+        if not indexacao.iniciada:
+            st.info("⏳ Aguardando a indexação dos arquivos enviados antes (nesta ou em outra sessão)...")
+        else:
+            st.progress(
+                indexacao.concluidos / max(indexacao.total, 1),
+                text=f"⏳ {indexacao.concluidos} de {indexacao.total} arquivo(s) indexado(s). "
+                     "A busca já considera os arquivos prontos."
             )
-            
-            if arquivo_original:
-                arquivo_original.seek(0)
-                zip_file.writestr(arquivo_original.name, arquivo_original.getvalue())
-                
-                # Adiciona versão DANFE para arquivos XML
-                if arquivo_nome.lower().endswith('.xml'):
-                    arquivo_original.seek(0)
-                    pdf_buffer = xml_para_danfe(arquivo_original.getvalue().decode())
-                    if pdf_buffer:
-                        pdf_nome = arquivo_nome.rsplit('.', 1)[0] + '_danfe.pdf'
-                        zip_file.writestr(pdf_nome, pdf_buffer.getvalue())
+        if indexacao.cancelada:
+            st.info("⏹️ Cancelando: a indexação para depois do arquivo em andamento.")
+        elif st.button("⏹️ Cancelar indexação", key='cancelar_indexacao'):
+            indexacao.cancelar()
+            st.rerun(scope='fragment')
+        return
     
-    zip_buffer.seek(0)
-    return zip_buffer
+    for arquivo, erro in indexacao.erros:
+        st.warning(f"Erro ao processar {arquivo}: {erro}")
+    if indexacao.cancelada:
+        st.info(
+            f"⏹️ Indexação cancelada: {indexacao.total - indexacao.concluidos} arquivo(s) não foram indexados "
+            "e podem ser enviados de novo."
+        )
+    with compartilhado.leitura():
+        total_indice = len(compartilhado.indice)
+        duplicados = compartilhado.indice.duplicados
+    ja_indexados = st.session_state.get('ja_indexados', 0)
+    if total_indice == 0:
+        st.error("Nenhum arquivo foi processado com sucesso.")
+    else:
+        st.success(
+            f'✅ Processamento concluído: {indexacao.concluidos - len(indexacao.erros)} de {indexacao.total} arquivo(s) processado(s)'
+            + (f', {ja_indexados} já estava(m) no índice' if ja_indexados else '')
+            + (f', {duplicados} vinculado(s) a outra nota (cópias ou DANFE do XML)' if duplicados else '')
+        )
+    
+    if compartilhado.aviso:
+        st.warning(compartilhado.aviso)
+    
+    exibir_desempenho(indexacao.medicoes)
+    with compartilhado.leitura():
+        exibir_memoria(compartilhado.indice)
 
-def get_download_link(buffer, filename):
+def exibir_memoria(indice_notas):
     """
-    Cria um link de download para o arquivo ZIP
+    Mostra quanto o índice ocupa em memória, por parte
     """
-    b64 = base64.b64encode(buffer.getvalue()).decode()
-    return f'<a href="data:application/zip;base64,{b64}" download="{filename}" class="download-button">📥 Baixar todas em ZIP</a>'
+    partes = indice_notas.memoria()
+    total = sum(partes.values())
+    with st.expander(f"💾 Memória do índice: {total / 1e6:.1f} MB", expanded=False):
+        st.dataframe(
+            pd.DataFrame({'parte': list(partes), 'MB': [tamanho / 1e6 for tamanho in partes.values()]}),
+            use_container_width=True, hide_index=True
+        )
+        textos = indice_notas.textos
+        if textos.tamanho_original:
+            st.caption(
+                f"Texto de {len(textos)} documento(s): {textos.tamanho_original / 1e6:.1f} MB, "
+                f"{textos.memoria() / 1e6:.1f} MB comprimido"
+            )
 
-def get_individual_download_link(arquivo, nome_arquivo):
+def exibir_desempenho(medicoes):
     """
-    Cria links de download para o arquivo original e versão DANFE (se for XML)
+    Mostra o tempo gasto em cada etapa e os arquivos mais lentos, com
+    exportação das medições em JSON e CSV
     """
-    try:
-        arquivo.seek(0)
-        b64 = base64.b64encode(arquivo.getvalue()).decode()
-        mime_type = 'application/pdf' if nome_arquivo.lower().endswith('.pdf') else 'application/xml'
-        
-        links = [f'<a href="data:{mime_type};base64,{b64}" download="{nome_arquivo}" class="download-button-small">⬇️ Baixar arquivo</a>']
+    # Inclui os DANFEs e ZIPs gerados pelos downloads
+    df = tabela_medicoes(list(medicoes) + registros({'xml_para_danfe', 'criar_zip_resultado'}))
+    if df.empty:
+        return
+    
+    with st.expander("⏱️ Desempenho do processamento", expanded=False):
+        st.write("Tempo por etapa (as subetapas estão contidas na etapa indicada):")
+        st.dataframe(resumo_por_etapa(df), use_container_width=True)
         
-        # Adiciona botão de DANFE para arquivos XML
-        if nome_arquivo.lower().endswith('.xml'):
-            arquivo.seek(0)
-            pdf_buffer = xml_para_danfe(arquivo.getvalue().decode())
-            if pdf_buffer:
-                pdf_b64 = base64.b64encode(pdf_buffer.getvalue()).decode()
-                pdf_nome = nome_arquivo.rsplit('.', 1)[0] + '_danfe.pdf'
-                links.append(f'<a href="data:application/pdf;base64,{pdf_b64}" download="{pdf_nome}" class="download-button-small">📄 Baixar DANFE</a>')
+        st.write("Arquivos mais lentos:")
+        st.dataframe(arquivos_mais_lentos(df), use_container_width=True)
         
-        return ' '.join(links)
-    except Exception as e:
-        return f"Erro ao gerar link: {str(e)}"
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                "Exportar JSON",
+                data=df.to_json(orient='records', force_ascii=False),
+                file_name="medicoes.json",
+                mime='application/json',
+                key="medicoes_json"
+            )
+        with col2:
+            st.download_button(
+                "Exportar CSV",
+                data=df.to_csv(index=False),
+                file_name="medicoes.csv",
+                mime='text/csv',
+                key="medicoes_csv"
+            )
 
-def processar_arquivos(arquivos_uploaded, progress_bar, status_text):
+def montar_trecho(texto, trechos, contexto=TAMANHO_CONTEXTO, maximo=MAXIMO_OCORRENCIAS_TRECHO):
     """
-    Processa os arquivos carregados com barra de progresso
+    Monta o HTML do trecho de um resultado com as primeiras ocorrências
+    destacadas, a partir das posições (início, fim) devolvidas pela busca.
+    Janelas de contexto que se sobrepõem são unidas
     """
-    index = []
-    total_arquivos = len(arquivos_uploaded)
+    texto = texto.replace('\n', ' ')
+    if not trechos:
+        return html.escape(texto[:2 * contexto]) + ('…' if len(texto) > 2 * contexto else '')
     
-    for i, arquivo in enumerate(arquivos_uploaded):
-        try:
-            progress_bar.progress((i + 1) / total_arquivos)
-            status_text.text(f'Processando: {arquivo.name} ({i + 1} de {total_arquivos})')
-            
-            tipo = 'PDF' if arquivo.name.lower().endswith('.pdf') else 'XML'
+    janelas = []
+    for inicio, fim in trechos[:maximo]:
+        janela_inicio, janela_fim = max(0, inicio - contexto), min(len(texto), fim + contexto)
+        if janelas and janela_inicio <= janelas[-1][1]:
+            janelas[-1][1] = max(janelas[-1][1], janela_fim)
+            janelas[-1][2].append((inicio, fim))
+        else:
+            janelas.append([janela_inicio, janela_fim, [(inicio, fim)]])
+    
+    partes = []
+    for janela_inicio, janela_fim, ocorrencias in janelas:
+        pedacos = ['…' if janela_inicio > 0 else '']
+        posicao = janela_inicio
+        for inicio, fim in ocorrencias:
+            inicio = max(inicio, posicao)
+            if fim <= inicio:
+                continue
+            pedacos.append(html.escape(texto[posicao:inicio]))
+            pedacos.append(f"<mark>{html.escape(texto[inicio:fim])}</mark>")
+            posicao = fim
+        pedacos.append(html.escape(texto[posicao:janela_fim]))
+        pedacos.append('…' if janela_fim < len(texto) else '')
+        partes.append(''.join(pedacos))
+    return ' '.join(partes)
+
+def exibir_resultados(termo, docs, ocorrencias, url_zip=None):
+    """
+    Mostra os resultados da busca em páginas; trechos, links e botões são
+    montados só para as notas da página atual. Do índice são copiados, com a
+    trava de leitura, só os dados dos arquivos e os trechos da página: a
+    montagem dos links e botões acontece depois de liberá-la, para não
+    atrasar a indexação (e, com ela, as outras sessões). Com url_zip, o ZIP
+    é baixado da API, que o envia em blocos
+    """
+    st.header("📋 Resultados")
+    if len(docs) == 0:
+        if termo:
+            st.warning(f"Nenhuma nota fiscal encontrada com o produto '{termo}'")
+        else:
+            st.warning("Nenhuma nota fiscal encontrada com os filtros informados")
+        return
+    
+    st.success(f"Encontrado em {len(docs)} nota(s) fiscal(is)")
+    armazem = obter_indice_compartilhado().armazem if st.session_state.get('origem_indice') == 'compartilhado' else None
+    obter_arquivo = abridor_de_arquivos(armazem)
+    # Os botões do ZIP ficam acima da paginação, mas são montados depois
+    area_zip = st.container()
+    
+    pagina_col1, pagina_col2, _ = st.columns([1, 1, 3])
+    with pagina_col1:
+        tamanho_pagina = st.selectbox("Resultados por página", TAMANHOS_PAGINA, key="tamanho_pagina")
+    total_paginas = max(1, -(-len(docs) // tamanho_pagina))
+    if st.session_state.get('pagina_resultados', 1) > total_paginas:
+        st.session_state.pagina_resultados = total_paginas
+    with pagina_col2:
+        pagina = st.number_input(
+            f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, step=1, key="pagina_resultados"
+        )
+    
+    inicio_pagina = (pagina - 1) * tamanho_pagina
+    docs_pagina = docs[inicio_pagina:pagina * tamanho_pagina]
+    
+    with indice_da_sessao() as indice_notas:
+        if not isinstance(indice_notas, IndiceNotas):
+            return
+        # O ZIP leva também os arquivos vinculados a cada nota
+        arquivos_por_nota = indice_notas.arquivos_das_notas(docs)
+        trechos_pagina = [montar_trecho(indice_notas.texto(doc), ocorrencias.get(doc, [])) for doc in docs_pagina]
+    
+    partes = [arquivos_por_nota[i:i + NOTAS_POR_ZIP] for i in range(0, len(arquivos_por_nota), NOTAS_POR_ZIP)]
+    nome_zip = f"notas_fiscais_{(termo or 'filtros').replace(' ', '_')}"
+    with area_zip:
+        st.markdown("### 📥 Download dos Resultados")
+        if url_zip:
+            st.link_button("📥 Baixar todas em ZIP", url_zip)
+            partes = []
+        elif len(partes) > 1:
+            st.caption(
+                f"O resultado foi dividido em {len(partes)} arquivos ZIP de até {NOTAS_POR_ZIP} notas: "
+                "o app monta cada ZIP inteiro antes de enviá-lo, e o navegador só o recebe depois. "
+                "Com o índice pré-construído, a API (BUSCA_NF_API_URL) baixa tudo em um só arquivo, em blocos."
+            )
+        for numero, parte in enumerate(partes, start=1):
+            st.download_button(
+                "📥 Baixar todas em ZIP" if len(partes) == 1 else f"📥 Baixar parte {numero} de {len(partes)}",
+                data=gerar_zip_sob_demanda([registro for registros in parte for registro in registros], obter_arquivo),
+                file_name=f"{nome_zip}.zip" if len(partes) == 1 else f"{nome_zip}_parte{numero}.zip",
+                mime='application/zip',
+                key=f"zip_resultados_{numero}",
+                on_click='ignore'
+            )
+    
+    pagina_arquivos = arquivos_por_nota[inicio_pagina:inicio_pagina + len(docs_pagina)]
+    for doc, (row, *copias), trecho in zip(docs_pagina, pagina_arquivos, trechos_pagina):
+        titulo = f"📄 {row['arquivo']} ({row['tipo']})"
+        if copias:
+            titulo += f" + {len(copias)} arquivo(s) vinculado(s)"
+        with st.expander(titulo, expanded=True):
+            col1, col2 = st.columns([3, 1])
             
-            arquivo.seek(0)
-            if tipo == 'PDF':
-                texto = extrair_texto_pdf(arquivo)
-            else:
-                texto = extrair_texto_xml(arquivo.getvalue())
+            with col1:
+                if ocorrencias.get(doc):
+                    st.write(f"Trechos relevantes ({len(ocorrencias[doc])} ocorrência(s)):")
+                else:
+                    st.write("Início do documento:")
+                st.markdown(f'<div>{trecho}</div>', unsafe_allow_html=True)
             
-            if texto:
-                index.append({
-                    'arquivo': arquivo.name,
-                    'tipo': tipo,
-                    'conteudo': texto
-                })
-            else:
-                st.warning(f"Nenhum texto extraído de {arquivo.name}")
+            with col2:
+                arquivo_original = obter_arquivo(row)
+                if arquivo_original is not None:
+                    st.markdown(
+                        get_individual_download_link(arquivo_original, row['arquivo']),
+                        unsafe_allow_html=True
+                    )
+                    
+                    # O DANFE só é gerado quando o botão é clicado
+                    if row['arquivo'].lower().endswith('.xml'):
+                        st.download_button(
+                            "📄 Baixar DANFE",
+                            data=gerar_danfe_sob_demanda(arquivo_original),
+                            file_name=row['arquivo'].rsplit('.', 1)[0] + '_danfe.pdf',
+                            mime='application/pdf',
+                            key=f"danfe_{doc}",
+                            on_click='ignore'
+                        )
                 
-        except Exception as e:
-            st.warning(f"Erro ao processar {arquivo.name}: {str(e)}")
-            continue
-    
-    if not index:
-        st.error("Nenhum arquivo foi processado com sucesso.")
-        return pd.DataFrame(columns=['arquivo', 'tipo', 'conteudo'])
-    
-    return pd.DataFrame(index)
+                # Cópias e o DANFE em PDF da mesma nota, agrupados no resultado
+                for copia in copias:
+                    dados_copia = obter_arquivo(copia)
+                    st.caption(f"🔗 {copia['arquivo']}")
+                    if dados_copia is not None:
+                        st.markdown(
+                            get_individual_download_link(dados_copia, copia['arquivo']),
+                            unsafe_allow_html=True
+                        )
+
+def exibir_compras(docs=None):
+    """
+    Mostra os totais de compra (notas, quantidade, valor e preço médio)
+    agrupados pelas dimensões escolhidas, das notas encontradas na busca ou
+    de todas, a partir dos agregados mantidos no índice. Só o resumo é
+    calculado com a trava de leitura
+    """
+    with st.expander("📊 Resumo das compras (NFe em XML)", expanded=False):
+        col1, col2 = st.columns(2)
+        with col1:
+            por = st.multiselect(
+                "Agrupar por", list(ROTULOS_DIMENSOES), default=['produto', 'emitente'],
+                format_func=ROTULOS_DIMENSOES.get, key="compras_por"
+            )
+        with col2:
+            produto = st.text_input("Produto (código ou parte da descrição)", key="compras_produto")
+        
+        if docs is not None:
+            if not st.toggle("Só as notas encontradas na busca", value=True, key="compras_encontradas"):
+                docs = None
+        with indice_da_sessao() as indice_notas:
+            if not isinstance(indice_notas, IndiceNotas):
+                return
+            if docs is None and indice_notas.ocultos:
+                docs = indice_notas.visiveis(np.arange(len(indice_notas)))
+            resumo = indice_notas.agregados.resumir(por, docs=docs, produto=produto)
+        
+        if resumo.empty or resumo['itens'].sum() == 0:
+            st.info("Nenhum item de NFe para resumir")
+            return
+        
+        st.dataframe(
+            resumo,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                'cProd': 'Código',
+                'xProd': 'Descrição',
+                'cnpj_emitente': 'Fornecedor (CNPJ)',
+                'mes': 'Mês',
+                'notas': 'Notas',
+                'itens': 'Itens',
+                'quantidade': st.column_config.NumberColumn('Quantidade', format='%.2f'),
+                'valor': st.column_config.NumberColumn('Valor (R$)', format='%.2f'),
+                'preco_medio': st.column_config.NumberColumn('Preço médio (R$)', format='%.4f'),
+            }
+        )
+        st.download_button(
+            "Exportar CSV",
+            data=resumo.to_csv(index=False),
+            file_name="resumo_compras.csv",
+            mime='text/csv',
+            key="compras_csv"
+        )
 
 def main():
     st.title("Hiper Materiais - 🔍 Busca em Notas Fiscais")
@@ -376,10 +659,11 @@ def main():
             **Selecione os arquivos de uma das formas:**
             1. Arraste uma pasta inteira para a área de upload
             2. Selecione múltiplos arquivos
+            3. Envie arquivos ZIP com as notas (as pastas internas são mantidas)
             
             **Após selecionar:**
             1. Aguarde o processamento dos arquivos
-            2. Digite o nome do produto que deseja buscar
+            2. Digite o nome do produto que deseja buscar (combine termos com AND, OR, NOT e parênteses, ou separe uma lista de códigos por vírgulas)
             3. Clique em 'Buscar'
             4. Use os botões de download conforme necessário:
                - Download individual de cada nota
@@ -469,17 +753,22 @@ def main():
 
     arquivos = st.file_uploader(
         "Arraste uma pasta ou selecione os arquivos",
-        type=['pdf', 'xml'],
+        type=['pdf', 'xml', 'zip'],
         accept_multiple_files=True,
         key=f"uploader_{st.session_state.key}",
-        help="Você pode arrastar uma pasta inteira ou selecionar arquivos individuais"
+        help="Você pode arrastar uma pasta inteira, selecionar arquivos individuais ou enviar arquivos ZIP com as notas"
     )
     
+    indice_preconstruido = obter_indice_preconstruido()
+    
     if arquivos:
+        # Os ZIPs são substituídos pelos arquivos que contêm
+        entradas = expandir_arquivos(arquivos)
+        
         # Mostra estatísticas dos arquivos selecionados
-        pdfs = sum(1 for f in arquivos if f.name.lower().endswith('.pdf'))
-        xmls = sum(1 for f in arquivos if f.name.lower().endswith('.xml'))
-        st.success(f"✅ Selecionado(s): {len(arquivos)} arquivo(s)")
+        pdfs = sum(1 for nome, *_ in entradas if nome.lower().endswith('.pdf'))
+        xmls = sum(1 for nome, *_ in entradas if nome.lower().endswith('.xml'))
+        st.success(f"✅ Selecionado(s): {len(entradas)} arquivo(s)")
         
         col1, col2 = st.columns(2)
         with col1:
@@ -490,11 +779,11 @@ def main():
         # Lista os arquivos selecionados
         with st.expander("📄 Arquivos selecionados", expanded=False):
             arquivos_por_pasta = {}
-            for arquivo in arquivos:
-                pasta = os.path.dirname(arquivo.name)
+            for nome, *_ in entradas:
+                pasta = os.path.dirname(nome)
                 if pasta not in arquivos_por_pasta:
                     arquivos_por_pasta[pasta] = []
-                arquivos_por_pasta[pasta].append(arquivo.name)
+                arquivos_por_pasta[pasta].append(nome)
             
             for pasta, arquivos_pasta in arquivos_por_pasta.items():
                 if pasta:
@@ -504,18 +793,47 @@ def main():
                     tipo = 'PDF' if nome.lower().endswith('.pdf') else 'XML'
                     st.write(f"{'   ' if pasta else ''}• {nome} ({tipo})")
         
-        # Processamento dos arquivos
-        if 'df_index' not in st.session_state or st.button("🔄 Reprocessar arquivos"):
+        # Processamento dos arquivos: só os ainda não enviados por esta
+        # sessão; reprocessar envia todos de novo (os que já estão no índice
+        # compartilhado são ignorados e os que falharam são tentados de novo)
+        usar_indice('compartilhado')
+        enviados = st.session_state.get('arquivos_enviados', set())
+        novas = [entrada for entrada in entradas if entrada[0] not in enviados]
+        if novas or st.button("🔄 Reprocessar arquivos"):
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            with st.spinner('Processando arquivos...'):
-                st.session_state.df_index = processar_arquivos(arquivos, progress_bar, status_text)
+            with st.spinner('Gravando arquivos...'):
+                processar_arquivos(novas or entradas, progress_bar, status_text)
+                st.session_state.arquivos_enviados = enviados | {nome for nome, *_ in entradas}
             
             progress_bar.empty()
             status_text.empty()
-            
-            st.success('✅ Processamento concluído!')
+        
+        # Enquanto a indexação anda, o andamento é atualizado sem rodar a página inteira
+        indexacao = st.session_state.get('indexacao')
+        em_andamento = indexacao is not None and not obter_indice_compartilhado().concluida(indexacao)
+        st.fragment(acompanhar_indexacao, run_every=INTERVALO_ANDAMENTO if em_andamento else None)()
+    
+    elif indice_preconstruido is not None:
+        # Sem arquivos carregados, a busca usa o índice gerado pelo indexador
+        usar_indice('preconstruido')
+        st.session_state.pop('indexacao', None)
+        st.info(f"📚 Usando o índice pré-construído com {len(indice_preconstruido)} arquivo(s)")
+        exibir_memoria(indice_preconstruido)
+    
+    else:
+        # Sem arquivos nesta sessão, busca nos carregados pelas outras
+        compartilhado = obter_indice_compartilhado()
+        with compartilhado.leitura():
+            total_compartilhado = len(compartilhado.indice)
+        if total_compartilhado:
+            usar_indice('compartilhado')
+            st.info(f"📚 Usando o índice compartilhado com {total_compartilhado} nota(s) carregada(s) em outras sessões")
+        else:
+            st.session_state.pop('origem_indice', None)
+    
+    if st.session_state.get('origem_indice') is not None:
 
 # Interface de busca
         st.header("🔎 Buscar Produtos")
@@ -545,94 +863,91 @@ def main():
         with search_col1:
             termo_busca = st.text_input(
                 "Digite o nome do produto",
-                placeholder="Ex: Fechadura, Parafuso, etc.",
+                placeholder="Ex: Fechadura AND (inox OR latão) NOT tetra",
                 label_visibility="collapsed",
+                help='Use AND, OR e NOT (em maiúsculas) e parênteses; "aspas" para a frase exata; '
+                     'vírgula seguida de espaço para buscar qualquer item de uma lista (ex.: 7318831, 7318503)',
                 key="search_input",
                 on_change=lambda: st.session_state.update({'search_triggered': True})
             )
         
         with search_col2:
             buscar = st.button("Buscar", use_container_width=True)
+        
+        busca_aproximada = st.toggle(
+            "Busca aproximada",
+            key="busca_aproximada",
+            help="Encontra também palavras parecidas (erros de OCR, digitação e abreviações como 'PARAF SEXT') e ordena pela semelhança"
+        )
+        
+        # Filtros pelos dados estruturados das NFes em XML
+        with st.expander("🎛️ Filtros (NFe em XML)", expanded=False):
+            filtro_col1, filtro_col2, filtro_col3 = st.columns(3)
+            with filtro_col1:
+                filtro_emitente = st.text_input("CNPJ do emitente", key="filtro_emitente")
+                filtro_destinatario = st.text_input("CNPJ do destinatário", key="filtro_destinatario")
+            with filtro_col2:
+                filtro_ncm = st.text_input("NCM", placeholder="Ex: 7318* para buscar pelo início", key="filtro_ncm")
+                filtro_chave = st.text_input("Chave de acesso", key="filtro_chave")
+            with filtro_col3:
+                periodo = st.date_input("Período de emissão", value=(), format="DD/MM/YYYY", key="filtro_periodo")
+                valor_col1, valor_col2 = st.columns(2)
+                with valor_col1:
+                    valor_minimo = st.number_input("Valor NF mín. (R$)", min_value=0.0, value=None, key="filtro_valor_minimo")
+                with valor_col2:
+                    valor_maximo = st.number_input("Valor NF máx. (R$)", min_value=0.0, value=None, key="filtro_valor_maximo")
+        
+        filtros = {
+            'cnpj_emitente': filtro_emitente,
+            'cnpj_destinatario': filtro_destinatario,
+            'ncm': filtro_ncm,
+            'chave': filtro_chave,
+            'data_inicio': periodo[0] if len(periodo) > 0 else None,
+            'data_fim': periodo[1] if len(periodo) > 1 else None,
+            'valor_minimo': valor_minimo,
+            'valor_maximo': valor_maximo,
+        }
 
         # Realizar busca
         if (termo_busca and st.session_state.get('search_triggered', False)) or buscar:
             st.session_state.search_triggered = False  # Reset do trigger
+            st.session_state.pop('resultado_busca', None)
             try:
-                if 'df_index' not in st.session_state:
-                    st.error("Por favor, faça o upload dos arquivos primeiro.")
-                    return
-                
-                if 'conteudo' not in st.session_state.df_index.columns:
-                    st.error("Erro na estrutura dos dados. Tente reprocessar os arquivos.")
-                    return
-                
-                # Normaliza o termo de busca se parecer um CNPJ
-                termo_busca_normalizado = ''.join(filter(str.isdigit, termo_busca))
-
-                st.session_state.df_index['conteudo'] = st.session_state.df_index['conteudo'].fillna('')
-
-                # Busca modificada para diferentes tipos de conteúdo
-                if termo_busca_normalizado and len(termo_busca_normalizado) > 6:  # Se parece ser um CNPJ ou NCM
-                    padrao_busca = f"({termo_busca}|{termo_busca_normalizado})"
-                    mascara = st.session_state.df_index['conteudo'].str.lower().str.contains(
-                        padrao_busca,
-                        regex=True,
-                        na=False
-                    )
-                else:  # Busca normal por texto
-                    mascara = st.session_state.df_index['conteudo'].str.lower().str.contains(
-                        termo_busca.lower(),
-                        regex=False,
-                        na=False
-                    )
-                
-                resultados = st.session_state.df_index[mascara]
-                
-                st.header("📋 Resultados")
-                if len(resultados) == 0:
-                    st.warning(f"Nenhuma nota fiscal encontrada com o produto '{termo_busca}'")
-                else:
-                    st.success(f"Encontrado em {len(resultados)} nota(s) fiscal(is)")
+                # Buscas de várias sessões leem o índice ao mesmo tempo; a
+                # escrita de um segmento novo espera a busca terminar
+                with indice_da_sessao() as indice_notas:
+                    if not isinstance(indice_notas, IndiceNotas):
+                        st.error("Erro na estrutura dos dados. Tente reprocessar os arquivos.")
+                        return
                     
-                    arquivos_encontrados = resultados['arquivo'].tolist()
-                    zip_buffer = criar_zip_resultado(arquivos_encontrados, arquivos)
-                    
-                    st.markdown("### 📥 Download dos Resultados")
-                    st.markdown(
-                        get_download_link(
-                            zip_buffer,
-                            f"notas_fiscais_{termo_busca.replace(' ', '_')}.zip"
-                        ),
-                        unsafe_allow_html=True
+                    encontrados = indice_notas.pesquisar(
+                        termo_busca, aproximada=busca_aproximada, limite_aproximada=LIMITE_BUSCA_APROXIMADA, **filtros
                     )
+                    if encontrados is None:
+                        st.warning("Digite um termo de busca ou informe algum filtro.")
+                        return
+                    docs, ocorrencias = encontrados
                     
-                    for idx, row in resultados.iterrows():
-                        with st.expander(f"📄 {row['arquivo']} ({row['tipo']})", expanded=True):
-                            col1, col2 = st.columns([3, 1])
-                            
-                            with col1:
-                                st.write("Trechos relevantes:")
-                                texto = row['conteudo'].lower()
-                                posicao = texto.find(termo_busca.lower())
-                                inicio = max(0, posicao - 100)
-                                fim = min(len(texto), posicao + 100)
-                                contexto = "..." + texto[inicio:fim] + "..."
-                                st.markdown(f"*{contexto}*")
-                            
-                            with col2:
-                                arquivo_original = next(
-                                    (arq for arq in arquivos if arq.name == row['arquivo']),
-                                    None
-                                )
-                                if arquivo_original:
-                                    st.markdown(
-                                        get_individual_download_link(arquivo_original, row['arquivo']),
-                                        unsafe_allow_html=True
-                                    )
+                    # Guardado na sessão para que a troca de página não refaça a busca
+                    st.session_state.resultado_busca = {
+                        'termo': termo_busca, 'docs': docs, 'ocorrencias': ocorrencias,
+                        'url_zip': url_zip_api(termo_busca, busca_aproximada, filtros),
+                    }
+                    st.session_state.pagina_resultados = 1
             
+            except ValueError as e:
+                # Erro na sintaxe da consulta
+                st.error(str(e))
             except Exception as e:
                 st.error(f"Erro durante a busca: {str(e)}")
                 st.info("Tente reprocessar os arquivos clicando em 'Reprocessar arquivos'")
+        
+        # Cada parte copia o que precisa do índice com a trava de leitura e
+        # monta a página depois de liberá-la
+        resultado_busca = st.session_state.get('resultado_busca')
+        exibir_compras(resultado_busca['docs'] if resultado_busca is not None else None)
+        if resultado_busca is not None:
+            exibir_resultados(**resultado_busca)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,161 @@
+import hashlib
+import mmap
+import os
+import posixpath
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+# Diretório e tamanho máximo (em MB) dos arquivos guardados em disco
+DIRETORIO_ARMAZEM = os.environ.get(
+    'BUSCA_NF_ARMAZEM_DIR',
+    os.path.join(Path.home(), '.cache', 'busca-notas-fiscais', 'arquivos')
+)
+TAMANHO_MAXIMO_ARMAZEM_MB = int(os.environ.get('BUSCA_NF_ARMAZEM_MB', 20480))
+
+# Arquivos gravados há menos que isto (em segundos) não são removidos
+INTERVALO_RECENTES = 3600
+
+# Tamanho dos blocos copiados ao gravar um arquivo
+TAMANHO_BLOCO = 1024 * 1024
+
+EXTENSOES_NOTAS = ('.pdf', '.xml')
+
+
+def mapear_arquivo(caminho):
+    """
+    Retorna o conteúdo do arquivo mapeado em memória (somente leitura), sem
+    copiá-lo; o sistema operacional carrega as páginas conforme são lidas
+    """
+    with open(caminho, 'rb') as arquivo:
+        if os.fstat(arquivo.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def membros_zip(fonte, prefixo=''):
+    """
+    Lista os PDFs e XMLs de um arquivo ZIP sem extraí-los: só o diretório
+    central é lido, e o ZIP é fechado em seguida. Retorna [(caminho,
+    ZipInfo do membro)], com as subpastas do ZIP preservadas no caminho; o
+    membro é lido depois com zip_file.open(info)
+    """
+    membros = []
+    with zipfile.ZipFile(fonte) as zip_file:
+        for info in zip_file.infolist():
+            nome = info.filename.replace('\\', '/').lstrip('/')
+            if info.is_dir() or nome.startswith('__MACOSX/') or not nome.lower().endswith(EXTENSOES_NOTAS):
+                continue
+            if prefixo:
+                nome = posixpath.join(prefixo, nome)
+            membros.append((nome, info))
+    return membros
+
+
+class ArmazemDocumentos:
+    """
+    Guarda os arquivos carregados em um diretório endereçado pelo hash do
+    conteúdo; os bytes são lidos do disco quando pedidos. O diretório é
+    compartilhado entre as sessões, de modo que o mesmo arquivo é gravado
+    uma única vez. Não há mapa de nomes: arquivos diferentes com o mesmo
+    nome, enviados por sessões diferentes, são encontrados pelo hash que o
+    índice guarda de cada documento
+    """
+
+    def __init__(self, diretorio=DIRETORIO_ARMAZEM, tamanho_maximo_mb=TAMANHO_MAXIMO_ARMAZEM_MB):
+        self.diretorio = Path(diretorio)
+        self.tamanho_maximo = tamanho_maximo_mb * 1024 * 1024
+
+    def _caminho_hash(self, chave):
+        return self.diretorio / chave[:2] / chave
+
+    def __contains__(self, chave):
+        return bool(chave) and self._caminho_hash(chave).exists()
+
+    def guardar(self, fonte):
+        """
+        Copia o arquivo (bytes ou objeto com read()) para o diretório em
+        blocos, calculando o hash no caminho. Retorna o hash do conteúdo
+        """
+        if isinstance(fonte, (bytes, bytearray, memoryview)):
+            blocos = [fonte]
+        else:
+            fonte.seek(0)
+            blocos = iter(lambda: fonte.read(TAMANHO_BLOCO), b'')
+
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        sha = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.diretorio, delete=False) as tmp:
+            try:
+                for bloco in blocos:
+                    sha.update(bloco)
+                    tmp.write(bloco)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+
+        chave = sha.hexdigest()
+        destino = self._caminho_hash(chave)
+        if destino.exists():
+            os.unlink(tmp.name)
+            # Atualiza o horário de modificação para a remoção por uso
+            try:
+                os.utime(destino)
+            except OSError:
+                pass
+        else:
+            destino.parent.mkdir(exist_ok=True)
+            os.replace(tmp.name, destino)
+        return chave
+
+    def caminho(self, chave):
+        """
+        Retorna o caminho em disco do arquivo guardado com o hash, ou None
+        """
+        return self._caminho_hash(chave) if chave in self else None
+
+    def ler(self, chave):
+        """
+        Retorna o conteúdo do arquivo guardado com o hash mapeado em memória,
+        ou None se ele não estiver guardado
+        """
+        caminho = self.caminho(chave)
+        if caminho is None:
+            return None
+        try:
+            # Atualiza o horário de modificação para a remoção por uso
+            os.utime(caminho)
+            return mapear_arquivo(caminho)
+        except OSError:
+            return None
+
+    def limpar(self, protegidos=(), recentes_s=INTERVALO_RECENTES):
+        """
+        Remove os arquivos menos usados até o diretório voltar ao tamanho
+        máximo. Ficam os de hash em protegidos (os que o índice usa) e os
+        gravados há menos de recentes_s segundos, que podem ser de um envio
+        ainda não entregue à indexação
+        """
+        protegidos = set(protegidos)
+        limite_recentes = time.time() - recentes_s
+        entradas = []
+        total = 0
+        for caminho in self.diretorio.glob('*/*'):
+            try:
+                info = caminho.stat()
+            except OSError:
+                continue
+            total += info.st_size
+            if caminho.name not in protegidos and info.st_mtime < limite_recentes:
+                entradas.append((info.st_mtime, info.st_size, caminho))
+
+        for _, tamanho, caminho in sorted(entradas):
+            if total <= self.tamanho_maximo:
+                break
+            try:
+                caminho.unlink()
+                total -= tamanho
+            except OSError:
+                pass
@@ -0,0 +1,286 @@
+"""
+Gera um corpus sintético de notas fiscais para os benchmarks: XMLs de NFe
+(nfeProc, versão 4.00) e PDFs no estilo DANFE, digitais (com camada de
+texto) e escaneados (só imagem).
+
+Uso:
+    python -m benchmarks.corpus PASTA [--notas 1000] [--itens-min 1] [--itens-max 30]
+                                      [--pdfs-digitais 50] [--pdfs-escaneados 20] [--semente 42]
+"""
+import argparse
+import io
+import random
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Catálogo de produtos: (descrição, NCM, unidade, faixa de preço unitário)
+PRODUTOS = [
+    ('Fechadura externa inox lingueta', '83014000', 'UN', (45, 320)),
+    ('Fechadura tetra latão cromado', '83014000', 'UN', (60, 410)),
+    ('Parafuso sextavado zincado 1/4 x 2', '73181500', 'CT', (8, 45)),
+    ('PARAF SEXT INOX M8 X 30', '73181500', 'CT', (12, 70)),
+    ('Parafuso phillips cabeça chata 4,2 x 32', '73181200', 'CT', (5, 30)),
+    ('Porca sextavada zincada M10', '73181600', 'CT', (4, 25)),
+    ('Arruela lisa galvanizada 3/8', '73182200', 'CT', (3, 18)),
+    ('Bucha de nylon S8', '39269090', 'CT', (6, 22)),
+    ('Dobradiça latão 3 1/2 polegadas', '83021000', 'UN', (9, 55)),
+    ('Cadeado latão 40 mm', '83011000', 'UN', (18, 90)),
+    ('Tinta acrílica fosca branco neve 18L', '32091010', 'GL', (180, 520)),
+    ('Massa corrida PVA 25kg', '32141010', 'BD', (45, 130)),
+    ('Cimento CP II 50kg', '25232910', 'SC', (28, 45)),
+    ('Argamassa colante AC-II 20kg', '32149000', 'SC', (18, 40)),
+    ('Tubo PVC soldável 25mm 6m', '39172300', 'BR', (15, 48)),
+    ('Joelho PVC 90 graus 25mm', '39174000', 'UN', (1, 6)),
+    ('Registro de gaveta bruto 3/4', '84818095', 'UN', (35, 140)),
+    ('Torneira de parede cromada 1/2', '84818019', 'UN', (40, 260)),
+    ('Fio flexível 2,5mm rolo 100m', '85444900', 'RL', (160, 380)),
+    ('Disjuntor monopolar 20A', '85362000', 'UN', (12, 45)),
+    ('Tomada 2P+T 10A branca', '85366990', 'UN', (7, 28)),
+    ('Lâmpada LED bulbo 9W', '85395200', 'UN', (6, 25)),
+    ('Broca aço rápido 8mm', '82075011', 'UN', (9, 42)),
+    ('Disco de corte inox 115mm', '68042211', 'UN', (3, 15)),
+    ('Trena emborrachada 5m', '90178010', 'UN', (14, 60)),
+]
+
+RAZOES = ['Distribuidora', 'Comércio de Ferragens', 'Materiais de Construção', 'Indústria Metalúrgica',
+          'Atacadista', 'Tintas e Vernizes', 'Elétrica', 'Hidráulica']
+SOBRENOMES = ['Silva', 'Souza', 'Oliveira', 'Pereira', 'Lima', 'Costa', 'Almeida', 'Ribeiro', 'Martins',
+              'Araújo', 'Barbosa', 'Cardoso', 'Teixeira', 'Moreira']
+
+DESTINATARIO = ('98765432000110', 'Hiper Materiais Ltda')
+
+
+def _digito_verificador(base, pesos):
+    soma = sum(int(d) * p for d, p in zip(base, pesos))
+    resto = soma % 11
+    return '0' if resto < 2 else str(11 - resto)
+
+
+def gerar_cnpj(rng):
+    """
+    Gera um CNPJ com dígitos verificadores válidos
+    """
+    base = ''.join(str(rng.randint(0, 9)) for _ in range(8)) + '0001'
+    base += _digito_verificador(base, [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+    base += _digito_verificador(base, [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+    return base
+
+
+def gerar_chave(rng, cnpj, emissao, numero):
+    """
+    Gera a chave de acesso de 44 dígitos, com dígito verificador módulo 11
+    """
+    base = f"35{emissao:%y%m}{cnpj}55001{numero:09d}1{rng.randint(0, 99999999):08d}"
+    soma = sum(int(d) * p for d, p in zip(reversed(base), [2, 3, 4, 5, 6, 7, 8, 9] * 6))
+    resto = soma % 11
+    return base + ('0' if resto < 2 else str(11 - resto))
+
+
+def gerar_fornecedores(rng, quantidade=200):
+    return [
+        (gerar_cnpj(rng), f"{rng.choice(RAZOES)} {rng.choice(SOBRENOMES)} Ltda")
+        for _ in range(quantidade)
+    ]
+
+
+def gerar_nota(rng, numero, fornecedores, itens_min, itens_max, inicio=datetime(2024, 1, 1)):
+    """
+    Gera os dados de uma nota fiscal sintética
+    """
+    cnpj, nome = rng.choice(fornecedores)
+    emissao = inicio + timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+    itens = []
+    for _ in range(rng.randint(itens_min, itens_max)):
+        descricao, ncm, unidade, (minimo, maximo) = rng.choice(PRODUTOS)
+        quantidade = rng.randint(1, 200)
+        unitario = round(rng.uniform(minimo, maximo), 2)
+        itens.append({
+            'cProd': f"{ncm[:4]}{rng.randint(100, 999)}",
+            'xProd': descricao,
+            'NCM': ncm,
+            'uCom': unidade,
+            'qCom': quantidade,
+            'vUnCom': unitario,
+            'vProd': round(quantidade * unitario, 2),
+        })
+    return {
+        'numero': numero,
+        'chave': gerar_chave(rng, cnpj, emissao, numero),
+        'emissao': emissao,
+        'cnpj_emitente': cnpj,
+        'emitente': nome,
+        'itens': itens,
+        'vNF': round(sum(item['vProd'] for item in itens), 2),
+    }
+
+
+def nota_para_xml(nota):
+    """
+    Serializa a nota no formato nfeProc da NFe 4.00
+    """
+    dets = []
+    for n, item in enumerate(nota['itens'], start=1):
+        dets.append(
+            f'<det nItem="{n}"><prod><cProd>{item["cProd"]}</cProd><cEAN>SEM GTIN</cEAN>'
+            f'<xProd>{escape(item["xProd"])}</xProd><NCM>{item["NCM"]}</NCM><CFOP>5102</CFOP>'
+            f'<uCom>{item["uCom"]}</uCom><qCom>{item["qCom"]:.4f}</qCom><vUnCom>{item["vUnCom"]:.10f}</vUnCom>'
+            f'<vProd>{item["vProd"]:.2f}</vProd></prod></det>'
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">'
+        f'<NFe><infNFe Id="NFe{nota["chave"]}" versao="4.00">'
+        f'<ide><cUF>35</cUF><natOp>VENDA</natOp><mod>55</mod><serie>1</serie><nNF>{nota["numero"]}</nNF>'
+        f'<dhEmi>{nota["emissao"]:%Y-%m-%dT%H:%M:%S}-03:00</dhEmi></ide>'
+        f'<emit><CNPJ>{nota["cnpj_emitente"]}</CNPJ><xNome>{escape(nota["emitente"])}</xNome></emit>'
+        f'<dest><CNPJ>{DESTINATARIO[0]}</CNPJ><xNome>{DESTINATARIO[1]}</xNome></dest>'
+        + ''.join(dets) +
+        f'<total><ICMSTot><vProd>{nota["vNF"]:.2f}</vProd><vNF>{nota["vNF"]:.2f}</vNF></ICMSTot></total>'
+        '</infNFe></NFe>'
+        f'<protNFe versao="4.00"><infProt><chNFe>{nota["chave"]}</chNFe></infProt></protNFe>'
+        '</nfeProc>'
+    ).encode('utf-8')
+
+
+def linhas_danfe(nota):
+    """
+    Linhas de texto de uma página no estilo DANFE
+    """
+    cnpj = nota['cnpj_emitente']
+    linhas = [
+        'DANFE - DOCUMENTO AUXILIAR DA NOTA FISCAL ELETRÔNICA',
+        'IDENTIFICAÇÃO DO EMITENTE',
+        nota['emitente'],
+        f"CNPJ: {cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}",
+        'CHAVE DE ACESSO',
+        ' '.join(nota['chave'][i:i + 4] for i in range(0, 44, 4)),
+        'DESTINATÁRIO/REMETENTE',
+        f"{DESTINATARIO[1]}  CNPJ: 98.765.432/0001-10  EMISSÃO: {nota['emissao']:%d/%m/%Y}",
+        'CÁLCULO DO IMPOSTO',
+        f"VALOR TOTAL DA NOTA: {nota['vNF']:.2f}",
+        'DADOS DO PRODUTO / SERVIÇOS',
+    ]
+    for item in nota['itens'][:40]:
+        linhas.append(
+            f"{item['cProd']}  {item['xProd']}  {item['NCM']}  {item['uCom']}  "
+            f"{item['qCom']}  {item['vUnCom']:.2f}  {item['vProd']:.2f}"
+        )
+    linhas.append('DADOS ADICIONAIS')
+    return linhas
+
+
+def _texto_pdf(texto):
+    dados = texto.encode('cp1252', errors='replace')
+    return dados.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def pdf_digital(linhas):
+    """
+    Monta um PDF de uma página com camada de texto (Helvetica, WinAnsi)
+    """
+    conteudo = [b'BT /F1 9 Tf 11 TL 40 800 Td']
+    for linha in linhas:
+        conteudo.append(b'(' + _texto_pdf(linha) + b") '")
+    conteudo.append(b'ET')
+    stream = b'\n'.join(conteudo)
+
+    objetos = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+        b'/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'\nendstream',
+    ]
+    saida = bytearray(b'%PDF-1.4\n')
+    posicoes = []
+    for n, objeto in enumerate(objetos, start=1):
+        posicoes.append(len(saida))
+        saida += f'{n} 0 obj\n'.encode() + objeto + b'\nendobj\n'
+    inicio_xref = len(saida)
+    saida += f'xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n'.encode()
+    for posicao in posicoes:
+        saida += f'{posicao:010d} 00000 n \n'.encode()
+    saida += f'trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n'.encode()
+    return bytes(saida)
+
+
+def pdf_escaneado(linhas, rng, dpi=150):
+    """
+    Monta um PDF de uma página só com imagem, imitando um DANFE escaneado
+    (leve rotação e ruído)
+    """
+    largura, altura = int(8.27 * dpi), int(11.69 * dpi)
+    imagem = Image.new('L', (largura, altura), 255)
+    desenho = ImageDraw.Draw(imagem)
+    try:
+        fonte = ImageFont.load_default(size=dpi // 7)
+    except TypeError:
+        fonte = ImageFont.load_default()
+    y = dpi // 2
+    for linha in linhas:
+        desenho.text((dpi // 2, y), linha, fill=0, font=fonte)
+        y += dpi // 5
+    imagem = imagem.rotate(rng.uniform(-0.8, 0.8), fillcolor=255)
+    ruido = Image.effect_noise(imagem.size, 12)
+    imagem = Image.blend(imagem, ruido, 0.08)
+
+    saida = io.BytesIO()
+    imagem.save(saida, 'PDF', resolution=dpi)
+    return saida.getvalue()
+
+
+def gerar_corpus(pasta, notas=1000, itens_min=1, itens_max=30, pdfs_digitais=50, pdfs_escaneados=20,
+                 semente=42, saida=print):
+    """
+    Grava o corpus na pasta: xml/NNNN/*.xml, pdf_digital/*.pdf e
+    pdf_escaneado/*.pdf (com o texto esperado em um .txt ao lado)
+    """
+    rng = random.Random(semente)
+    pasta = Path(pasta)
+    fornecedores = gerar_fornecedores(rng)
+
+    for numero in range(1, notas + 1):
+        nota = gerar_nota(rng, numero, fornecedores, itens_min, itens_max)
+        destino = pasta / 'xml' / f"{numero // 1000:04d}"
+        destino.mkdir(parents=True, exist_ok=True)
+        (destino / f"{nota['chave']}-nfe.xml").write_bytes(nota_para_xml(nota))
+
+        if numero <= pdfs_digitais:
+            (pasta / 'pdf_digital').mkdir(parents=True, exist_ok=True)
+            (pasta / 'pdf_digital' / f"{nota['chave']}.pdf").write_bytes(pdf_digital(linhas_danfe(nota)))
+        if pdfs_digitais < numero <= pdfs_digitais + pdfs_escaneados:
+            (pasta / 'pdf_escaneado').mkdir(parents=True, exist_ok=True)
+            linhas = linhas_danfe(nota)
+            (pasta / 'pdf_escaneado' / f"{nota['chave']}.pdf").write_bytes(pdf_escaneado(linhas, rng))
+            (pasta / 'pdf_escaneado' / f"{nota['chave']}.txt").write_text("\n".join(linhas), encoding='utf-8')
+
+        if numero % 10000 == 0:
+            saida(f"{numero} de {notas} nota(s) gerada(s)")
+
+    saida(f"Corpus gravado em {pasta}: {notas} XML(s), {min(pdfs_digitais, notas)} PDF(s) digitais, "
+          f"{max(0, min(pdfs_escaneados, notas - pdfs_digitais))} PDF(s) escaneados")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pasta', help='pasta de destino do corpus')
+    parser.add_argument('--notas', type=int, default=1000)
+    parser.add_argument('--itens-min', type=int, default=1)
+    parser.add_argument('--itens-max', type=int, default=30)
+    parser.add_argument('--pdfs-digitais', type=int, default=50)
+    parser.add_argument('--pdfs-escaneados', type=int, default=20)
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    gerar_corpus(args.pasta, args.notas, args.itens_min, args.itens_max,
+                 args.pdfs_digitais, args.pdfs_escaneados, args.semente)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
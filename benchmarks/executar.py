@@ -0,0 +1,371 @@
+"""
+Mede o desempenho das etapas do sistema sobre um corpus (veja
+benchmarks/corpus.py): extração, indexação, latência das consultas (p50/p99)
+direto no índice e pela API HTTP, geração de DANFE e exportação em ZIP. Os resultados são gravados em JSON
+para comparar versões.
+
+Uso:
+    python -m benchmarks.executar PASTA_CORPUS [--saida resultado.json] [--processos N]
+    python -m benchmarks.executar --comparar base.json novo.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from api import criar_servidor
+from benchmarks.corpus import PRODUTOS
+from consulta import buscar_consulta
+from extracao import extrair_em_paralelo
+from indice_busca import dobrar_texto, tokenizar
+from indice_notas import IndiceNotas
+
+
+def _versao_codigo():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=Path(__file__).resolve().parent, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _entradas(caminhos):
+    """
+    (nome, caminho) de cada arquivo: a extração lê cada um só dentro do
+    processo que vai extraí-lo, como no indexador
+    """
+    return [(caminho.name, caminho) for caminho in caminhos]
+
+
+def _latencias(valores):
+    valores = np.asarray(valores) * 1000
+    if len(valores) == 0:
+        return {'consultas': 0}
+    return {
+        'consultas': int(len(valores)),
+        'p50_ms': float(np.percentile(valores, 50)),
+        'p99_ms': float(np.percentile(valores, 99)),
+        'media_ms': float(valores.mean()),
+    }
+
+
+def medir_extracao(grupos, num_processos):
+    """
+    Extrai cada grupo de arquivos (sem cache) e retorna as medidas e os
+    resultados
+    """
+    medidas = {}
+    resultados = []
+    for nome, entradas in grupos.items():
+        if not entradas:
+            continue
+        inicio = time.perf_counter()
+        erros = 0
+        for _, resultado in extrair_em_paralelo(entradas, num_processos):
+            if resultado['erro']:
+                erros += 1
+            else:
+                resultados.append(resultado)
+        segundos = time.perf_counter() - inicio
+        medidas[nome] = {
+            'arquivos': len(entradas),
+            'erros': erros,
+            'segundos': segundos,
+            'arquivos_por_segundo': len(entradas) / segundos if segundos else None,
+        }
+    return medidas, resultados
+
+
+def consultas_texto(rng, indice, quantidade):
+    """
+    Monta consultas realistas: palavras, prefixos e frases do catálogo e
+    CNPJs presentes no corpus
+    """
+    consultas = []
+    cnpjs = [c for c in indice.filtros.cnpj_emitente] or ['00000000000000']
+    for _ in range(quantidade):
+        descricao = rng.choice(PRODUTOS)[0]
+        palavras = [token for token, _ in tokenizar(dobrar_texto(descricao)) if len(token) > 2]
+        tipo = rng.random()
+        if tipo < 0.4:
+            consultas.append(rng.choice(palavras))
+        elif tipo < 0.6:
+            consultas.append(rng.choice(palavras)[:4])
+        elif tipo < 0.85 and len(palavras) > 1:
+            i = rng.randrange(len(palavras) - 1)
+            consultas.append(f"{palavras[i]} {palavras[i + 1]}")
+        else:
+            consultas.append(rng.choice(cnpjs))
+    return consultas
+
+
+def _com_erro(rng, palavra):
+    """
+    Troca uma letra da palavra, como um erro de OCR
+    """
+    if len(palavra) < 4 or not palavra.isalpha():
+        return palavra
+    i = rng.randrange(1, len(palavra))
+    return palavra[:i] + rng.choice('aeioulrcn') + palavra[i + 1:]
+
+
+def medir_consultas(indice, quantidade, semente):
+    rng = random.Random(semente)
+    tempos_texto = []
+    acertos = 0
+    for consulta in consultas_texto(rng, indice, quantidade):
+        inicio = time.perf_counter()
+        acertos += len(indice.busca.buscar(consulta))
+        tempos_texto.append(time.perf_counter() - inicio)
+
+    # Consultas com um erro de digitação em cada palavra, para a busca aproximada
+    tempos_aproximada = []
+    for consulta in consultas_texto(rng, indice, quantidade):
+        consulta = ' '.join(_com_erro(rng, palavra) for palavra in consulta.split())
+        inicio = time.perf_counter()
+        indice.busca.buscar_aproximado(consulta)
+        tempos_aproximada.append(time.perf_counter() - inicio)
+
+    # Consultas booleanas e listas de códigos de produto
+    codigos = [str(c) for c in indice.df_itens['cProd'].dropna().unique()]
+    booleanas = [
+        'parafuso AND (sextavado OR phillips) NOT zincado',
+        'fechadura OR cadeado OR dobradica',
+        '"parafuso sextavado" NOT inox',
+        ', '.join(rng.sample(codigos, min(40, len(codigos)))) or 'parafuso',
+    ]
+    tempos_booleana = []
+    for _ in range(max(1, quantidade // len(booleanas))):
+        for consulta in booleanas:
+            inicio = time.perf_counter()
+            buscar_consulta(indice.busca, consulta)
+            tempos_booleana.append(time.perf_counter() - inicio)
+
+    filtros = [
+        {'ncm': '7318*'},
+        {'ncm': '83014000', 'valor_minimo': 1000},
+        {'data_inicio': datetime(2024, 7, 1), 'data_fim': datetime(2024, 9, 30)},
+        {'cnpj_destinatario': '98.765.432/0001-10', 'valor_maximo': 500},
+    ]
+    tempos_filtro = []
+    for _ in range(max(1, quantidade // len(filtros))):
+        for filtro in filtros:
+            inicio = time.perf_counter()
+            indice.filtros.filtrar(**filtro)
+            tempos_filtro.append(time.perf_counter() - inicio)
+
+    return {
+        'texto': {**_latencias(tempos_texto), 'documentos_encontrados': acertos},
+        'aproximada': _latencias(tempos_aproximada),
+        'booleana': _latencias(tempos_booleana),
+        'filtros': _latencias(tempos_filtro),
+    }
+
+
+def medir_api(indice, quantidade, semente, clientes=4):
+    """
+    Latência das buscas pela API HTTP (primeira página, com os trechos),
+    com clientes simultâneos, em um servidor local numa porta livre
+    """
+    servidor = criar_servidor(indice, porta=0, registrar=False)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{servidor.server_address[1]}/buscar?q="
+
+    def consultar(consulta):
+        inicio = time.perf_counter()
+        with urllib.request.urlopen(base + urllib.parse.quote(consulta)) as resposta:
+            resposta.read()
+        return time.perf_counter() - inicio
+
+    consultas = consultas_texto(random.Random(semente), indice, quantidade)
+    try:
+        with ThreadPoolExecutor(clientes) as executor:
+            tempos = list(executor.map(consultar, consultas))
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+    return {**_latencias(tempos), 'clientes': clientes}
+
+
+def medir_danfe(entradas, num_processos=None):
+    """
+    Gera os DANFEs um a um e depois em lote, no pool de processos (com um
+    cache vazio, para que o lote não reaproveite os já gerados)
+    """
+    try:
+        from danfe_nfe import CacheDanfe, GeracaoDanfes, gerar_danfe
+        tempos = []
+        for _, caminho in entradas:
+            dados = caminho.read_bytes()
+            inicio = time.perf_counter()
+            gerar_danfe(dados)
+            tempos.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        xmls = [(nome, caminho.read_bytes) for nome, caminho in entradas]
+        geracao = GeracaoDanfes(xmls, num_processos, cache=CacheDanfe()).iniciar()
+        while not geracao.terminada:
+            geracao.prontos(espera=0.5)
+        lote = time.perf_counter() - inicio
+        if geracao.erros:
+            raise RuntimeError(geracao.erros[0][1])
+    except Exception as e:
+        return {'erro': str(e)}
+    total = sum(tempos)
+    return {'documentos': len(tempos), 'segundos': total,
+            'documentos_por_segundo': len(tempos) / total if total else None,
+            'lote_segundos': lote, 'lote_documentos_por_segundo': len(tempos) / lote if lote else None}
+
+
+def medir_zip(indice, caminhos_por_nome):
+    """
+    Exporta em ZIP os arquivos de uma consulta ampla (sem DANFE, medido à
+    parte), lidos do disco um por vez
+    """
+    from exportacao import iterar_zip
+
+    docs = sorted(indice.busca.buscar('parafuso'))
+    nomes = indice.df_index['arquivo'].iloc[docs].tolist()
+    caminhos = [(nome, caminhos_por_nome[nome]) for nome in nomes if nome in caminhos_por_nome]
+    membros = [(nome, caminho.read_bytes) for nome, caminho in caminhos]
+    tamanho_entrada = sum(caminho.stat().st_size for _, caminho in caminhos)
+
+    inicio = time.perf_counter()
+    tamanho_saida = sum(len(bloco) for bloco in iterar_zip(membros))
+    segundos = time.perf_counter() - inicio
+    return {
+        'arquivos': len(membros),
+        'mb_entrada': tamanho_entrada / 1e6,
+        'mb_saida': tamanho_saida / 1e6,
+        'segundos': segundos,
+        'mb_por_segundo': tamanho_entrada / 1e6 / segundos if segundos else None,
+    }
+
+
+def executar(pasta, num_processos=None, consultas=500, amostra_pdf=50, amostra_danfe=20, semente=42, saida=print):
+    pasta = Path(pasta)
+    xmls = sorted(pasta.glob('xml/*/*.xml'))
+    grupos = {
+        'xml': _entradas(xmls),
+        'pdf_digital': _entradas(sorted(pasta.glob('pdf_digital/*.pdf'))[:amostra_pdf]),
+        'pdf_escaneado': _entradas(sorted(pasta.glob('pdf_escaneado/*.pdf'))[:amostra_pdf]),
+    }
+
+    saida(f"Extraindo {sum(len(g) for g in grupos.values())} arquivo(s)...")
+    extracao, resultados = medir_extracao(grupos, num_processos)
+
+    saida("Indexando...")
+    inicio = time.perf_counter()
+    indice = IndiceNotas.de_resultados(resultados)
+    indexacao = {'documentos': len(indice), 'itens': len(indice.df_itens),
+                 'segundos': time.perf_counter() - inicio,
+                 'memoria_mb': {parte: tamanho / 1e6 for parte, tamanho in indice.memoria().items()}}
+
+    saida(f"Executando {consultas} consulta(s)...")
+    latencia = medir_consultas(indice, consultas, semente)
+    latencia['api'] = medir_api(indice, consultas, semente)
+
+    saida("Gerando DANFEs...")
+    danfe = medir_danfe(grupos['xml'][:amostra_danfe], num_processos)
+
+    saida("Exportando ZIP...")
+    exportacao = medir_zip(indice, dict(grupos['xml']))
+
+    return {
+        'versao': _versao_codigo(),
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'maquina': {
+            'sistema': platform.platform(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+        },
+        'parametros': {'corpus': str(pasta), 'processos': num_processos, 'consultas': consultas,
+                       'amostra_pdf': amostra_pdf, 'amostra_danfe': amostra_danfe},
+        'etapas': {
+            'extracao': extracao,
+            'indexacao': indexacao,
+            'consultas': latencia,
+            'danfe': danfe,
+            'zip': exportacao,
+        },
+    }
+
+
+def _metricas(dados, prefixo=''):
+    """
+    Achata o dicionário de etapas em {nome.da.metrica: valor}
+    """
+    metricas = {}
+    for chave, valor in dados.items():
+        nome = f"{prefixo}{chave}"
+        if isinstance(valor, dict):
+            metricas.update(_metricas(valor, nome + '.'))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            metricas[nome] = valor
+    return metricas
+
+
+def comparar(base, novo):
+    """
+    Retorna as linhas da comparação entre dois resultados
+    """
+    antes, depois = _metricas(base['etapas']), _metricas(novo['etapas'])
+    linhas = [f"{'métrica':<45} {base.get('versao') or 'base':>12} {novo.get('versao') or 'novo':>12} {'variação':>10}"]
+    for nome in sorted(set(antes) | set(depois)):
+        a, d = antes.get(nome), depois.get(nome)
+        variacao = f"{(d - a) / a:+.1%}" if a and d is not None else '-'
+        formatar = lambda v: '-' if v is None else f"{v:.4g}"
+        linhas.append(f"{nome:<45} {formatar(a):>12} {formatar(d):>12} {variacao:>10}")
+    return linhas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pasta', nargs='?', help='pasta do corpus gerado por benchmarks.corpus')
+    parser.add_argument('--saida', help='arquivo JSON com os resultados')
+    parser.add_argument('--processos', type=int, help='processos usados na extração')
+    parser.add_argument('--consultas', type=int, default=500)
+    parser.add_argument('--amostra-pdf', type=int, default=50, help='PDFs de cada tipo extraídos')
+    parser.add_argument('--amostra-danfe', type=int, default=20, help='DANFEs gerados')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--comparar', nargs=2, metavar=('BASE', 'NOVO'), help='compara dois resultados')
+    args = parser.parse_args(argv)
+
+    if args.comparar:
+        base, novo = (json.loads(Path(p).read_text(encoding='utf-8')) for p in args.comparar)
+        print("\n".join(comparar(base, novo)))
+        return 0
+
+    if not args.pasta:
+        parser.error('informe a pasta do corpus')
+    if not os.path.isdir(args.pasta):
+        parser.error(f'pasta do corpus não encontrada: {args.pasta}')
+    padroes = ('xml/*/*.xml', 'pdf_digital/*.pdf', 'pdf_escaneado/*.pdf')
+    if not any(next(Path(args.pasta).glob(padrao), None) for padrao in padroes):
+        parser.error(f'a pasta {args.pasta} não tem arquivos do corpus (gere com python -m benchmarks.corpus)')
+
+    resultado = executar(args.pasta, args.processos, args.consultas, args.amostra_pdf,
+                         args.amostra_danfe, args.semente)
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        Path(args.saida).write_text(texto, encoding='utf-8')
+    print(texto)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Compara o OCR da página inteira com o OCR por regiões do DANFE.
+
+Uso:
+    python -m benchmarks.ocr PASTA_OU_PDF [...] [--max-paginas N] [--saida resultado.json]
+
+Para cada PDF, se existir um arquivo de texto com o mesmo nome (nota.pdf ->
+nota.txt) ele é usado como gabarito; senão o texto do OCR da página inteira
+serve de referência para o modo por regiões.
+"""
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from PyPDF2 import PdfReader
+
+from extracao import ocr_pagina
+from indice_busca import dobrar_texto, tokenizar
+
+MODOS = ['pagina', 'regioes']
+
+
+def palavras(texto):
+    """
+    Retorna o multiconjunto de palavras (com 3 ou mais caracteres) do texto
+    """
+    return Counter(token for token, _ in tokenizar(dobrar_texto(texto)) if len(token) >= 3)
+
+
+def comparar(referencia, candidato):
+    """
+    Retorna (precisão, cobertura) das palavras do candidato em relação à
+    referência
+    """
+    ref, cand = palavras(referencia), palavras(candidato)
+    acertos = sum((ref & cand).values())
+    precisao = acertos / sum(cand.values()) if cand else 0.0
+    cobertura = acertos / sum(ref.values()) if ref else 0.0
+    return precisao, cobertura
+
+
+def listar_pdfs(caminhos):
+    for caminho in map(Path, caminhos):
+        if caminho.is_dir():
+            yield from sorted(caminho.rglob('*.pdf'))
+        elif caminho.suffix.lower() == '.pdf':
+            yield caminho
+
+
+def executar(caminhos, max_paginas=None):
+    tempos = {modo: 0.0 for modo in MODOS}
+    paginas = 0
+    comparacoes = {modo: [] for modo in MODOS}
+    por_arquivo = []
+
+    for pdf in listar_pdfs(caminhos):
+        dados = pdf.read_bytes()
+        total_paginas = len(PdfReader(pdf).pages)
+        if max_paginas:
+            total_paginas = min(total_paginas, max_paginas)
+
+        textos = {modo: [] for modo in MODOS}
+        for numero in range(1, total_paginas + 1):
+            for modo in MODOS:
+                inicio = time.perf_counter()
+                textos[modo].append(ocr_pagina(dados, numero, modo=modo))
+                tempos[modo] += time.perf_counter() - inicio
+        paginas += total_paginas
+
+        gabarito = pdf.with_suffix('.txt')
+        referencia = gabarito.read_text(encoding='utf-8') if gabarito.exists() else "\n".join(textos['pagina'])
+        resultado = {'arquivo': str(pdf), 'paginas': total_paginas, 'gabarito': gabarito.exists()}
+        for modo in MODOS:
+            if modo == 'pagina' and not gabarito.exists():
+                continue
+            precisao, cobertura = comparar(referencia, "\n".join(textos[modo]))
+            comparacoes[modo].append((precisao, cobertura))
+            resultado[modo] = {'precisao_palavras': precisao, 'cobertura_palavras': cobertura}
+        por_arquivo.append(resultado)
+
+    resumo = {'paginas': paginas, 'modos': {}}
+    for modo in MODOS:
+        medidas = comparacoes[modo]
+        resumo['modos'][modo] = {
+            'segundos': tempos[modo],
+            'paginas_por_segundo': paginas / tempos[modo] if tempos[modo] else None,
+            'precisao_palavras': sum(p for p, _ in medidas) / len(medidas) if medidas else None,
+            'cobertura_palavras': sum(c for _, c in medidas) / len(medidas) if medidas else None,
+        }
+    return {'resumo': resumo, 'arquivos': por_arquivo}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('caminhos', nargs='+', help='PDFs escaneados ou pastas com PDFs')
+    parser.add_argument('--max-paginas', type=int, help='limite de páginas lidas por arquivo')
+    parser.add_argument('--saida', help='arquivo JSON com os resultados')
+    args = parser.parse_args(argv)
+
+    resultado = executar(args.caminhos, args.max_paginas)
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    def formatar(valor):
+        return '-' if valor is None else f"{valor:.1%}"
+
+    for modo, medidas in resultado['resumo']['modos'].items():
+        print(f"{modo:>8}: {medidas['paginas_por_segundo'] or 0:.2f} páginas/s, "
+              f"precisão {formatar(medidas['precisao_palavras'])}, "
+              f"cobertura {formatar(medidas['cobertura_palavras'])}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
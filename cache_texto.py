@@ -0,0 +1,194 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+from contextlib import closing
+from pathlib import Path
+
+from duplicados import chave_documento, chave_no_texto
+from extracao import MODO_OCR, VERSAO_EXTRATOR, extrair_em_paralelo, ler_dados, tipo_arquivo
+
+# Diretório e tamanho máximo (em MB) do cache em disco
+DIRETORIO_CACHE = os.environ.get(
+    'BUSCA_NF_CACHE_DIR',
+    os.path.join(Path.home(), '.cache', 'busca-notas-fiscais', 'textos')
+)
+TAMANHO_MAXIMO_MB = int(os.environ.get('BUSCA_NF_CACHE_MB', 1024))
+
+
+def hash_conteudo(dados):
+    """
+    Calcula o hash SHA-256 do conteúdo de um arquivo
+    """
+    return hashlib.sha256(dados).hexdigest()
+
+
+class CacheTexto:
+    """
+    Cache em disco do texto (e dos itens) extraído, endereçado pelo hash do conteúdo do
+    arquivo. Cada versão do extrator (e modo de OCR) usa um diretório
+    próprio, e as entradas menos usadas são removidas quando o cache passa
+    do tamanho máximo
+    """
+
+    def __init__(self, diretorio=DIRETORIO_CACHE, tamanho_maximo_mb=TAMANHO_MAXIMO_MB):
+        self.raiz = Path(diretorio)
+        self.diretorio = self.raiz / f"v{VERSAO_EXTRATOR}-{MODO_OCR}"
+        self.tamanho_maximo = tamanho_maximo_mb * 1024 * 1024
+
+    def _caminho(self, chave):
+        return self.diretorio / chave[:2] / f"{chave}.z"
+
+    def obter(self, chave):
+        """
+        Retorna o resultado guardado para o hash informado (dicionário com
+        'conteudo' e 'itens') ou None
+        """
+        caminho = self._caminho(chave)
+        try:
+            dados = caminho.read_bytes()
+        except OSError:
+            return None
+        try:
+            resultado = pickle.loads(zlib.decompress(dados))
+        except Exception:
+            return None
+        try:
+            # Atualiza o horário de modificação para a remoção por uso
+            os.utime(caminho)
+        except OSError:
+            pass
+        return resultado
+
+    def guardar(self, chave, resultado):
+        """
+        Grava o texto e os itens extraídos no cache de forma atômica
+        """
+        resultado = {'conteudo': resultado['conteudo'], 'itens': resultado.get('itens')}
+        caminho = self._caminho(chave)
+        try:
+            caminho.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=caminho.parent, delete=False) as tmp:
+                tmp.write(zlib.compress(pickle.dumps(resultado, protocol=pickle.HIGHEST_PROTOCOL)))
+            os.replace(tmp.name, caminho)
+        except OSError:
+            pass
+
+    def limpar(self):
+        """
+        Remove as entradas menos usadas (incluindo as de versões antigas do
+        extrator) até o cache voltar ao tamanho máximo
+        """
+        entradas = []
+        total = 0
+        for caminho in self.raiz.glob('v*/*/*.z'):
+            try:
+                info = caminho.stat()
+            except OSError:
+                continue
+            atual = caminho.parent.parent == self.diretorio
+            entradas.append((atual, info.st_mtime, info.st_size, caminho))
+            total += info.st_size
+
+        # Versões antigas saem primeiro, depois as menos usadas
+        for atual, _, tamanho, caminho in sorted(entradas, key=lambda e: (e[0], e[1])):
+            if total <= self.tamanho_maximo and atual:
+                break
+            try:
+                caminho.unlink()
+                total -= tamanho
+            except OSError:
+                pass
+
+
+def extrair_com_cache(entradas, num_processos=None, cache=None, hashes=None):
+    """
+    Extrai uma lista de (nome, dados ou caminho) consultando antes o cache:
+    só os arquivos nunca vistos vão para o pool de processos. Os hashes podem
+    ser informados quando já são conhecidos. Gera (posição, resultado,
+    em_cache) conforme os arquivos ficam prontos; cada resultado traz também
+    o hash e a chave de acesso da nota.
+
+    Cópias idênticas são extraídas uma vez só, e os PDFs com a chave no
+    nome ficam para o fim: se o XML da mesma nota foi extraído, o DANFE
+    não passa pelo OCR e volta marcado como duplicado
+    """
+    cache = cache or CacheTexto()
+    if hashes is None:
+        hashes = [hash_conteudo(ler_dados(dados)) for _, dados in entradas]
+
+    repetidos = {}
+    primeiro_por_hash = {}
+    chaves_xml = set()
+    pendentes = []
+    adiados = []
+
+    def com_copias(i, resultado, em_cache):
+        resultado['hash'] = hashes[i]
+        resultado['chave'] = chave_documento(resultado['arquivo'], resultado['conteudo'], resultado['itens'])
+        if resultado['tipo'] == 'XML' and not resultado['erro'] and resultado['chave']:
+            chaves_xml.add(resultado['chave'])
+        yield i, resultado, em_cache
+        for k in repetidos.get(i, []):
+            nome = entradas[k][0]
+            itens = resultado['itens']
+            yield k, {
+                **resultado, 'arquivo': nome, 'medicoes': [], 'duplicado': True,
+                'itens': itens.assign(arquivo=nome) if itens is not None else None
+            }, em_cache
+
+    for i, (nome, _) in enumerate(entradas):
+        if hashes[i] in primeiro_por_hash:
+            repetidos.setdefault(primeiro_por_hash[hashes[i]], []).append(i)
+            continue
+        primeiro_por_hash[hashes[i]] = i
+
+    for i in primeiro_por_hash.values():
+        nome = entradas[i][0]
+        em_cache = cache.obter(hashes[i])
+        if em_cache is None:
+            if tipo_arquivo(nome) == 'PDF' and chave_no_texto(nome):
+                adiados.append(i)
+            else:
+                pendentes.append(i)
+            continue
+
+        itens = em_cache['itens']
+        if itens is not None:
+            # O mesmo conteúdo pode ter sido extraído com outro nome
+            itens = itens.assign(arquivo=nome)
+        yield from com_copias(i, {
+            'arquivo': nome, 'tipo': tipo_arquivo(nome), 'conteudo': em_cache['conteudo'],
+            'itens': itens, 'erro': None
+        }, True)
+
+    with closing(extrair_em_paralelo([entradas[i] for i in pendentes], num_processos)) as extraidos:
+        for j, resultado in extraidos:
+            i = pendentes[j]
+            if not resultado['erro']:
+                cache.guardar(hashes[i], resultado)
+            yield from com_copias(i, resultado, False)
+
+    # DANFEs cujo XML já foi extraído não precisam de OCR
+    restantes = []
+    for i in adiados:
+        nome = entradas[i][0]
+        chave = chave_no_texto(nome)
+        if chave not in chaves_xml:
+            restantes.append(i)
+            continue
+        yield from com_copias(i, {
+            'arquivo': nome, 'tipo': 'PDF', 'conteudo': '', 'itens': None, 'erro': None,
+            'chave': chave, 'duplicado': True
+        }, False)
+
+    with closing(extrair_em_paralelo([entradas[i] for i in restantes], num_processos)) as extraidos:
+        for j, resultado in extraidos:
+            i = restantes[j]
+            if not resultado['erro']:
+                cache.guardar(hashes[i], resultado)
+            yield from com_copias(i, resultado, False)
+
+    if pendentes or restantes:
+        cache.limpar()
@@ -0,0 +1,212 @@
+"""
+Linguagem de consulta da busca:
+
+    fechadura AND (inox OR latão) NOT tetra
+    "parafuso sextavado"
+    7318831, 7318503, 8301400
+
+- Palavras seguidas formam uma frase, como na busca simples (a última
+  palavra pode ser só o início).
+- "Aspas" buscam a frase exata.
+- AND, OR e NOT, sempre em maiúsculas, e parênteses. Entre dois blocos
+  sem operador vale AND. E, OU e NÃO só são operadores em consultas que
+  já usam um dos anteriores ou parênteses: "PARAFUSO E PORCA" continua
+  sendo uma frase.
+- Vírgula ou ponto e vírgula seguidos de espaço separam uma lista de
+  alternativas, como OR ("4,2" continua sendo um número). Elementos
+  vazios ("fechadura," ou "a,, b") são ignorados.
+
+Cada frase é buscada uma vez no índice invertido e vira um array ordenado de
+documentos; os operadores são aplicados como operações de conjunto do numpy.
+"""
+import re
+
+import numpy as np
+
+OPERADORES = {'AND': 'e', 'OR': 'ou', 'NOT': 'nao'}
+# Palavras comuns em descrições de produto; só valem como operador quando
+# a consulta é claramente booleana
+OPERADORES_PORTUGUES = {'E': 'e', 'OU': 'ou', 'NAO': 'nao', 'NÃO': 'nao'}
+
+PADRAO_LEXICO = re.compile(r'''
+    \s*(?:
+        (?P<abre>\() |
+        (?P<fecha>\)) |
+        "(?P<frase>[^"]*)"? |
+        (?P<lista>[,;])(?=\s|$) |
+        (?P<palavra>[^\s()"]+?)(?=[\s()"]|[,;](?:\s|$)|$)
+    )
+''', re.VERBOSE)
+
+
+def _lexico(texto):
+    """
+    Divide a consulta em [(tipo, valor, texto original)]
+    """
+    encontrados = [
+        (encontrado.lastgroup, encontrado.group(encontrado.lastgroup), encontrado.group().strip())
+        for encontrado in PADRAO_LEXICO.finditer(texto.strip()) if encontrado.lastgroup is not None
+    ]
+    booleana = any(
+        tipo in ('abre', 'fecha') or (tipo == 'palavra' and valor in OPERADORES)
+        for tipo, valor, _ in encontrados
+    )
+    operadores = {**OPERADORES, **OPERADORES_PORTUGUES} if booleana else OPERADORES
+
+    simbolos = []
+    for tipo, valor, original in encontrados:
+        if tipo == 'palavra' and valor in operadores:
+            tipo, valor = 'operador', operadores[valor]
+        anterior = simbolos[-1][0] if simbolos else None
+        # Separadores sem elemento antes (no início, repetidos ou depois de
+        # um operador) ou depois (antes de ')' ou no fim) são descartados
+        if tipo == 'lista' and anterior in (None, 'abre', 'lista', 'operador'):
+            continue
+        if tipo == 'fecha' and anterior == 'lista':
+            simbolos.pop()
+        simbolos.append((tipo, valor, original))
+    if simbolos and simbolos[-1][0] == 'lista':
+        simbolos.pop()
+    return simbolos
+
+
+def composta(texto):
+    """
+    Indica se a consulta usa algum recurso da linguagem (operadores,
+    parênteses, aspas ou listas) em vez de ser um texto simples
+    """
+    return any(tipo != 'palavra' for tipo, _, _ in _lexico(texto))
+
+
+class _Analisador:
+    """
+    Analisador descendente recursivo. Produz a árvore da consulta com nós
+    ('frase', texto, prefixo), ('e', [filhos]), ('ou', [filhos]) e
+    ('nao', filho)
+    """
+
+    def __init__(self, simbolos):
+        self.simbolos = simbolos
+        self.posicao = 0
+
+    def _atual(self):
+        return self.simbolos[self.posicao][:2] if self.posicao < len(self.simbolos) else (None, None)
+
+    def _avancar(self):
+        simbolo = self._atual()
+        self.posicao += 1
+        return simbolo
+
+    def _invalida(self, posicao):
+        # Mostra o texto digitado ('AND', não o valor normalizado 'e')
+        return ValueError(f"Consulta inválida perto de '{self.simbolos[posicao][2]}'")
+
+    def analisar(self):
+        arvore = self._ou()
+        if self._atual()[0] is not None:
+            raise self._invalida(self.posicao)
+        return arvore
+
+    def _ou(self):
+        filhos = [self._e()]
+        while self._atual() == ('operador', 'ou') or self._atual()[0] == 'lista':
+            self._avancar()
+            filhos.append(self._e())
+        return filhos[0] if len(filhos) == 1 else ('ou', filhos)
+
+    def _e(self):
+        filhos = [self._unario()]
+        while True:
+            tipo, valor = self._atual()
+            if (tipo, valor) == ('operador', 'e'):
+                self._avancar()
+            elif not (tipo in ('abre', 'frase', 'palavra') or (tipo, valor) == ('operador', 'nao')):
+                break
+            filhos.append(self._unario())
+        return filhos[0] if len(filhos) == 1 else ('e', filhos)
+
+    def _unario(self):
+        if self._atual() == ('operador', 'nao'):
+            self._avancar()
+            return ('nao', self._unario())
+        return self._primario()
+
+    def _primario(self):
+        tipo, valor = self._avancar()
+        if tipo == 'abre':
+            no = self._ou()
+            if self._atual()[0] == 'fecha':
+                self._avancar()
+            elif self._atual()[0] is not None:
+                raise ValueError("Parêntese sem fechamento na consulta")
+            return no
+        if tipo == 'frase':
+            return ('frase', valor, False)
+        if tipo == 'palavra':
+            palavras = [valor]
+            while self._atual()[0] == 'palavra':
+                palavras.append(self._avancar()[1])
+            return ('frase', ' '.join(palavras), True)
+        if tipo is None:
+            raise ValueError("Consulta incompleta: falta um termo depois do operador")
+        raise self._invalida(self.posicao - 1)
+
+
+def analisar(texto):
+    """
+    Converte o texto da consulta na árvore avaliada por buscar_consulta
+    """
+    simbolos = _lexico(texto)
+    if not simbolos:
+        raise ValueError("Consulta vazia")
+    return _Analisador(simbolos).analisar()
+
+
+def _avaliar(no, indice, total, folhas):
+    """
+    Retorna o array ordenado dos documentos do nó. As ocorrências das
+    frases que não estão sob NOT são acumuladas em folhas, para os trechos
+    """
+    tipo = no[0]
+    if tipo == 'frase':
+        ocorrencias = indice.buscar(no[1], prefixo=no[2])
+        folhas.append(ocorrencias)
+        return np.array(sorted(ocorrencias), dtype=np.int64)
+
+    if tipo == 'nao':
+        return np.setdiff1d(np.arange(total), _avaliar(no[1], indice, total, []), assume_unique=True)
+
+    if tipo == 'ou':
+        docs = np.array([], dtype=np.int64)
+        for filho in no[1]:
+            docs = np.union1d(docs, _avaliar(filho, indice, total, folhas))
+        return docs
+
+    # AND: intersecta os termos positivos (do menor para o maior) e depois
+    # remove os negados, sem montar o complemento de cada um
+    positivos = [_avaliar(filho, indice, total, folhas) for filho in no[1] if filho[0] != 'nao']
+    negativos = [_avaliar(filho[1], indice, total, []) for filho in no[1] if filho[0] == 'nao']
+    if positivos:
+        positivos.sort(key=len)
+        docs = positivos[0]
+        for conjunto in positivos[1:]:
+            docs = np.intersect1d(docs, conjunto, assume_unique=True)
+    else:
+        docs = np.arange(total)
+    for conjunto in negativos:
+        docs = np.setdiff1d(docs, conjunto, assume_unique=True)
+    return docs
+
+
+def buscar_consulta(indice, consulta):
+    """
+    Avalia a consulta no índice invertido. Retorna {doc: [(início, fim), ...]}
+    como IndiceInvertido.buscar; documentos encontrados só por NOT vêm com a
+    lista de trechos vazia
+    """
+    folhas = []
+    docs = _avaliar(analisar(consulta), indice, len(indice), folhas)
+    return {
+        int(doc): sorted({trecho for ocorrencias in folhas for trecho in ocorrencias.get(doc, ())})
+        for doc in docs
+    }
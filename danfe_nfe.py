@@ -0,0 +1,305 @@
+import hashlib
+import io
+import os
+import queue
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+
+from instrumentacao import arquivo_em_medicao, incluir, medir
+
+# Quantidade máxima de DANFEs mantidos em memória
+TAMANHO_CACHE_DANFE = int(os.environ.get('BUSCA_NF_DANFE_CACHE', 256))
+
+# Processos usados para gerar os DANFEs de um lote (ex.: o ZIP dos resultados)
+NUM_PROCESSOS_DANFE = int(os.environ.get('BUSCA_NF_PROCESSOS', os.cpu_count() or 1))
+
+# DANFEs prontos que aguardam quem os consome; acima disso a geração pausa
+DANFES_EM_ESPERA = 32
+
+PADRAO_CHAVE = re.compile(rb'Id\s*=\s*["\']NFe(\d{44})["\']')
+
+
+def chave_nfe(xml_content):
+    """
+    Retorna a chave de acesso (44 dígitos) do XML da NFe, ou None
+    """
+    if isinstance(xml_content, str):
+        xml_content = xml_content.encode('utf-8')
+    encontrado = PADRAO_CHAVE.search(xml_content)
+    return encontrado.group(1).decode() if encontrado else None
+
+
+def _como_bytes(xml_content):
+    if isinstance(xml_content, str):
+        return xml_content.encode('utf-8')
+    return bytes(xml_content)
+
+
+def _ler_xml(fonte):
+    """
+    Conteúdo do XML a partir da fonte: os próprios bytes ou uma função que
+    abre o arquivo (retornando bytes, arquivo mapeado ou None, se ele não
+    estiver disponível). O que a função abriu é fechado depois da leitura
+    """
+    if not callable(fonte):
+        return _como_bytes(fonte)
+    aberto = fonte()
+    if aberto is None:
+        return None
+    try:
+        return _como_bytes(aberto.read() if hasattr(aberto, 'read') else aberto)
+    finally:
+        if hasattr(aberto, 'close'):
+            aberto.close()
+
+
+@contextmanager
+def _caminho_em_memoria(dados):
+    """
+    Caminho de um arquivo com os dados, para o leitor do PyNFe, que só abre
+    caminhos. No Linux o arquivo é anônimo e fica só na memória
+    (memfd_create); nos demais sistemas é um temporário, removido ao sair do
+    bloco mesmo quando a leitura falha
+    """
+    if hasattr(os, 'memfd_create'):
+        fd = os.memfd_create('nfe.xml', os.MFD_CLOEXEC)
+        try:
+            with open(fd, 'wb', closefd=False) as arquivo:
+                arquivo.write(dados)
+            yield f'/proc/self/fd/{fd}'
+        finally:
+            os.close(fd)
+        return
+
+    arquivo = tempfile.NamedTemporaryFile(suffix='.xml', delete=False)
+    try:
+        # Fechado antes da leitura, que no Windows não abre o arquivo em uso
+        with arquivo:
+            arquivo.write(dados)
+        yield arquivo.name
+    finally:
+        os.unlink(arquivo.name)
+
+
+@medir('xml_para_danfe')
+def gerar_danfe(xml_content):
+    """
+    Converte XML de NFe para DANFE usando PyNFe e retorna os bytes do PDF
+    """
+    # Importado só quando um DANFE é pedido, para não pesar no início dos
+    # processos de extração e do indexador
+    from pynfe.processamento.danfe import danfe
+    from pynfe.processamento.xml import XML
+
+    with _caminho_em_memoria(_como_bytes(xml_content)) as caminho:
+        nfe = XML(caminho)
+
+        pdf_buffer = io.BytesIO()
+        danfe_nfe = danfe(nfe.nfe, template=False)
+        danfe_nfe.gerar_pdf(pdf_buffer)
+        return pdf_buffer.getvalue()
+
+
+def _gerar_no_processo(xml_content):
+    """
+    Gera um DANFE dentro dos processos do pool; devolve o erro e as medições
+    em vez de levantar a exceção
+    """
+    with arquivo_em_medicao(None) as medicoes:
+        try:
+            pdf, erro = gerar_danfe(xml_content), None
+        except Exception as e:
+            pdf, erro = None, str(e)
+    return pdf, erro, medicoes
+
+
+class CacheDanfe:
+    """
+    Cache LRU limitado dos DANFEs já gerados, indexado pela chave de acesso
+    da NFe (ou pelo hash do XML, quando não há chave)
+    """
+
+    def __init__(self, tamanho_maximo=TAMANHO_CACHE_DANFE):
+        self.tamanho_maximo = tamanho_maximo
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def chave(xml_content):
+        return chave_nfe(xml_content) or hashlib.sha256(xml_content).hexdigest()
+
+    def consultar(self, chave):
+        """
+        Retorna o DANFE já gerado com a chave, ou None
+        """
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                return self._itens[chave]
+        return None
+
+    def guardar(self, chave, pdf):
+        with self._lock:
+            self._itens[chave] = pdf
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho_maximo:
+                self._itens.popitem(last=False)
+
+    def obter(self, xml_content):
+        """
+        Retorna os bytes do DANFE do XML, gerando-o apenas se necessário
+        """
+        xml_content = _como_bytes(xml_content)
+        chave = self.chave(xml_content)
+        pdf = self.consultar(chave)
+        if pdf is None:
+            pdf = gerar_danfe(xml_content)
+            self.guardar(chave, pdf)
+        return pdf
+
+
+# Cache compartilhado por todas as sessões do processo
+cache_danfe = CacheDanfe()
+
+
+class GeracaoDanfes:
+    """
+    Gera os DANFEs de uma lista de (nome, XML) em uma thread própria, que
+    distribui as notas ainda fora do cache em um pool de processos. O XML
+    pode ser uma função que abre o arquivo: cada um é lido só quando entra
+    no pool e descartado quando o PDF fica pronto. Os PDFs são entregues por
+    prontos() conforme terminam, e a falha de uma nota fica em erros, sem
+    interromper as demais
+    """
+
+    def __init__(self, xmls, num_processos=None, cache=None):
+        self.total = len(xmls)
+        self.erros = []
+        self._xmls = xmls
+        self._num_processos = num_processos or NUM_PROCESSOS_DANFE
+        self._cache = cache or cache_danfe
+        self._prontos = queue.Queue(maxsize=DANFES_EM_ESPERA)
+        self._cancelada = threading.Event()
+        self._thread = threading.Thread(target=self._executar, name='danfes', daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+        return self
+
+    @property
+    def terminada(self):
+        return self._thread.ident is not None and not self._thread.is_alive() and self._prontos.empty()
+
+    def cancelar(self):
+        """
+        Interrompe a geração; as notas já em andamento no pool terminam
+        """
+        self._cancelada.set()
+
+    def prontos(self, espera=None):
+        """
+        Retorna e remove os (nome, pdf) gerados desde a última chamada. Com
+        espera, aguarda até essa quantidade de segundos pelo primeiro
+        """
+        gerados = []
+        if espera:
+            try:
+                gerados.append(self._prontos.get(timeout=espera))
+            except queue.Empty:
+                return gerados
+        while True:
+            try:
+                gerados.append(self._prontos.get_nowait())
+            except queue.Empty:
+                return gerados
+
+    def _entregar(self, nome, pdf, erro):
+        """
+        Registra o resultado de uma nota; aguarda espaço na fila enquanto a
+        geração não for cancelada. Retorna False se foi
+        """
+        if erro is not None:
+            self.erros.append((nome, erro))
+            return not self._cancelada.is_set()
+        while not self._cancelada.is_set():
+            try:
+                self._prontos.put((nome, pdf), timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _executar(self):
+        try:
+            self._gerar()
+        except Exception as e:
+            self.erros.append(('', str(e)))
+
+    def _pendentes(self):
+        """
+        Lê os XMLs um por vez, entrega os DANFEs que já estão no cache e gera
+        (nome, chave, XML) dos que faltam
+        """
+        for nome, fonte in self._xmls:
+            if self._cancelada.is_set():
+                return
+            try:
+                xml_content = _ler_xml(fonte)
+            except Exception as e:
+                if not self._entregar(nome, None, str(e)):
+                    return
+                continue
+            if xml_content is None:
+                continue
+            chave = self._cache.chave(xml_content)
+            pdf = self._cache.consultar(chave)
+            if pdf is None:
+                yield nome, chave, xml_content
+            elif not self._entregar(nome, pdf, None):
+                return
+
+    def _gerar(self):
+        pendentes = self._pendentes()
+        if self._num_processos <= 1 or self.total <= 1:
+            for nome, chave, xml_content in pendentes:
+                try:
+                    pdf, erro = gerar_danfe(xml_content), None
+                    self._cache.guardar(chave, pdf)
+                except Exception as e:
+                    pdf, erro = None, str(e)
+                if not self._entregar(nome, pdf, erro):
+                    return
+            return
+
+        num_processos = min(self._num_processos, self.total)
+        with ProcessPoolExecutor(max_workers=num_processos) as executor:
+            # Poucas notas por vez no pool, para que os XMLs lidos e os PDFs
+            # prontos não se acumulem na memória quando o consumo é mais lento
+            em_andamento = {}
+            while True:
+                for nome, chave, xml_content in pendentes:
+                    em_andamento[executor.submit(_gerar_no_processo, xml_content)] = (nome, chave)
+                    if len(em_andamento) >= 2 * num_processos:
+                        break
+                if not em_andamento:
+                    return
+
+                terminados, _ = wait(em_andamento, return_when=FIRST_COMPLETED)
+                for futuro in terminados:
+                    nome, chave = em_andamento.pop(futuro)
+                    try:
+                        pdf, erro, medicoes = futuro.result()
+                        # As medições voltam para o processo principal
+                        incluir(medicoes)
+                    except Exception as e:
+                        # Falha do próprio processo (ex.: processo encerrado)
+                        pdf, erro = None, str(e)
+                    if pdf is not None:
+                        self._cache.guardar(chave, pdf)
+                    if not self._entregar(nome, pdf, erro):
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        return
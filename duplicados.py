@@ -0,0 +1,108 @@
+import re
+
+# Chave de acesso: 44 dígitos, seguidos ou em grupos de 4 como no DANFE
+PADRAO_CHAVE_TEXTO = re.compile(r'(?<!\d)\d{4}(?:[ .]?\d{4}){10}(?!\d)')
+
+
+def chave_valida(chave):
+    """
+    Confere o dígito verificador (módulo 11) da chave de acesso
+    """
+    if len(chave) != 44 or not chave.isdigit():
+        return False
+    soma = sum(int(digito) * peso for digito, peso in zip(reversed(chave[:43]), [2, 3, 4, 5, 6, 7, 8, 9] * 6))
+    resto = soma % 11
+    return int(chave[43]) == (0 if resto < 2 else 11 - resto)
+
+
+def chave_no_texto(texto):
+    """
+    Retorna a primeira chave de acesso válida encontrada no texto, ou None
+    """
+    for encontrado in PADRAO_CHAVE_TEXTO.finditer(texto or ''):
+        chave = re.sub(r'\D', '', encontrado.group())
+        if chave_valida(chave):
+            return chave
+    return None
+
+
+def chave_documento(nome, conteudo, itens=None):
+    """
+    Chave de acesso da nota do arquivo: a do infNFe (nos itens do XML), a
+    impressa no DANFE ou, por último, a do nome do arquivo
+    """
+    if itens is not None and len(itens):
+        chaves = itens['chave'].dropna()
+        if len(chaves):
+            return str(chaves.iloc[0])
+    return chave_no_texto(conteudo) or chave_no_texto(nome)
+
+
+class AgrupadorDuplicados:
+    """
+    Decide, arquivo a arquivo, se o resultado da extração é uma nota nova
+    ou a cópia de uma já vista: mesmo conteúdo (hash), o PDF do DANFE de
+    um XML já visto ou outro XML da mesma chave de acesso. PDFs diferentes
+    com a mesma chave (com anotações, carimbos) continuam sendo documentos
+    próprios, para que o texto deles seja indexado. O XML é preferido como
+    principal; se chegar depois dos PDFs da mesma nota, ele os substitui.
+
+    classificar() retorna um dos eventos:
+    ('nova', None), ('copia', hash do principal) ou
+    ('substitui', [hashes dos principais anteriores])
+    """
+
+    def __init__(self):
+        self.reiniciar()
+
+    def reiniciar(self, arquivos=()):
+        """
+        Esquece os arquivos já classificados e classifica de novo os
+        informados (por exemplo, os de IndiceNotas.arquivos())
+        """
+        self._por_hash = {}
+        self._por_chave = {}
+        self._substituido = {}
+        for arquivo in arquivos:
+            self.classificar(arquivo)
+
+    def principal(self, hash_conteudo):
+        """
+        Hash do documento principal atual do grupo do hash informado
+        """
+        hash_conteudo = self._por_hash.get(hash_conteudo, hash_conteudo)
+        while hash_conteudo in self._substituido:
+            hash_conteudo = self._substituido[hash_conteudo]
+        return hash_conteudo
+
+    def classificar(self, resultado):
+        hash_conteudo = resultado.get('hash')
+        chave = resultado.get('chave')
+
+        if hash_conteudo and hash_conteudo in self._por_hash:
+            return 'copia', self.principal(hash_conteudo)
+
+        if chave and chave in self._por_chave:
+            tipo_anterior, anteriores = self._por_chave[chave]
+            anteriores = [self.principal(anterior) for anterior in anteriores]
+            if tipo_anterior != 'XML' and resultado['tipo'] == 'XML' and hash_conteudo:
+                self._por_hash[hash_conteudo] = hash_conteudo
+                for anterior in anteriores:
+                    self._substituido[anterior] = hash_conteudo
+                self._por_chave[chave] = ('XML', [hash_conteudo])
+                return 'substitui', anteriores
+            if tipo_anterior != 'XML' and resultado['tipo'] != 'XML':
+                if hash_conteudo:
+                    self._por_hash[hash_conteudo] = hash_conteudo
+                    anteriores.append(hash_conteudo)
+                    self._por_chave[chave] = (tipo_anterior, anteriores)
+                return 'nova', None
+            if hash_conteudo:
+                self._por_hash[hash_conteudo] = anteriores[0]
+            return 'copia', anteriores[0]
+
+        if hash_conteudo:
+            self._por_hash[hash_conteudo] = hash_conteudo
+            if chave:
+                self._por_chave[chave] = (resultado['tipo'], [hash_conteudo])
+        return 'nova', None
@@ -0,0 +1,117 @@
+import functools
+import io
+import time
+import zipfile
+
+from danfe_nfe import GeracaoDanfes
+
+# Tamanho dos blocos lidos dos arquivos e entregues pelo gerador
+TAMANHO_BLOCO = 1024 * 1024
+
+# Intervalo máximo de espera por um DANFE em geração
+ESPERA_DANFE = 0.5
+
+
+class _SaidaSequencial(io.RawIOBase):
+    """
+    Destino não posicionável para o ZipFile: guarda o que foi escrito até
+    o gerador retirar
+    """
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def retirar(self):
+        dados = b''.join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def _abrir_fonte(fonte):
+    """
+    Converte a fonte de um membro (bytes, arquivo ou função que retorna um
+    deles) em um objeto com read()
+    """
+    if callable(fonte):
+        fonte = fonte()
+    if isinstance(fonte, (bytes, bytearray, memoryview)):
+        return io.BytesIO(fonte)
+    fonte.seek(0)
+    return fonte
+
+
+def iterar_zip(membros):
+    """
+    Gera o arquivo ZIP em blocos, membro a membro, sem montar o arquivo
+    inteiro na memória. membros é um iterável de (nome, fonte); membros cuja
+    fonte falhar são ignorados
+    """
+    saida = _SaidaSequencial()
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for nome, fonte in membros:
+            try:
+                origem = _abrir_fonte(fonte)
+            except Exception:
+                continue
+
+            info = zipfile.ZipInfo(nome, time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with zip_file.open(info, 'w', force_zip64=True) as destino:
+                while True:
+                    bloco = origem.read(TAMANHO_BLOCO)
+                    if not bloco:
+                        break
+                    destino.write(bloco)
+                    dados = saida.retirar()
+                    if dados:
+                        yield dados
+            dados = saida.retirar()
+            if dados:
+                yield dados
+    dados = saida.retirar()
+    if dados:
+        yield dados
+
+
+def membros_resultado(arquivos_encontrados, obter_arquivo, num_processos=None):
+    """
+    Gera os membros do ZIP de resultados: cada arquivo encontrado (os dados
+    de IndiceNotas.arquivos_das_notas(), abertos com obter_arquivo) e, para
+    os XMLs, o DANFE correspondente. Os DANFEs são gerados em paralelo
+    enquanto os arquivos são escritos e entram no ZIP conforme ficam
+    prontos; cada XML é lido pela geração só quando chega a vez dele. As
+    notas cujo DANFE falhou são listadas em ERROS_DANFE.txt
+    """
+    xmls = [
+        (registro['arquivo'], functools.partial(obter_arquivo, registro))
+        for registro in arquivos_encontrados
+        if registro['arquivo'].lower().endswith('.xml')
+    ]
+    geracao = GeracaoDanfes(xmls, num_processos).iniciar()
+    try:
+        for registro in arquivos_encontrados:
+            arquivo = obter_arquivo(registro)
+            if arquivo is not None:
+                yield registro['arquivo'], arquivo
+            yield from _membros_danfe(geracao.prontos())
+
+        while not geracao.terminada:
+            yield from _membros_danfe(geracao.prontos(espera=ESPERA_DANFE))
+    finally:
+        geracao.cancelar()
+
+    if geracao.erros:
+        relatorio = ''.join(f"{nome}: {erro}\n" for nome, erro in geracao.erros)
+        yield 'ERROS_DANFE.txt', relatorio.encode('utf-8')
+
+
+def _membros_danfe(prontos):
+    for arquivo_nome, pdf in prontos:
+        yield arquivo_nome.rsplit('.', 1)[0] + '_danfe.pdf', pdf
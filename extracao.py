@@ -0,0 +1,332 @@
+import io
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+
+import pandas as pd
+import pdf2image
+import pytesseract
+from lxml import etree
+from PyPDF2 import PdfReader
+
+from instrumentacao import arquivo_em_medicao, em_contexto, medir, medir_etapa
+from ocr_danfe import ocr_regioes_pagina
+
+# Versão dos extratores; deve ser incrementada sempre que o texto ou os
+# itens extraídos mudarem, para invalidar o cache persistente
+VERSAO_EXTRATOR = 3
+
+# Número padrão de processos usados na extração paralela
+NUM_PROCESSOS = int(os.environ.get('BUSCA_NF_PROCESSOS', os.cpu_count() or 1))
+
+# Threads de OCR por arquivo (cada uma mantém uma página rasterizada)
+THREADS_OCR = int(os.environ.get('BUSCA_NF_THREADS_OCR', 2))
+
+# Resolução usada para rasterizar as páginas escaneadas
+DPI_OCR = 200
+
+# Modo de OCR: 'pagina' lê a página inteira; 'regioes' lê só as regiões
+# buscadas do DANFE (produtos, emitente, destinatário e chave)
+MODO_OCR = os.environ.get('BUSCA_NF_MODO_OCR', 'pagina')
+
+# Páginas com menos caracteres do que isso na camada de texto passam por OCR
+MIN_CARACTERES_PAGINA = 20
+
+# Namespace da NFe, no formato usado pelo lxml
+NS_NFE = '{http://www.portalfiscal.inf.br/nfe}'
+
+# Campos de cada item (det/prod) extraídos para a tabela estruturada
+CAMPOS_PRODUTO = ['cProd', 'xProd', 'NCM', 'qCom', 'vUnCom', 'vProd']
+
+# Colunas da tabela de itens e seus tipos
+COLUNAS_ITENS = {
+    'arquivo': 'category',
+    'chave': 'category',
+    'cnpj_emitente': 'category',
+    'cnpj_destinatario': 'category',
+    'data_emissao': 'datetime64[ns]',
+    'cProd': 'category',
+    'xProd': 'category',
+    'NCM': 'category',
+    'qCom': 'float64',
+    'vUnCom': 'float64',
+    'vProd': 'float64',
+    'vNF': 'float64',
+}
+
+def tipo_arquivo(nome):
+    """
+    Retorna o tipo do arquivo ('PDF' ou 'XML') a partir do nome
+    """
+    return 'PDF' if nome.lower().endswith('.pdf') else 'XML'
+
+
+def ler_dados(dados):
+    """
+    Aceita os bytes do arquivo ou o caminho dele em disco; com o caminho,
+    o arquivo é lido só dentro do processo que vai extraí-lo
+    """
+    if isinstance(dados, os.PathLike):
+        with open(dados, 'rb') as arquivo:
+            return arquivo.read()
+    return dados
+
+
+def _texto_filho(elemento, tag):
+    filho = elemento.find(NS_NFE + tag)
+    return filho.text if filho is not None else None
+
+
+def tabela_itens(colunas):
+    """
+    Monta o DataFrame tipado dos itens a partir de um dicionário de colunas
+    (ou de um DataFrame já existente)
+    """
+    df = pd.DataFrame({nome: colunas[nome] if nome in colunas else [] for nome in COLUNAS_ITENS})
+    for nome in ('qCom', 'vUnCom', 'vProd', 'vNF'):
+        df[nome] = pd.to_numeric(df[nome], errors='coerce').astype('float64')
+    df['data_emissao'] = pd.to_datetime(df['data_emissao'].astype('string').str[:10], errors='coerce').astype('datetime64[ns]')
+    return df.astype({nome: tipo for nome, tipo in COLUNAS_ITENS.items() if tipo == 'category'})
+
+
+def concatenar_itens(tabelas):
+    """
+    Junta tabelas de itens mantendo as colunas categóricas
+    """
+    tabelas = [t for t in tabelas if t is not None and len(t)]
+    if not tabelas:
+        return tabela_itens({})
+    df = pd.concat(tabelas, ignore_index=True)
+    return df.astype({nome: 'category' for nome, tipo in COLUNAS_ITENS.items() if tipo == 'category'})
+
+
+def _cnpj_texto(rotulo, cnpj):
+    """
+    Linhas do CNPJ no texto pesquisável: sem e com formatação
+    """
+    return [
+        f"CNPJ {rotulo}: {cnpj}",
+        f"CNPJ {rotulo} Formatado: {cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}",
+    ]
+
+
+def _produto_texto(prod):
+    """
+    Linha de um item (det/prod) no texto pesquisável
+    """
+    rotulos = (('cProd', 'Código'), ('xProd', 'Produto'), ('NCM', 'NCM'), ('qCom', 'Qtd'), ('vUnCom', 'Valor'))
+    partes = []
+    for campo, rotulo in rotulos:
+        filho = prod.find(NS_NFE + campo)
+        if filho is not None:
+            partes.append(f"{rotulo}: {filho.text}")
+    return " | ".join(partes)
+
+
+@medir('extrair_xml')
+def extrair_xml(fonte, arquivo=''):
+    """
+    Extrai de um XML de NFe, em uma única leitura, o texto pesquisável
+    (chave, emitente, destinatário, produtos e valor total) e a tabela dos
+    itens (det), com uma linha por item. O XML é lido em fluxo com
+    iterparse e os elementos já processados são descartados, então lotes
+    grandes (nfeProc/enviNFe) usam memória limitada. Retorna (texto, itens)
+    """
+    if isinstance(fonte, (bytes, bytearray)):
+        fonte = io.BytesIO(fonte)
+
+    colunas = {nome: [] for nome in COLUNAS_ITENS}
+    nota = {}
+    itens_nota = []
+    # Partes do texto: chave, emitente, destinatário e total são os da
+    # primeira NFe do arquivo; os produtos são os de todas
+    cabecalho = {}
+    produtos = []
+
+    tags = [NS_NFE + tag for tag in ('ide', 'emit', 'dest', 'det', 'ICMSTot', 'infNFe', 'NFe')]
+    for _, elemento in etree.iterparse(fonte, events=('end',), tag=tags):
+        tag = etree.QName(elemento).localname
+
+        if tag == 'ide':
+            nota['data_emissao'] = _texto_filho(elemento, 'dhEmi') or _texto_filho(elemento, 'dEmi')
+        elif tag in ('emit', 'dest'):
+            documento = _texto_filho(elemento, 'CNPJ') or _texto_filho(elemento, 'CPF')
+            campo = 'cnpj_emitente' if tag == 'emit' else 'cnpj_destinatario'
+            nota[campo] = documento
+            if tag not in cabecalho:
+                rotulo = 'Emitente' if tag == 'emit' else 'Destinatário'
+                linhas = []
+                nome = elemento.find(NS_NFE + 'xNome')
+                if nome is not None:
+                    linhas.append(f"{rotulo}: {nome.text}")
+                cnpj = elemento.find(NS_NFE + 'CNPJ')
+                if cnpj is not None:
+                    linhas.extend(_cnpj_texto(rotulo, cnpj.text))
+                cabecalho[tag] = linhas
+        elif tag == 'det':
+            prod = elemento.find(NS_NFE + 'prod')
+            if prod is not None:
+                itens_nota.append({campo: _texto_filho(prod, campo) for campo in CAMPOS_PRODUTO})
+                produtos.append(_produto_texto(prod))
+        elif tag == 'ICMSTot':
+            nota['vNF'] = _texto_filho(elemento, 'vNF')
+            if tag not in cabecalho:
+                vnf = elemento.find(NS_NFE + 'vNF')
+                cabecalho[tag] = [f"Valor Total NF: {vnf.text}"] if vnf is not None else []
+        elif tag == 'infNFe':
+            chave = elemento.get('Id', '')
+            if tag not in cabecalho:
+                cabecalho[tag] = [f"Chave: {chave}"]
+            chave = chave[3:] if chave.startswith('NFe') else chave
+            for item in itens_nota:
+                colunas['arquivo'].append(arquivo)
+                colunas['chave'].append(chave)
+                for campo in ('cnpj_emitente', 'cnpj_destinatario', 'data_emissao', 'vNF'):
+                    colunas[campo].append(nota.get(campo))
+                for campo in CAMPOS_PRODUTO:
+                    colunas[campo].append(item[campo])
+            nota = {}
+            itens_nota = []
+
+        # Descarta o que já foi lido (inclusive a assinatura de cada NFe)
+        if tag in ('det', 'infNFe', 'NFe'):
+            elemento.clear()
+            while elemento.getprevious() is not None:
+                del elemento.getparent()[0]
+
+    linhas = [
+        *cabecalho.get('infNFe', []), *cabecalho.get('emit', []), *cabecalho.get('dest', []),
+        *produtos, *cabecalho.get('ICMSTot', []),
+    ]
+    return "\n".join(linhas), tabela_itens(colunas)
+
+
+def rasterizar_pagina(dados, numero, dpi=DPI_OCR):
+    """
+    Converte uma única página do PDF (numerada a partir de 1) em imagem
+    """
+    with medir_etapa('rasterizacao'):
+        return pdf2image.convert_from_bytes(dados, dpi=dpi, first_page=numero, last_page=numero)[0]
+
+
+def ocr_pagina(dados, numero, modo=None):
+    """
+    Rasteriza e aplica OCR em uma página do PDF, liberando a imagem em seguida.
+    No modo 'regioes' só as regiões buscadas do DANFE são lidas
+    """
+    if (modo or MODO_OCR) == 'regioes':
+        texto = ocr_regioes_pagina(dados, numero)
+        if texto is not None:
+            return texto
+
+    imagem = rasterizar_pagina(dados, numero)
+    try:
+        with medir_etapa('tesseract'):
+            return pytesseract.image_to_string(imagem, lang='por')
+    finally:
+        imagem.close()
+
+
+def pagina_precisa_ocr(texto):
+    """
+    Indica se a página não tem camada de texto suficiente e precisa de OCR
+    """
+    return len((texto or '').strip()) < MIN_CARACTERES_PAGINA
+
+
+@medir('extrair_texto_pdf')
+def extrair_texto_pdf(arquivo):
+    """
+    Extrai texto de arquivos PDF, sejam eles digitais ou escaneados. A
+    decisão de aplicar OCR é feita página a página, e as páginas escaneadas
+    são rasterizadas e reconhecidas em paralelo, uma imagem por thread
+    """
+    dados = arquivo if isinstance(arquivo, bytes) else arquivo.getvalue()
+
+    with medir_etapa('pdf_texto'):
+        reader = PdfReader(io.BytesIO(dados))
+        textos = [pagina.extract_text() or '' for pagina in reader.pages]
+    paginas_ocr = [n for n, texto in enumerate(textos) if pagina_precisa_ocr(texto)]
+
+    if paginas_ocr:
+        with ThreadPoolExecutor(max_workers=min(THREADS_OCR, len(paginas_ocr))) as executor:
+            futuros = {executor.submit(em_contexto(ocr_pagina), dados, n + 1): n for n in paginas_ocr}
+            for futuro in as_completed(futuros):
+                textos[futuros[futuro]] = futuro.result()
+
+    return "".join(textos)
+
+
+def extrair_arquivo(nome, dados):
+    """
+    Extrai o texto de um único arquivo. Executa dentro dos processos
+    do pool, por isso devolve o erro (e as medições de desempenho) em vez
+    de exibi-lo
+    """
+    tipo = tipo_arquivo(nome)
+    resultado = {'arquivo': nome, 'tipo': tipo, 'conteudo': '', 'itens': None, 'erro': None}
+    with arquivo_em_medicao(nome) as medicoes:
+        try:
+            dados = ler_dados(dados)
+            if tipo == 'PDF':
+                resultado['conteudo'] = extrair_texto_pdf(dados)
+            else:
+                resultado['conteudo'], resultado['itens'] = extrair_xml(dados, arquivo=nome)
+        except Exception as e:
+            resultado['erro'] = str(e)
+    # As medições voltam junto com o resultado para o processo principal
+    resultado['medicoes'] = medicoes
+    return resultado
+
+
+def _iniciar_processo():
+    """
+    Prepara cada processo do pool de extração. O paralelismo é feito por
+    arquivo e por página, então cada Tesseract usa uma única thread; a
+    variável vale só para os processos do pool, sem alterar o ambiente de
+    quem importa o módulo
+    """
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+
+def extrair_em_paralelo(arquivos, num_processos=None):
+    """
+    Extrai o texto de uma lista de (nome, dados ou caminho) distribuindo os
+    arquivos em um pool de processos. Gera (posição, resultado) na ordem em que
+    os arquivos terminam
+    """
+    num_processos = num_processos or NUM_PROCESSOS
+
+    if num_processos <= 1 or len(arquivos) <= 1:
+        for i, (nome, dados) in enumerate(arquivos):
+            yield i, extrair_arquivo(nome, dados)
+        return
+
+    num_processos = min(num_processos, len(arquivos))
+    with ProcessPoolExecutor(max_workers=num_processos, initializer=_iniciar_processo) as executor:
+        # Poucos arquivos por vez no pool: os resultados prontos não se
+        # acumulam quando o consumo é mais lento, e quem fecha o gerador não
+        # espera pelos que nem começaram
+        restantes = iter(enumerate(arquivos))
+        em_andamento = {}
+        try:
+            while True:
+                for i, (nome, dados) in restantes:
+                    em_andamento[executor.submit(extrair_arquivo, nome, dados)] = i
+                    if len(em_andamento) >= 2 * num_processos:
+                        break
+                if not em_andamento:
+                    return
+
+                terminados, _ = wait(em_andamento, return_when=FIRST_COMPLETED)
+                for futuro in terminados:
+                    i = em_andamento.pop(futuro)
+                    try:
+                        resultado = futuro.result()
+                    except Exception as e:
+                        # Falha do próprio processo (ex.: processo encerrado)
+                        nome = arquivos[i][0]
+                        resultado = {'arquivo': nome, 'tipo': tipo_arquivo(nome), 'conteudo': '', 'itens': None,
+                                     'erro': str(e), 'medicoes': []}
+                    yield i, resultado
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
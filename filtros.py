@@ -0,0 +1,249 @@
+import sys
+from bisect import bisect_left, insort
+
+import numpy as np
+import pandas as pd
+
+
+def normalizar_cnpj(cnpj):
+    """
+    Remove caracteres especiais do CNPJ
+    """
+    if cnpj:
+        return ''.join(filter(str.isdigit, cnpj))
+    return ''
+
+
+def _digitos(valor):
+    """
+    Mantém só os dígitos do NCM ou da chave de acesso
+    """
+    return normalizar_cnpj(valor)
+
+
+def mapear_valores(serie, funcao):
+    """
+    Aplica a função aos valores não nulos da coluna; nas categóricas, uma
+    vez por categoria em vez de uma vez por linha
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        convertidos = np.array([funcao(valor) for valor in serie.cat.categories] + [None], dtype=object)
+        return pd.Series(convertidos[serie.cat.codes.to_numpy()], index=serie.index)
+    return serie.astype(object).map(funcao, na_action='ignore')
+
+
+def _agrupar(valores, docs):
+    """
+    Monta o índice hash {valor: array ordenado de documentos}
+    """
+    indice = {}
+    if len(valores) == 0:
+        return indice
+    tabela = pd.DataFrame({'valor': valores, 'doc': docs}).dropna().drop_duplicates()
+    for valor, grupo in tabela.groupby('valor', sort=False, observed=True)['doc']:
+        indice[valor] = np.sort(grupo.to_numpy(dtype=np.int64))
+    return indice
+
+
+def docs_dos_itens(df_index, df_itens):
+    """
+    Número do documento (linha de df_index) de cada item, pelo nome do
+    arquivo; -1 para itens sem documento
+    """
+    posicoes = pd.Series(np.arange(len(df_index)), index=df_index['arquivo'].to_numpy())
+    posicoes = posicoes[~posicoes.index.duplicated()]
+    docs = df_itens['arquivo'].astype(object).map(posicoes)
+    return docs.fillna(-1).to_numpy(dtype=np.int64)
+
+
+# Campos com índice hash {valor: documentos}
+CAMPOS_HASH = ('cnpj_emitente', 'cnpj_destinatario', 'ncm', 'chave')
+
+# Dígitos mínimos antes do "*" para o NCM ser filtrado pelo prefixo
+MINIMO_PREFIXO_NCM = 2
+
+
+class IndiceFiltros:
+    """
+    Índices dos dados estruturados das NFes para filtrar os documentos:
+    hash para CNPJs, NCM e chave, e arrays ordenados para data de emissão e
+    valor total, consultados por busca binária
+    """
+
+    def __init__(self):
+        self.cnpj_emitente = {}
+        self.cnpj_destinatario = {}
+        self.ncm = {}
+        self.chave = {}
+        self._ncms_ordenados = []
+        self._datas = np.array([], dtype='datetime64[ns]')
+        self._docs_por_data = np.array([], dtype=np.int64)
+        self._valores = np.array([], dtype=np.float64)
+        self._docs_por_valor = np.array([], dtype=np.int64)
+
+    @classmethod
+    def construir(cls, df_index, df_itens):
+        """
+        Cria os índices; os documentos são as linhas de df_index e os itens
+        são associados a eles pelo nome do arquivo
+        """
+        indice = cls()
+        if df_itens is None or len(df_itens) == 0:
+            return indice
+
+        itens = df_itens.assign(doc=docs_dos_itens(df_index, df_itens))
+        itens = itens[itens['doc'] >= 0]
+
+        indice.cnpj_emitente = _agrupar(mapear_valores(itens['cnpj_emitente'], normalizar_cnpj), itens['doc'])
+        indice.cnpj_destinatario = _agrupar(mapear_valores(itens['cnpj_destinatario'], normalizar_cnpj), itens['doc'])
+        indice.ncm = _agrupar(mapear_valores(itens['NCM'], _digitos), itens['doc'])
+        indice.chave = _agrupar(itens['chave'].astype(object), itens['doc'])
+        indice._ncms_ordenados = sorted(indice.ncm)
+
+        # Uma entrada por nota para os índices ordenados
+        notas = itens.drop_duplicates(['doc', 'chave'])
+
+        com_data = notas.dropna(subset=['data_emissao']).sort_values('data_emissao')
+        indice._datas = com_data['data_emissao'].to_numpy(dtype='datetime64[ns]')
+        indice._docs_por_data = com_data['doc'].to_numpy(dtype=np.int64)
+
+        com_valor = notas.dropna(subset=['vNF']).sort_values('vNF')
+        indice._valores = com_valor['vNF'].to_numpy(dtype=np.float64)
+        indice._docs_por_valor = com_valor['doc'].to_numpy(dtype=np.int64)
+        return indice
+
+    def mesclar(self, outro, deslocamento):
+        """
+        Acrescenta os índices de outro segmento, cujos documentos passam a
+        começar em deslocamento. Os documentos novos vêm depois dos atuais,
+        então os arrays dos índices hash continuam ordenados, e os arrays de
+        data e valor são intercalados por busca binária
+        """
+        for atual, novo in ((self.cnpj_emitente, outro.cnpj_emitente),
+                            (self.cnpj_destinatario, outro.cnpj_destinatario),
+                            (self.ncm, outro.ncm),
+                            (self.chave, outro.chave)):
+            for valor, docs in novo.items():
+                docs = docs + deslocamento
+                if valor in atual:
+                    atual[valor] = np.concatenate([atual[valor], docs])
+                else:
+                    atual[valor] = docs
+                    if atual is self.ncm:
+                        insort(self._ncms_ordenados, valor)
+
+        posicoes = np.searchsorted(self._datas, outro._datas, side='right')
+        self._datas = np.insert(self._datas, posicoes, outro._datas)
+        self._docs_por_data = np.insert(self._docs_por_data, posicoes, outro._docs_por_data + deslocamento)
+
+        posicoes = np.searchsorted(self._valores, outro._valores, side='right')
+        self._valores = np.insert(self._valores, posicoes, outro._valores)
+        self._docs_por_valor = np.insert(self._docs_por_valor, posicoes, outro._docs_por_valor + deslocamento)
+
+    def colunas(self):
+        """
+        Os índices em arrays contíguos, para gravação: para cada campo hash,
+        os valores com os arrays de documentos concatenados (e o fim de cada
+        um), e os arrays ordenados de data e de valor
+        """
+        campos = {}
+        for campo in CAMPOS_HASH:
+            indice = getattr(self, campo)
+            valores = list(indice)
+            fins = np.zeros(len(valores) + 1, dtype=np.int64)
+            np.cumsum([len(indice[valor]) for valor in valores], out=fins[1:])
+            docs = np.concatenate([indice[valor] for valor in valores]) if valores else np.array([], dtype=np.int64)
+            campos[campo] = (valores, fins, docs)
+        return {
+            'campos': campos,
+            'datas': self._datas,
+            'docs_por_data': self._docs_por_data,
+            'valores': self._valores,
+            'docs_por_valor': self._docs_por_valor,
+        }
+
+    @classmethod
+    def de_colunas(cls, campos, datas, docs_por_data, valores, docs_por_valor):
+        """
+        Reabre os índices a partir do que colunas() retornou; os arrays de
+        documentos são fatias dos concatenados, sem cópia
+        """
+        indice = cls()
+        for campo, (chaves, fins, docs) in campos.items():
+            setattr(indice, campo, {valor: docs[fins[i]:fins[i + 1]] for i, valor in enumerate(chaves)})
+        indice._ncms_ordenados = sorted(indice.ncm)
+        indice._datas = np.asarray(datas, dtype='datetime64[ns]')
+        indice._docs_por_data = np.asarray(docs_por_data, dtype=np.int64)
+        indice._valores = np.asarray(valores, dtype=np.float64)
+        indice._docs_por_valor = np.asarray(docs_por_valor, dtype=np.int64)
+        return indice
+
+    def memoria(self):
+        """
+        Bytes ocupados pelos índices
+        """
+        total = sys.getsizeof(self._ncms_ordenados) + sum(
+            a.nbytes for a in (self._datas, self._docs_por_data, self._valores, self._docs_por_valor)
+        )
+        for indice in (getattr(self, campo) for campo in CAMPOS_HASH):
+            total += sys.getsizeof(indice) + sum(sys.getsizeof(valor) + docs.nbytes for valor, docs in indice.items())
+        return total
+
+    def _por_ncm(self, ncm):
+        """
+        Documentos com o NCM informado; "7318*" busca pelo prefixo. Prefixos
+        com menos de MINIMO_PREFIXO_NCM dígitos ("*", "7*") retornam None,
+        já que pegariam quase todas as notas
+        """
+        prefixo = ncm.endswith('*')
+        ncm = _digitos(ncm)
+        if prefixo and len(ncm) < MINIMO_PREFIXO_NCM:
+            return None
+        if not prefixo:
+            return self.ncm.get(ncm, np.array([], dtype=np.int64))
+
+        partes = []
+        i = bisect_left(self._ncms_ordenados, ncm)
+        while i < len(self._ncms_ordenados) and self._ncms_ordenados[i].startswith(ncm):
+            partes.append(self.ncm[self._ncms_ordenados[i]])
+            i += 1
+        return np.unique(np.concatenate(partes)) if partes else np.array([], dtype=np.int64)
+
+    @staticmethod
+    def _intervalo(ordenados, docs, minimo, maximo):
+        inicio = np.searchsorted(ordenados, minimo, side='left') if minimo is not None else 0
+        fim = np.searchsorted(ordenados, maximo, side='right') if maximo is not None else len(ordenados)
+        return np.unique(docs[inicio:fim])
+
+    def filtrar(self, cnpj_emitente=None, cnpj_destinatario=None, ncm=None, chave=None,
+                data_inicio=None, data_fim=None, valor_minimo=None, valor_maximo=None):
+        """
+        Retorna o array ordenado dos documentos que atendem a todos os
+        filtros informados, ou None se nenhum filtro foi informado
+        """
+        vazio = np.array([], dtype=np.int64)
+        conjuntos = []
+        if cnpj_emitente:
+            conjuntos.append(self.cnpj_emitente.get(normalizar_cnpj(cnpj_emitente), vazio))
+        if cnpj_destinatario:
+            conjuntos.append(self.cnpj_destinatario.get(normalizar_cnpj(cnpj_destinatario), vazio))
+        if ncm and (por_ncm := self._por_ncm(ncm.strip())) is not None:
+            conjuntos.append(por_ncm)
+        if chave:
+            conjuntos.append(self.chave.get(_digitos(chave), vazio))
+        if data_inicio is not None or data_fim is not None:
+            # A data final é inclusiva: vale até o fim do dia
+            minimo = np.datetime64(pd.Timestamp(data_inicio), 'ns') if data_inicio is not None else None
+            maximo = (np.datetime64(pd.Timestamp(data_fim) + pd.Timedelta(days=1), 'ns') - np.timedelta64(1, 'ns')
+                      if data_fim is not None else None)
+            conjuntos.append(self._intervalo(self._datas, self._docs_por_data, minimo, maximo))
+        if valor_minimo is not None or valor_maximo is not None:
+            conjuntos.append(self._intervalo(self._valores, self._docs_por_valor, valor_minimo, valor_maximo))
+
+        if not conjuntos:
+            return None
+
+        resultado = conjuntos[0]
+        for conjunto in conjuntos[1:]:
+            resultado = np.intersect1d(resultado, conjunto, assume_unique=True)
+        return resultado
@@ -0,0 +1,176 @@
+"""
+Indexa uma pasta de notas fiscais (PDF e XML) sem passar pela interface.
+
+Uso:
+    python indexador.py PASTA [--indice notas.idx] [--processos N] [--medicoes medicoes.csv]
+
+Nas execuções seguintes só os arquivos novos ou alterados (pelo horário de
+modificação e tamanho e, em caso de dúvida, pelo hash do conteúdo) são
+extraídos e mesclados no índice anterior; os dos arquivos apagados ou
+alterados saem dos resultados, e o índice é compactado quando eles se
+acumulam. Com um caminho terminado em .parquet, o índice é gravado como
+instantâneo em Parquet (veja instantaneo.py). Para abrir o índice no app,
+defina BUSCA_NF_INDICE com o caminho gerado.
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+from cache_texto import extrair_com_cache, hash_conteudo
+from duplicados import AgrupadorDuplicados
+from indice_notas import IndiceNotas
+from instrumentacao import tabela_medicoes
+
+EXTENSOES = ('.pdf', '.xml')
+
+# Quantidade de arquivos extraídos por lote
+TAMANHO_LOTE = 256
+
+# Quando os documentos fora dos resultados (removidos ou substituídos)
+# passam desta fração do índice, ele é refeito só com os visíveis
+FRACAO_COMPACTACAO = 0.25
+
+
+def listar_arquivos(pasta):
+    """
+    Lista os PDFs e XMLs da pasta e subpastas, em ordem
+    """
+    for raiz, _, nomes in os.walk(pasta):
+        for nome in sorted(nomes):
+            if nome.lower().endswith(EXTENSOES):
+                yield Path(raiz) / nome
+
+
+def indexar_pasta(pasta, caminho_indice, num_processos=None, saida=print, caminho_medicoes=None):
+    """
+    Atualiza o índice da pasta: os documentos de arquivos apagados ou
+    alterados saem do índice e só os arquivos novos ou alterados são
+    extraídos e mesclados nele. Retorna o índice gravado
+    """
+    pasta = Path(pasta).resolve()
+    indice = IndiceNotas()
+    if os.path.exists(caminho_indice):
+        try:
+            indice = IndiceNotas.carregar(caminho_indice)
+        except ValueError as e:
+            saida(f"{e}; o índice será refeito")
+
+    # Caminho de cada arquivo do índice -> (documento, nome se for vinculado);
+    # os documentos sem caminho não são da pasta
+    indexados = {}
+    sem_caminho = set()
+    documentos = indice.df_index
+    for doc, (caminho, copias) in enumerate(zip(documentos['caminho'], documentos['copias'])):
+        if doc in indice.ocultos:
+            continue
+        if not caminho:
+            sem_caminho.add(doc)
+            continue
+        indexados[caminho] = (doc, None)
+        for copia in copias:
+            if copia.get('caminho'):
+                indexados[copia['caminho']] = (doc, copia['arquivo'])
+
+    manifesto = {}
+    mantidos = set()
+    pendentes = []
+    for caminho in listar_arquivos(pasta):
+        info = caminho.stat()
+        chave = str(caminho)
+        estado = indice.manifesto.get(chave)
+
+        if estado and estado[:2] == (info.st_mtime_ns, info.st_size) and chave in indexados:
+            manifesto[chave] = estado
+            mantidos.add(chave)
+            continue
+
+        # Horário ou tamanho mudaram: confirma pelo hash antes de extrair
+        hash_atual = hash_conteudo(caminho.read_bytes())
+        manifesto[chave] = (info.st_mtime_ns, info.st_size, hash_atual)
+        if estado and estado[2] == hash_atual and chave in indexados:
+            mantidos.add(chave)
+        else:
+            pendentes.append(caminho)
+
+    # Saem do índice os arquivos apagados ou alterados; as cópias de um
+    # documento que saiu são extraídas de novo
+    removidos = sem_caminho | {
+        doc for caminho, (doc, nome) in indexados.items() if nome is None and caminho not in mantidos
+    }
+    vinculados = []
+    for caminho, (doc, nome) in indexados.items():
+        if nome is None:
+            continue
+        if caminho not in mantidos:
+            vinculados.append(nome)
+        elif doc in removidos:
+            mantidos.discard(caminho)
+            pendentes.append(Path(caminho))
+    saida(f"{len(mantidos)} inalterado(s), {len(pendentes)} novo(s) ou alterado(s), "
+          f"{len(set(indice.manifesto) - set(manifesto))} removido(s)")
+    indice.remover(removidos, vinculados)
+
+    if len(indice.ocultos) > FRACAO_COMPACTACAO * len(indice):
+        saida(f"Compactando o índice ({len(indice.ocultos)} de {len(indice)} documento(s) fora dos resultados)")
+        indice = indice.compactar()
+
+    resultados = []
+    erros = 0
+    medicoes = []
+    for inicio in range(0, len(pendentes), TAMANHO_LOTE):
+        lote = pendentes[inicio:inicio + TAMANHO_LOTE]
+        # Os processos de extração leem os arquivos direto da pasta
+        entradas = [(caminho.relative_to(pasta).as_posix(), caminho) for caminho in lote]
+        hashes = [manifesto[str(caminho)][2] for caminho in lote]
+        for i, resultado, _ in extrair_com_cache(entradas, num_processos, hashes=hashes):
+            medicoes.extend(resultado.get('medicoes', []))
+            if resultado['erro']:
+                erros += 1
+                saida(f"Erro ao processar {resultado['arquivo']}: {resultado['erro']}")
+                # Sem registro no manifesto, o arquivo é tentado de novo na próxima execução
+                manifesto.pop(str(lote[i]), None)
+                continue
+            if not resultado['conteudo'] and not resultado.get('duplicado'):
+                saida(f"Nenhum texto extraído de {resultado['arquivo']}")
+            resultado['caminho'] = str(lote[i])
+            resultados.append(resultado)
+        saida(f"{min(inicio + TAMANHO_LOTE, len(pendentes))} de {len(pendentes)} arquivo(s) extraído(s)")
+
+    # Os arquivos novos são classificados contra os que já estão no índice
+    agrupador = AgrupadorDuplicados()
+    agrupador.reiniciar(indice.arquivos())
+    indice.mesclar(IndiceNotas.de_resultados(resultados, agrupador=agrupador))
+    indice.manifesto = manifesto
+    indice.salvar(caminho_indice)
+    saida(f"Índice gravado em {caminho_indice}: {len(indice) - len(indice.ocultos)} nota(s), "
+          f"{indice.duplicados} arquivo(s) "
+          f"vinculado(s) como cópia, {erros} erro(s), {sum(indice.memoria().values()) / 1e6:.1f} MB em memória")
+
+    if caminho_medicoes:
+        df = tabela_medicoes(medicoes)
+        if caminho_medicoes.lower().endswith('.csv'):
+            df.to_csv(caminho_medicoes, index=False)
+        else:
+            df.to_json(caminho_medicoes, orient='records', force_ascii=False, indent=2)
+        saida(f"Medições gravadas em {caminho_medicoes}")
+    return indice
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pasta', help='pasta com as notas fiscais')
+    parser.add_argument('--indice', default='notas.idx', help='arquivo do índice (padrão: notas.idx)')
+    parser.add_argument('--processos', type=int, help='processos usados na extração')
+    parser.add_argument('--medicoes', help='grava o tempo de cada etapa por arquivo (.json ou .csv)')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.pasta):
+        parser.error(f"pasta não encontrada: {args.pasta}")
+
+    indexar_pasta(args.pasta, args.indice, args.processos, caminho_medicoes=args.medicoes)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,528 @@
+import math
+import re
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping
+from itertools import islice
+
+import numpy as np
+
+# Sequências de letras ou de dígitos; "NFe3519" vira "nfe" e "3519"
+PADRAO_TOKEN = re.compile(r'[^\W\d_]+|\d+')
+
+# Tamanho mínimo do termo para a busca aproximada pontuar as palavras que
+# começam por ele (abreviações como "sext") e as que diferem dele por
+# poucas letras (erros de digitação como "parafsuo"); termos mais curtos
+# casariam com palavras demais
+MINIMO_PREFIXO = 3
+MINIMO_EDICAO = 5
+
+
+def _montar_tabela_dobra():
+    """
+    Monta a tabela que troca cada caractere latino pela sua forma minúscula
+    e sem acento, sempre por exatamente um caractere
+    """
+    tabela = {}
+    for codigo in range(0x250):
+        caractere = chr(codigo)
+        base = ''.join(
+            c for c in unicodedata.normalize('NFKD', caractere.lower())
+            if not unicodedata.combining(c)
+        )
+        if len(base) == 1 and base != caractere:
+            tabela[codigo] = base
+        elif len(base) != 1 and len(caractere.lower()) == 1 and caractere.lower() != caractere:
+            tabela[codigo] = caractere.lower()
+    return tabela
+
+
+TABELA_DOBRA = _montar_tabela_dobra()
+
+
+def dobrar_texto(texto):
+    """
+    Converte o texto para minúsculas e remove os acentos, mantendo o mesmo
+    comprimento para que as posições valham também no texto original
+    """
+    return texto.translate(TABELA_DOBRA)
+
+
+def tokenizar(texto):
+    """
+    Retorna a lista de (token, início) do texto já dobrado
+    """
+    return [(m.group(), m.start()) for m in PADRAO_TOKEN.finditer(texto)]
+
+
+def trigramas(token):
+    """
+    Conjunto de trigramas de caracteres do token, com espaços nas bordas
+    para que o início e o fim da palavra também contem
+    """
+    token = f"  {token} "
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def distancia_edicao(a, b):
+    """
+    Quantidade de letras inseridas, removidas, trocadas ou de pares vizinhos
+    invertidos para transformar a em b
+    """
+    anterior, atual = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        anterior, atual, penultima = atual, [i] + [0] * len(b), anterior
+        for j in range(1, len(b) + 1):
+            atual[j] = min(anterior[j] + 1, atual[j - 1] + 1, anterior[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                atual[j] = min(atual[j], penultima[j - 2] + 1)
+    return atual[-1]
+
+
+def similaridade_termo(termo, token, comuns, tamanho_termo, tamanho_token):
+    """
+    Similaridade entre o termo e a palavra a partir dos trigramas em comum:
+    o coeficiente de Jaccard, ou a fração dos trigramas do termo presentes
+    na palavra quando ela começa pelo termo (abreviação), ou 1 menos a
+    distância de edição relativa (erro de digitação), o que for maior
+    """
+    similaridade = comuns / (tamanho_termo + tamanho_token - comuns)
+    if len(termo) >= MINIMO_PREFIXO and token.startswith(termo):
+        similaridade = max(similaridade, comuns / tamanho_termo)
+    if len(termo) >= MINIMO_EDICAO:
+        similaridade = max(similaridade, 1 - distancia_edicao(termo, token) / max(len(termo), len(token)))
+    return similaridade
+
+
+def _concatenar(listas):
+    """
+    Junta arrays('I') em um só, com o fim de cada um (fins[0] == 0)
+    """
+    fins = np.zeros(len(listas) + 1, dtype=np.int64)
+    np.cumsum([len(lista) for lista in listas], out=fins[1:])
+    return fins, np.frombuffer(b''.join(listas), dtype=np.uint32)
+
+
+def _array(valores):
+    lista = array('I')
+    lista.frombytes(np.ascontiguousarray(valores, dtype=np.uint32).data.cast('B'))
+    return lista
+
+
+class PostingsGravados(MutableMapping):
+    """
+    Postings lidos de um instantâneo, no lugar do dicionário token ->
+    array('I'): as listas de todos os tokens ficam concatenadas como foram
+    lidas e cada uma só vira array('I') quando o token é consultado pela
+    primeira vez. Os tokens acrescentados depois (mesclar) ficam só no
+    dicionário
+    """
+
+    def __init__(self, tokens, fins, valores):
+        self._linhas = dict(zip(tokens, range(len(tokens))))
+        self._fins = fins
+        self._valores = valores
+        self._listas = {}
+        self._novos = []
+
+    def __getitem__(self, token):
+        lista = self._listas.get(token)
+        if lista is None:
+            linha = self._linhas[token]
+            lista = self._listas[token] = _array(self._valores[self._fins[linha]:self._fins[linha + 1]])
+        return lista
+
+    def __setitem__(self, token, lista):
+        if token not in self:
+            self._novos.append(token)
+        self._listas[token] = lista
+
+    def __delitem__(self, token):
+        raise TypeError("Os postings gravados não removem tokens")
+
+    def __contains__(self, token):
+        return token in self._linhas or token in self._listas
+
+    def __iter__(self):
+        yield from self._linhas
+        yield from self._novos
+
+    def __reversed__(self):
+        yield from reversed(self._novos)
+        yield from reversed(self._linhas)
+
+    def __len__(self):
+        return len(self._linhas) + len(self._novos)
+
+    def memoria(self):
+        """
+        Bytes das listas lidas e das já convertidas, sem converter as demais
+        """
+        return (
+            self._valores.nbytes + self._fins.nbytes + sys.getsizeof(self._linhas)
+            + sum(sys.getsizeof(token) for token in self._linhas)
+            + sys.getsizeof(self._listas) + sum(sys.getsizeof(lista) for lista in self._listas.values())
+        )
+
+
+class IndiceTrigramas:
+    """
+    Índice de trigramas do vocabulário, para encontrar as palavras parecidas
+    com um termo (erros de OCR e de digitação, abreviações) sem comparar o
+    termo com todo o vocabulário
+    """
+
+    def __init__(self):
+        self.tokens = []
+        self._num_trigramas = array('I')
+        self._por_trigrama = {}
+
+    def adicionar(self, token):
+        """
+        Indexa uma palavra nova do vocabulário; números não são indexados
+        """
+        if not token[0].isalpha():
+            return
+        numero = len(self.tokens)
+        self.tokens.append(token)
+        conjunto = trigramas(token)
+        self._num_trigramas.append(len(conjunto))
+        for trigrama in conjunto:
+            self._por_trigrama.setdefault(trigrama, array('I')).append(numero)
+
+    def similares(self, termo, similaridade_minima=0.4, limite=20):
+        """
+        Retorna até limite palavras do vocabulário como [(palavra,
+        similaridade)], da mais parecida para a menos. A similaridade é o
+        de similaridade_termo(): o coeficiente de Jaccard entre os conjuntos
+        de trigramas, ou mais para abreviações e erros de digitação.
+
+        Com similaridade s, a palavra precisa ter pelo menos s * n dos n
+        trigramas do termo, então aparece em alguma das n - ceil(s * n) + 1
+        listas mais curtas. Só as palavras dessas listas são pontuadas, e o
+        custo depende delas e não do tamanho do vocabulário
+        """
+        conjunto = trigramas(termo)
+        listas = sorted(
+            (np.frombuffer(self._por_trigrama[t], dtype=np.uint32) for t in conjunto if t in self._por_trigrama),
+            key=len
+        )
+        # Trigramas em comum necessários (a tolerância evita que 0.4 * 5
+        # arredonde para 3)
+        minimo = max(1, math.ceil(similaridade_minima * len(conjunto) - 1e-9))
+        if len(listas) < minimo:
+            return []
+
+        candidatos = np.unique(np.concatenate(listas[:len(listas) - minimo + 1]))
+        # As listas estão em ordem (as palavras são numeradas ao entrar)
+        comuns = np.zeros(len(candidatos), dtype=np.int64)
+        for lista in listas:
+            posicoes = np.minimum(np.searchsorted(lista, candidatos), len(lista) - 1)
+            comuns += lista[posicoes] == candidatos
+        tamanhos = np.frombuffer(self._num_trigramas, dtype=np.uint32)[candidatos]
+        similaridade = comuns / (len(conjunto) + tamanhos.astype(np.int64) - comuns)
+        # As que têm os trigramas necessários podem ser abreviações ou erros
+        # de digitação do termo, mais parecidas do que o Jaccard indica
+        if len(termo) >= MINIMO_PREFIXO:
+            for i in np.flatnonzero(comuns >= minimo):
+                similaridade[i] = similaridade_termo(
+                    termo, self.tokens[candidatos[i]], comuns[i], len(conjunto), tamanhos[i]
+                )
+
+        encontrados = np.flatnonzero(similaridade >= similaridade_minima)
+        if len(encontrados) > limite:
+            encontrados = encontrados[np.argpartition(similaridade[encontrados], -limite)[-limite:]]
+        encontrados = encontrados[np.lexsort((candidatos[encontrados], -similaridade[encontrados]))]
+        return [(self.tokens[candidatos[i]], float(similaridade[i])) for i in encontrados]
+
+    def colunas(self):
+        """
+        O índice em arrays contíguos, para gravação: as palavras com a
+        quantidade de trigramas de cada uma, e os trigramas em ordem com as
+        listas de palavras concatenadas
+        """
+        trigramas = sorted(self._por_trigrama)
+        fins, valores = _concatenar([self._por_trigrama[t] for t in trigramas])
+        return {
+            'palavras': self.tokens,
+            'num_trigramas': np.frombuffer(self._num_trigramas, dtype=np.uint32),
+            'trigramas': trigramas,
+            'fins': fins,
+            'valores': valores,
+        }
+
+    @classmethod
+    def de_colunas(cls, palavras, num_trigramas, trigramas, fins, valores):
+        """
+        Reabre o índice a partir do que colunas() retornou
+        """
+        indice = cls()
+        indice.tokens = list(palavras)
+        indice._num_trigramas = _array(num_trigramas)
+        indice._por_trigrama = {
+            trigrama: _array(valores[fins[i]:fins[i + 1]]) for i, trigrama in enumerate(trigramas)
+        }
+        return indice
+
+    def memoria(self):
+        """
+        Bytes ocupados pelo índice (as palavras são as mesmas do índice
+        invertido e não são contadas de novo)
+        """
+        return (
+            sys.getsizeof(self.tokens) + sys.getsizeof(self._num_trigramas) + sys.getsizeof(self._por_trigrama)
+            + sum(sys.getsizeof(t) + sys.getsizeof(lista) for t, lista in self._por_trigrama.items())
+        )
+
+
+class IndiceInvertido:
+    """
+    Índice invertido do conteúdo das notas. Para cada token guarda os
+    documentos e as posições em que ele aparece, e para cada documento a
+    posição de cada token no texto, para devolver os trechos encontrados.
+
+    Tudo fica em arrays de inteiros de 4 bytes, sem um objeto Python por
+    par token/documento: cada token tem um único array com blocos
+    [doc, quantidade, posições...], e os inícios dos tokens de todos os
+    documentos ficam em outro array, com os limites de cada documento
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._inicios = array('I')
+        self._limites = array('Q', [0])
+        # Tokens em ordem, para a busca por prefixo, e quantos dos tokens de
+        # _postings (na ordem de inclusão) já estão nela
+        self._vocabulario = ([], 0)
+        self._trigramas = IndiceTrigramas()
+
+    @classmethod
+    def construir(cls, textos):
+        """
+        Cria o índice a partir de uma sequência de textos; o documento i
+        corresponde ao i-ésimo texto
+        """
+        indice = cls()
+        for texto in textos:
+            indice.adicionar(texto)
+        return indice
+
+    def __len__(self):
+        return len(self._limites) - 1
+
+    def _lista(self, token):
+        lista = self._postings.get(token)
+        if lista is None:
+            lista = self._postings[token] = array('I')
+            self._trigramas.adicionar(token)
+        return lista
+
+    def adicionar(self, texto):
+        """
+        Indexa um novo documento e retorna o seu número
+        """
+        doc = len(self)
+        por_token = {}
+        for posicao, (token, inicio) in enumerate(tokenizar(dobrar_texto(texto or ''))):
+            self._inicios.append(inicio)
+            por_token.setdefault(token, [doc, 0]).append(posicao)
+        self._limites.append(len(self._inicios))
+        for token, bloco in por_token.items():
+            bloco[1] = len(bloco) - 2
+            self._lista(token).extend(bloco)
+        return doc
+
+    def mesclar(self, outro):
+        """
+        Acrescenta os documentos de outro índice, renumerados a partir do fim
+        deste, sem reindexar os textos
+        """
+        deslocamento = len(self)
+        base = len(self._inicios)
+        for token, lista in outro._postings.items():
+            destino = self._lista(token)
+            i = 0
+            while i < len(lista):
+                fim = i + 2 + lista[i + 1]
+                destino.append(lista[i] + deslocamento)
+                destino.extend(lista[i + 1:fim])
+                i = fim
+        self._inicios.extend(outro._inicios)
+        self._limites.frombytes((np.frombuffer(outro._limites, dtype=np.uint64)[1:] + base).tobytes())
+
+    def _por_documento(self, token):
+        """
+        Percorre (doc, posições) do token
+        """
+        lista = self._postings[token]
+        i = 0
+        while i < len(lista):
+            fim = i + 2 + lista[i + 1]
+            yield lista[i], lista[i + 2:fim]
+            i = fim
+
+    def _trechos(self, doc, posicoes):
+        """
+        Converte {posição: comprimento} dos tokens do documento nos trechos
+        (início, fim) do texto original, em ordem
+        """
+        base = self._limites[doc]
+        return sorted(
+            (self._inicios[base + p], self._inicios[base + p] + comprimento)
+            for p, comprimento in posicoes.items()
+        )
+
+    def colunas(self):
+        """
+        O índice em arrays contíguos, para gravação: os tokens em ordem com
+        as listas de postings concatenadas (e o fim de cada uma), os inícios
+        dos tokens de todos os documentos com os limites de cada documento,
+        e as colunas do índice de trigramas
+        """
+        tokens = sorted(self._postings)
+        fins, valores = _concatenar([self._postings[token] for token in tokens])
+        return {
+            'tokens': tokens,
+            'fins': fins,
+            'valores': valores,
+            'inicios': np.frombuffer(self._inicios, dtype=np.uint32),
+            'limites': np.frombuffer(self._limites, dtype=np.uint64),
+            'trigramas': self._trigramas.colunas(),
+        }
+
+    @classmethod
+    def de_colunas(cls, tokens, fins, valores, inicios, limites, trigramas):
+        """
+        Reabre o índice a partir do que colunas() retornou. Os postings não
+        são convertidos na abertura, só conforme os tokens são buscados
+        """
+        indice = cls()
+        indice._postings = PostingsGravados(tokens, fins, valores)
+        indice._vocabulario = (list(tokens), len(tokens))
+        indice._inicios = _array(inicios)
+        indice._limites = array('Q')
+        indice._limites.frombytes(np.ascontiguousarray(limites, dtype=np.uint64).tobytes())
+        indice._trigramas = IndiceTrigramas.de_colunas(**trigramas)
+        return indice
+
+    def memoria(self):
+        """
+        Bytes ocupados pelo índice invertido e pelo de trigramas
+        """
+        if isinstance(self._postings, PostingsGravados):
+            postings = self._postings.memoria()
+        else:
+            postings = sys.getsizeof(self._postings) + sum(
+                sys.getsizeof(token) + sys.getsizeof(lista)
+                for token, lista in self._postings.items()
+            )
+        return {
+            'indice_invertido': postings + sys.getsizeof(self._inicios) + sys.getsizeof(self._limites),
+            'trigramas': self._trigramas.memoria(),
+        }
+
+    def _tokens_com_prefixo(self, prefixo):
+        vocabulario, incluidos = self._vocabulario
+        if incluidos < len(self._postings):
+            # Os tokens novos são os últimos incluídos em _postings. O sort
+            # encontra as duas sequências já ordenadas e só as intercala, sem
+            # reordenar o vocabulário inteiro; a lista nova substitui a
+            # anterior de uma vez, porque várias buscas podem fazer isso juntas
+            novos = sorted(islice(reversed(self._postings), len(self._postings) - incluidos))
+            vocabulario = vocabulario + novos
+            vocabulario.sort()
+            self._vocabulario = (vocabulario, len(self._postings))
+        i = bisect_left(vocabulario, prefixo)
+        tokens = []
+        while i < len(vocabulario) and vocabulario[i].startswith(prefixo):
+            tokens.append(vocabulario[i])
+            i += 1
+        return tokens
+
+    def _ocorrencias(self, token, prefixo=False):
+        """
+        Retorna {doc: {posição: comprimento}} para o token (ou para todos os
+        tokens que começam com ele)
+        """
+        tokens = self._tokens_com_prefixo(token) if prefixo else [token]
+        ocorrencias = {}
+        for t in tokens:
+            if t not in self._postings:
+                continue
+            for doc, posicoes in self._por_documento(t):
+                por_posicao = ocorrencias.setdefault(doc, {})
+                for posicao in posicoes:
+                    por_posicao[posicao] = len(t)
+        return ocorrencias
+
+    def buscar(self, consulta, prefixo=True):
+        """
+        Busca a consulta como frase: os termos devem aparecer em sequência e
+        o último pode ser só o início de uma palavra (a não ser com
+        prefixo=False). Retorna
+        {doc: [(início, fim), ...]} com as posições no texto original
+        """
+        termos = [token for token, _ in tokenizar(dobrar_texto(consulta))]
+        if not termos:
+            return {}
+
+        primeiras = self._ocorrencias(termos[0], prefixo=prefixo and len(termos) == 1)
+        if len(termos) == 1:
+            return {doc: self._trechos(doc, posicoes) for doc, posicoes in primeiras.items()}
+
+        seguintes = [
+            self._ocorrencias(termo, prefixo=prefixo and n == len(termos) - 1)
+            for n, termo in enumerate(termos[1:], start=1)
+        ]
+        resultado = {}
+        for doc, posicoes in primeiras.items():
+            if not all(doc in ocorrencias for ocorrencias in seguintes):
+                continue
+            trechos = []
+            for p in sorted(posicoes):
+                ultimo = seguintes[-1][doc].get(p + len(seguintes))
+                if ultimo is None:
+                    continue
+                if all(p + n in ocorrencias[doc] for n, ocorrencias in enumerate(seguintes[:-1], start=1)):
+                    base = self._limites[doc]
+                    inicio = self._inicios[base + p]
+                    fim = self._inicios[base + p + len(seguintes)] + ultimo
+                    trechos.append((inicio, fim))
+            if trechos:
+                resultado[doc] = trechos
+        return resultado
+
+    def buscar_aproximado(self, consulta, limite=50, similaridade_minima=0.4):
+        """
+        Busca tolerante a erros: cada termo casa com as palavras de
+        vocabulário mais parecidas (índice de trigramas) e os documentos são
+        pontuados pela média da melhor similaridade de cada termo. Retorna
+        {doc: [(início, fim), ...]} com os limite melhores documentos, do
+        mais parecido para o menos
+        """
+        termos = [token for token, _ in tokenizar(dobrar_texto(consulta))]
+        if not termos:
+            return {}
+
+        pontos = {}
+        posicoes = {}
+        for termo in termos:
+            if termo[0].isalpha():
+                variantes = self._trigramas.similares(termo, similaridade_minima)
+            else:
+                variantes = [(termo, 1.0)] if termo in self._postings else []
+            melhor = {}
+            for token, similaridade in variantes:
+                for doc, ocorrencias in self._por_documento(token):
+                    if similaridade > melhor.get(doc, 0.0):
+                        melhor[doc] = similaridade
+                    trechos = posicoes.setdefault(doc, {})
+                    for p in ocorrencias:
+                        trechos[p] = len(token)
+            for doc, similaridade in melhor.items():
+                pontos[doc] = pontos.get(doc, 0.0) + similaridade / len(termos)
+
+        melhores = sorted(pontos, key=lambda doc: (-pontos[doc], doc))[:limite]
+        return {doc: self._trechos(doc, posicoes[doc]) for doc in melhores}
@@ -0,0 +1,195 @@
+import contextlib
+import os
+import queue
+import threading
+import weakref
+
+from armazem import ArmazemDocumentos
+from duplicados import AgrupadorDuplicados
+from indice_notas import IndiceNotas
+from segundo_plano import IndexacaoEmSegundoPlano
+
+# Tempo máximo (em segundos) que o escritor espera por um segmento antes de
+# conferir se a indexação terminou
+ESPERA_SEGMENTO = 0.5
+
+# Instantâneo em Parquet do índice compartilhado (diretório terminado em
+# .parquet): restaurado quando o servidor inicia e regravado depois de cada
+# lote indexado
+CAMINHO_INSTANTANEO = os.environ.get('BUSCA_NF_INSTANTANEO')
+
+
+class TravaLeituraEscrita:
+    """
+    Várias leituras ao mesmo tempo ou uma escrita sozinha. Uma escrita à
+    espera bloqueia as leituras novas, para que buscas seguidas não a adiem
+    indefinidamente; por isso a mesma thread não deve abrir uma leitura
+    dentro de outra
+    """
+
+    def __init__(self):
+        self._condicao = threading.Condition()
+        self._leitores = 0
+        self._escrevendo = False
+        self._escritores_esperando = 0
+
+    @contextlib.contextmanager
+    def leitura(self):
+        with self._condicao:
+            while self._escrevendo or self._escritores_esperando:
+                self._condicao.wait()
+            self._leitores += 1
+        try:
+            yield
+        finally:
+            with self._condicao:
+                self._leitores -= 1
+                if not self._leitores:
+                    self._condicao.notify_all()
+
+    @contextlib.contextmanager
+    def escrita(self):
+        with self._condicao:
+            self._escritores_esperando += 1
+            while self._escrevendo or self._leitores:
+                self._condicao.wait()
+            self._escritores_esperando -= 1
+            self._escrevendo = True
+        try:
+            yield
+        finally:
+            with self._condicao:
+                self._escrevendo = False
+                self._condicao.notify_all()
+
+
+class IndiceCompartilhado:
+    """
+    Índice único do processo, compartilhado por todas as sessões do app.
+    As sessões enviam arquivos com enviar() e buscam dentro de leitura();
+    uma única thread escritora executa as indexações, uma de cada vez, e
+    mescla os segmentos no índice com a trava de escrita. Arquivos cujo
+    conteúdo já foi enviado (por qualquer sessão) não são extraídos de novo.
+    Com um caminho de instantâneo, o índice sobrevive aos reinícios
+    """
+
+    def __init__(self, num_processos=None, armazem=None, caminho_instantaneo=CAMINHO_INSTANTANEO):
+        self.indice = IndiceNotas()
+        self.armazem = armazem or ArmazemDocumentos()
+        self.caminho_instantaneo = caminho_instantaneo
+        # Problema ao abrir ou gravar o instantâneo, para exibir no app
+        self.aviso = None
+        self.trava = TravaLeituraEscrita()
+        self._num_processos = num_processos
+        self._agrupador = AgrupadorDuplicados()
+        self._enviados = set()
+        # Hashes enviados que a indexação ainda não leu do armazém
+        self._na_fila = set()
+        self._concluidas = weakref.WeakSet()
+        self._fila = queue.Queue()
+        self._mutex = threading.Lock()
+        self._escritor = threading.Thread(target=self._escrever, name='indice-compartilhado', daemon=True)
+        if caminho_instantaneo and os.path.exists(caminho_instantaneo):
+            try:
+                self.indice = IndiceNotas.carregar(caminho_instantaneo)
+            except ValueError as e:
+                self.aviso = f"{e}; o índice compartilhado começa vazio"
+            else:
+                self._restaurar()
+
+    def _restaurar(self):
+        """
+        Refaz, a partir do índice aberto do instantâneo, o que fica fora
+        dele: os hashes já enviados e os grupos de duplicados
+        """
+        for arquivo in self.indice.arquivos():
+            self._agrupador.classificar(arquivo)
+            if arquivo.get('hash'):
+                self._enviados.add(arquivo['hash'])
+
+    def leitura(self):
+        """
+        Trava de leitura do índice; use como with compartilhado.leitura():
+        """
+        return self.trava.leitura()
+
+    def enviar(self, entradas, hashes):
+        """
+        Coloca na fila de indexação os arquivos [(nome, caminho)] cujo hash
+        ainda não foi enviado. Retorna a IndexacaoEmSegundoPlano do lote,
+        para acompanhar o andamento, e a quantidade de arquivos ignorados
+        por já estarem no índice
+        """
+        with self._mutex:
+            novos = []
+            for entrada, hash_arquivo in zip(entradas, hashes):
+                if hash_arquivo not in self._enviados:
+                    self._enviados.add(hash_arquivo)
+                    self._na_fila.add(hash_arquivo)
+                    novos.append((entrada, hash_arquivo))
+            if self._escritor.ident is None:
+                self._escritor.start()
+
+        lote = IndexacaoEmSegundoPlano(
+            [entrada for entrada, _ in novos], [h for _, h in novos], self._num_processos, agrupador=self._agrupador
+        )
+        self._fila.put((lote, {entrada[0]: h for entrada, h in novos}))
+        return lote, len(entradas) - len(novos)
+
+    def limpar_armazem(self):
+        """
+        Remove do armazém os arquivos menos usados além do tamanho máximo,
+        menos os que ainda esperam a indexação. Os documentos cujo arquivo
+        saiu do armazém continuam no índice, mas sem download
+        """
+        with self._mutex:
+            na_fila = set(self._na_fila)
+        self.armazem.limpar(na_fila)
+
+    def concluida(self, lote):
+        """
+        Indica se todos os documentos do lote já estão no índice
+        """
+        return lote in self._concluidas
+
+    def _escrever(self):
+        while True:
+            lote, hash_por_nome = self._fila.get()
+            indexados = set()
+            try:
+                lote.iniciar()
+                while not lote.terminada:
+                    for segmento in lote.segmentos(espera=ESPERA_SEGMENTO):
+                        hashes = segmento.hashes()
+                        with self.trava.escrita():
+                            self.indice.mesclar(segmento)
+                        indexados |= hashes
+            except Exception as e:
+                lote.cancelar()
+                lote.aguardar()
+                lote.erros.append(('', str(e)))
+                # O agrupador já classificou os arquivos dos segmentos que não
+                # foram mesclados; ele volta a conhecer só os do índice
+                self._agrupador.reiniciar(self.indice.arquivos())
+            finally:
+                # Os arquivos que não chegaram ao índice (com erro, cancelados
+                # ou perdidos em uma falha do lote) podem ser enviados de novo
+                with self._mutex:
+                    self._enviados -= set(hash_por_nome.values()) - indexados
+                    self._na_fila -= set(hash_por_nome.values())
+                if indexados:
+                    self._gravar_instantaneo()
+                self._concluidas.add(lote)
+
+    def _gravar_instantaneo(self):
+        """
+        Regrava o instantâneo, se configurado. Só o escritor altera o índice,
+        então as buscas continuam durante a gravação
+        """
+        if not self.caminho_instantaneo:
+            return
+        try:
+            self.indice.salvar(self.caminho_instantaneo)
+            self.aviso = None
+        except Exception as e:
+            self.aviso = f"Erro ao gravar o instantâneo do índice: {e}"
@@ -0,0 +1,516 @@
+import os
+import pickle
+import sys
+import tempfile
+import zlib
+from array import array
+
+import numpy as np
+import pandas as pd
+
+from agregados import AgregadosCompras
+from consulta import buscar_consulta, composta
+from duplicados import AgrupadorDuplicados
+from extracao import concatenar_itens
+from filtros import IndiceFiltros, normalizar_cnpj
+from indice_busca import IndiceInvertido
+
+# Versão do formato do arquivo de índice
+VERSAO_INDICE = 7
+
+# Caminhos com esta extensão são gravados como instantâneo em Parquet (um
+# diretório) em vez de um único arquivo
+EXTENSAO_INSTANTANEO = '.parquet'
+
+# Nível de compressão zlib do texto dos documentos (0 guarda sem comprimir)
+NIVEL_COMPRESSAO_TEXTO = int(os.environ.get('BUSCA_NF_COMPRESSAO_TEXTO', 1))
+
+COLUNAS_DOCUMENTOS = ['arquivo', 'tipo', 'caminho', 'hash', 'chave', 'copias']
+TIPO_DOCUMENTO = pd.CategoricalDtype(['PDF', 'XML'])
+
+
+class TextosCompactados:
+    """
+    Texto extraído dos documentos, comprimido documento a documento e
+    guardado em um único buffer contíguo com o array dos fins de cada um.
+    A busca usa o índice invertido; o texto só é descomprimido para montar
+    os trechos das notas exibidas
+    """
+
+    def __init__(self, textos=(), nivel=NIVEL_COMPRESSAO_TEXTO):
+        self.nivel = nivel
+        self._dados = bytearray()
+        self._fins = array('Q')
+        self.tamanho_original = 0
+        for texto in textos:
+            self.adicionar(texto)
+
+    def __len__(self):
+        return len(self._fins)
+
+    @classmethod
+    def de_colunas(cls, dados, fins, tamanho_original, nivel=NIVEL_COMPRESSAO_TEXTO):
+        """
+        Reabre os textos a partir do que colunas() retornou; dados pode ser
+        qualquer buffer, que só é copiado se outros textos forem acrescentados
+        """
+        textos = cls(nivel=nivel)
+        textos._dados = dados
+        textos._fins.frombytes(np.ascontiguousarray(fins, dtype=np.uint64).tobytes())
+        textos.tamanho_original = tamanho_original
+        return textos
+
+    def colunas(self):
+        """
+        Os textos comprimidos concatenados e o fim de cada um, para gravação
+        """
+        return {'dados': self._dados, 'fins': np.frombuffer(self._fins, dtype=np.uint64)}
+
+    def _buffer_gravavel(self):
+        if not isinstance(self._dados, bytearray):
+            self._dados = bytearray(self._dados)
+        return self._dados
+
+    def adicionar(self, texto):
+        codificado = (texto or '').encode('utf-8')
+        self.tamanho_original += len(codificado)
+        dados = self._buffer_gravavel()
+        dados += zlib.compress(codificado, self.nivel)
+        self._fins.append(len(self._dados))
+
+    def estender(self, outros):
+        """
+        Acrescenta os textos de outro TextosCompactados sem descomprimi-los
+        """
+        base = len(self._dados)
+        dados = self._buffer_gravavel()
+        dados += outros._dados
+        self._fins.extend(fim + base for fim in outros._fins)
+        self.tamanho_original += outros.tamanho_original
+
+    def __getitem__(self, doc):
+        inicio = self._fins[doc - 1] if doc > 0 else 0
+        return zlib.decompress(self._dados[inicio:self._fins[doc]]).decode('utf-8')
+
+    def memoria(self):
+        dados = sys.getsizeof(self._dados) if isinstance(self._dados, bytearray) else memoryview(self._dados).nbytes
+        return dados + sys.getsizeof(self._fins)
+
+
+class IndiceNotas:
+    """
+    Reúne tudo o que a busca precisa: a tabela de documentos, a tabela de
+    itens das NFes, o índice invertido do texto, os índices dos filtros e
+    os totais de compra por produto, NCM, fornecedor e mês. Pode ser
+    gravado em disco e reaberto sem reprocessar os arquivos
+    """
+
+    def __init__(self, df_index=None, df_itens=None, manifesto=None, textos=None):
+        if df_index is None:
+            df_index = pd.DataFrame(columns=COLUNAS_DOCUMENTOS)
+        if textos is None:
+            textos = df_index['conteudo'] if 'conteudo' in df_index.columns else [''] * len(df_index)
+        for coluna in COLUNAS_DOCUMENTOS:
+            if coluna not in df_index.columns:
+                df_index[coluna] = None
+        self.df_index = df_index[COLUNAS_DOCUMENTOS].reset_index(drop=True)
+        self.df_index['tipo'] = self.df_index['tipo'].astype(TIPO_DOCUMENTO)
+        # Cada documento tem a própria lista de arquivos vinculados (cópias,
+        # DANFE do XML, reenvios); _copias guarda as mesmas listas por
+        # documento, para vincular sem concatenar a tabela
+        self.df_index['copias'] = [list(c) if isinstance(c, list) else [] for c in self.df_index['copias']]
+        self._copias = self.df_index['copias'].tolist()
+        self.df_itens = df_itens if df_itens is not None else concatenar_itens([])
+        # Estado dos arquivos indexados de uma pasta: caminho -> (mtime, tamanho, hash)
+        self.manifesto = manifesto or {}
+        # O texto é indexado e comprimido em uma só passada, sem ficar na tabela
+        self.textos = TextosCompactados()
+        self.busca = IndiceInvertido()
+        for texto in textos:
+            self.textos.adicionar(texto)
+            self.busca.adicionar(texto)
+        self.filtros = IndiceFiltros.construir(self.df_index, self.df_itens)
+        self.agregados = AgregadosCompras.construir(self.df_index, self.df_itens)
+        self._doc_por_hash = {h: doc for doc, h in enumerate(self.df_index['hash'].tolist()) if h}
+        # Documentos substituídos por outro da mesma nota (o PDF quando o XML
+        # chega depois); continuam nos índices, mas saem dos resultados
+        self.ocultos = set()
+        # Vínculos cujo documento principal ainda não está neste índice
+        self.pendentes = []
+
+    @property
+    def df_index(self):
+        """
+        Tabela de documentos. As tabelas dos segmentos mesclados só são
+        concatenadas quando ela é lida, uma vez para todos os segmentos
+        acumulados até então
+        """
+        if len(self._partes_index) > 1:
+            self._partes_index = [pd.concat(self._partes_index, ignore_index=True)]
+        return self._partes_index[0]
+
+    @df_index.setter
+    def df_index(self, df_index):
+        self._partes_index = [df_index]
+
+    @property
+    def df_itens(self):
+        """
+        Tabela de itens das NFes, concatenada como df_index
+        """
+        if len(self._partes_itens) > 1:
+            self._partes_itens = [concatenar_itens(self._partes_itens)]
+        return self._partes_itens[0]
+
+    @df_itens.setter
+    def df_itens(self, df_itens):
+        self._partes_itens = [df_itens]
+
+    def _documento(self, doc):
+        """
+        Linha do documento, sem concatenar as tabelas dos segmentos
+        """
+        for parte in self._partes_index:
+            if doc < len(parte):
+                return parte.iloc[doc]
+            doc -= len(parte)
+        raise IndexError(doc)
+
+    @classmethod
+    def de_resultados(cls, resultados, manifesto=None, agrupador=None):
+        """
+        Cria o índice a partir dos resultados da extração (dicionários com
+        arquivo, tipo, conteudo, itens e, opcionalmente, caminho, hash e
+        chave). Cada nota é indexada uma vez: as cópias idênticas e os
+        DANFEs de um XML ficam vinculados ao documento principal. O agrupador
+        pode ser compartilhado entre índices montados em partes
+        """
+        agrupador = agrupador or AgrupadorDuplicados()
+        # XMLs primeiro, para que sejam os principais das notas com DANFE
+        resultados = sorted((r for r in resultados if r is not None), key=lambda r: r.get('tipo') != 'XML')
+
+        novos = []
+        vinculos = []
+        for resultado in resultados:
+            evento, principal = agrupador.classificar(resultado)
+            if evento != 'copia':
+                novos.append(resultado)
+            if evento == 'copia':
+                vinculos.append((evento, principal, resultado))
+            elif evento == 'substitui':
+                vinculos.extend((evento, anterior, resultado) for anterior in principal)
+
+        df_index = pd.DataFrame(
+            [{coluna: r.get(coluna) for coluna in COLUNAS_DOCUMENTOS} for r in novos],
+            columns=COLUNAS_DOCUMENTOS
+        )
+        df_itens = concatenar_itens(r.get('itens') for r in novos)
+        indice = cls(df_index, df_itens, manifesto, textos=[r.get('conteudo') for r in novos])
+        indice.vincular(vinculos)
+        return indice
+
+    @classmethod
+    def de_partes(cls, df_index, df_itens, manifesto, textos, busca, filtros, agregados, ocultos=()):
+        """
+        Monta o índice com as partes já construídas (lidas do disco), sem
+        indexar o texto nem agregar os itens de novo
+        """
+        indice = cls(df_index, None, manifesto, textos=[])
+        indice.df_itens = df_itens
+        indice.textos = textos
+        indice.busca = busca
+        indice.filtros = filtros
+        indice.agregados = agregados
+        indice.ocultos = set(ocultos)
+        return indice
+
+    def colunas(self):
+        """
+        O índice em tabelas e arrays contíguos: é o que vai para o disco,
+        no .idx e no instantâneo em Parquet. de_colunas() o reabre sem
+        indexar nada de novo
+        """
+        return {
+            'documentos': self.df_index,
+            'itens': self.df_itens,
+            'manifesto': self.manifesto,
+            'ocultos': sorted(self.ocultos),
+            'textos': {**self.textos.colunas(), 'tamanho_original': self.textos.tamanho_original,
+                       'nivel': self.textos.nivel},
+            'busca': self.busca.colunas(),
+            'filtros': self.filtros.colunas(),
+            'agregados': self.agregados.colunas(),
+        }
+
+    @classmethod
+    def de_colunas(cls, colunas):
+        """
+        Reabre o índice a partir do que colunas() retornou
+        """
+        textos = colunas['textos']
+        return cls.de_partes(
+            colunas['documentos'], colunas['itens'], colunas['manifesto'],
+            TextosCompactados.de_colunas(textos['dados'], textos['fins'], textos['tamanho_original'], textos['nivel']),
+            IndiceInvertido.de_colunas(**colunas['busca']),
+            IndiceFiltros.de_colunas(**colunas['filtros']),
+            AgregadosCompras.de_colunas(**colunas['agregados']),
+            colunas['ocultos'],
+        )
+
+    def vincular(self, vinculos):
+        """
+        Aplica os vínculos (evento, hash do principal, resultado) produzidos
+        pelo AgrupadorDuplicados. Os que se referem a documentos ainda
+        ausentes ficam em pendentes
+        """
+        for vinculo in vinculos:
+            evento, principal, resultado = vinculo
+            doc = self._doc_por_hash.get(principal)
+            if evento == 'copia':
+                if doc is None:
+                    self.pendentes.append(vinculo)
+                    continue
+                self._copias[doc].append(_copia(resultado))
+            else:
+                # O novo principal herda o documento substituído e as cópias dele
+                novo = self._doc_por_hash.get(resultado.get('hash'))
+                if doc is None or novo is None:
+                    self.pendentes.append(vinculo)
+                    continue
+                copias = self._copias[novo]
+                copias.append(_copia(self._documento(doc)))
+                copias.extend(self._copias[doc])
+                self._copias[doc].clear()
+                self.ocultos.add(doc)
+
+    def pesquisar(self, termo='', aproximada=False, limite_aproximada=50, **filtros):
+        """
+        Busca o termo (na linguagem de consulta, ou aproximada) combinado com
+        os filtros de IndiceFiltros.filtrar. Retorna (docs, ocorrencias): o
+        array dos documentos visíveis, do mais relevante para o menos, e
+        {doc: [(início, fim), ...]}. Retorna None se não há termo nem filtro;
+        erros de sintaxe da consulta levantam ValueError
+        """
+        filtrados = self.filtros.filtrar(**filtros)
+        if not termo and filtrados is None:
+            return None
+
+        if termo and aproximada:
+            # Ordenados da nota mais parecida para a menos
+            ocorrencias = self.busca.buscar_aproximado(termo, limite=limite_aproximada)
+            docs = np.fromiter(ocorrencias, dtype=np.int64, count=len(ocorrencias))
+        elif termo:
+            # Aceita AND/OR/NOT, parênteses, "frases exatas" e listas separadas por vírgula
+            ocorrencias = buscar_consulta(self.busca, termo)
+
+            # Se parece ser um CNPJ ou NCM, busca também só pelos dígitos
+            termo_normalizado = normalizar_cnpj(termo)
+            if len(termo_normalizado) > 6 and termo_normalizado != termo and not composta(termo):
+                for doc, trechos in self.busca.buscar(termo_normalizado).items():
+                    ocorrencias[doc] = sorted(set(ocorrencias.get(doc, [])) | set(trechos))
+
+            # Notas com mais ocorrências primeiro
+            docs = np.fromiter(ocorrencias, dtype=np.int64, count=len(ocorrencias))
+            contagens = np.array([len(ocorrencias[doc]) for doc in docs], dtype=np.int64)
+            docs = docs[np.lexsort((docs, -contagens))]
+        else:
+            ocorrencias = {}
+            docs = np.arange(len(self))
+
+        # Combina a busca textual com os filtros estruturados
+        if filtrados is not None:
+            docs = docs[np.isin(docs, filtrados, assume_unique=True)]
+        return self.visiveis(docs), ocorrencias
+
+    def visiveis(self, docs):
+        """
+        Remove dos documentos encontrados os que foram substituídos
+        """
+        if not self.ocultos:
+            return docs
+        return docs[~np.isin(docs, np.fromiter(self.ocultos, dtype=np.int64))]
+
+    @property
+    def duplicados(self):
+        """
+        Quantidade de arquivos vinculados a outro documento em vez de indexados
+        """
+        return sum(len(copias) for copias in self._copias)
+
+    def mesclar(self, segmento):
+        """
+        Acrescenta ao fim deste índice os documentos de outro (um segmento
+        publicado pela indexação em segundo plano), sem reconstruir os
+        índices já montados. O custo é proporcional ao segmento: as tabelas
+        só são guardadas, para serem concatenadas quando forem lidas
+        """
+        if len(segmento) == 0:
+            pendentes, self.pendentes = self.pendentes + segmento.pendentes, []
+            self.vincular(pendentes)
+            return
+        deslocamento = len(self)
+        if deslocamento == 0:
+            self._partes_index = list(segmento._partes_index)
+            self._partes_itens = list(segmento._partes_itens)
+        else:
+            self._partes_index.extend(segmento._partes_index)
+            self._partes_itens.extend(parte for parte in segmento._partes_itens if len(parte))
+        self._copias.extend(segmento._copias)
+        self.textos.estender(segmento.textos)
+        self.busca.mesclar(segmento.busca)
+        self.filtros.mesclar(segmento.filtros, deslocamento)
+        self.agregados.mesclar(segmento.agregados, deslocamento)
+        self.manifesto.update(segmento.manifesto)
+        self._doc_por_hash.update((h, doc + deslocamento) for h, doc in segmento._doc_por_hash.items())
+        self.ocultos.update(doc + deslocamento for doc in segmento.ocultos)
+        pendentes, self.pendentes = self.pendentes + segmento.pendentes, []
+        self.vincular(pendentes)
+
+    def remover(self, docs=(), vinculados=()):
+        """
+        Tira do índice os documentos docs e os arquivos vinculados com os
+        nomes de vinculados (apagados ou alterados na pasta). Os documentos
+        ficam ocultos e sem vínculos, e os itens deles saem da tabela; os
+        índices de busca e de filtros não são refeitos (veja compactar())
+        """
+        docs = set(docs)
+        vinculados = set(vinculados)
+        nomes = set()
+        for doc in docs:
+            documento = self._documento(doc)
+            nomes.add(documento['arquivo'])
+            if self._doc_por_hash.get(documento['hash']) == doc:
+                del self._doc_por_hash[documento['hash']]
+            vinculados.update(copia['arquivo'] for copia in self._copias[doc])
+            self._copias[doc].clear()
+        if vinculados:
+            for copias in self._copias:
+                if any(copia['arquivo'] in vinculados for copia in copias):
+                    copias[:] = [copia for copia in copias if copia['arquivo'] not in vinculados]
+        self.ocultos.update(docs)
+        if nomes:
+            itens = self.df_itens
+            self.df_itens = itens[~itens['arquivo'].isin(nomes)].reset_index(drop=True)
+
+    def compactar(self):
+        """
+        Monta outro índice só com os documentos visíveis, descartando de vez
+        os ocultos (substituídos ou removidos). Custa tanto quanto indexar o
+        texto de novo, por isso só vale quando os ocultos já são muitos
+        """
+        visiveis = [doc for doc in range(len(self)) if doc not in self.ocultos]
+        df_index = self.df_index.iloc[visiveis].reset_index(drop=True)
+        df_itens = self.df_itens
+        df_itens = df_itens[df_itens['arquivo'].isin(df_index['arquivo'])].reset_index(drop=True)
+        indice = IndiceNotas(df_index, df_itens, self.manifesto, textos=(self.texto(doc) for doc in visiveis))
+        indice.pendentes = list(self.pendentes)
+        return indice
+
+    def __len__(self):
+        return sum(len(parte) for parte in self._partes_index)
+
+    def arquivos(self):
+        """
+        Gera os dados (arquivo, tipo, caminho, hash e chave) de todos os
+        arquivos do índice na ordem em que a indexação os classifica: cada
+        documento, os XMLs primeiro, seguido dos arquivos vinculados a ele.
+        Os substituídos aparecem como vinculados ao documento que os
+        substituiu
+        """
+        documentos = self.df_index.to_dict('records')
+        for doc in sorted(range(len(documentos)), key=lambda doc: documentos[doc]['tipo'] != 'XML'):
+            if doc not in self.ocultos:
+                yield _copia(documentos[doc])
+                yield from documentos[doc]['copias']
+
+    def hashes(self):
+        """
+        Hashes do conteúdo de todos os arquivos do índice: os documentos, os
+        arquivos vinculados a eles e os vínculos ainda pendentes
+        """
+        hashes = {h for h in self.df_index['hash'] if h}
+        hashes.update(copia['hash'] for copias in self._copias for copia in copias if copia.get('hash'))
+        hashes.update(resultado['hash'] for _, _, resultado in self.pendentes if resultado.get('hash'))
+        return hashes
+
+    def texto(self, doc):
+        """
+        Texto extraído do documento
+        """
+        return self.textos[doc]
+
+    def memoria(self):
+        """
+        Bytes ocupados em memória por cada parte do índice
+        """
+        partes = {
+            'textos': self.textos.memoria(),
+            'tabela_documentos': int(self.df_index.memory_usage(deep=True).sum()) + sum(
+                sys.getsizeof(copia) for copias in self.df_index['copias'] for copia in copias
+            ),
+            'tabela_itens': int(self.df_itens.memory_usage(deep=True).sum()),
+            **self.busca.memoria(),
+            'filtros': self.filtros.memoria(),
+            'agregados': self.agregados.memoria(),
+        }
+        return partes
+
+    def arquivos_das_notas(self, docs):
+        """
+        Para cada documento de docs, os dados (arquivo, tipo, caminho, hash e
+        chave) dele seguidos dos arquivos vinculados. Os downloads abrem cada
+        arquivo pelo próprio hash ou caminho, porque nomes iguais podem ser
+        de arquivos diferentes
+        """
+        return [
+            [_copia(documento), *(dict(copia) for copia in documento['copias'])]
+            for documento in self.df_index.iloc[docs].to_dict('records')
+        ]
+
+    def salvar(self, caminho):
+        """
+        Grava as colunas do índice em disco de forma atômica; caminhos
+        terminados em .parquet são gravados como instantâneo (veja
+        instantaneo.py)
+        """
+        colunas = self.colunas()
+        if eh_instantaneo(caminho):
+            # Importado só aqui, para que o pyarrow não pese em quem não usa
+            from instantaneo import salvar_instantaneo
+            salvar_instantaneo(colunas, caminho, VERSAO_INDICE)
+            return
+        if isinstance(colunas['textos']['dados'], memoryview):
+            # Texto de um índice aberto de um instantâneo (visão do Parquet)
+            colunas['textos']['dados'] = bytes(colunas['textos']['dados'])
+        diretorio = os.path.dirname(os.path.abspath(caminho))
+        with tempfile.NamedTemporaryFile(dir=diretorio, delete=False) as tmp:
+            pickle.dump({'versao': VERSAO_INDICE, 'colunas': colunas}, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp.name, caminho)
+
+    @classmethod
+    def carregar(cls, caminho):
+        """
+        Abre um índice gravado com salvar()
+        """
+        if eh_instantaneo(caminho):
+            from instantaneo import carregar_instantaneo
+            return cls.de_colunas(carregar_instantaneo(caminho, VERSAO_INDICE))
+        with open(caminho, 'rb') as arquivo:
+            dados = pickle.load(arquivo)
+        if dados.get('versao') != VERSAO_INDICE:
+            raise ValueError(f"Versão do índice incompatível: {dados.get('versao')}")
+        return cls.de_colunas(dados['colunas'])
+
+
+def eh_instantaneo(caminho):
+    """
+    Indica se o caminho do índice é de um instantâneo em Parquet
+    """
+    return os.fspath(caminho).rstrip('/' + os.sep).endswith(EXTENSAO_INSTANTANEO)
+
+
+def _copia(documento):
+    """
+    Dados guardados de um arquivo vinculado a outro documento
+    """
+    return {chave: documento.get(chave) for chave in ('arquivo', 'tipo', 'caminho', 'hash', 'chave')}
@@ -0,0 +1,314 @@
+"""
+Instantâneo do índice em Parquet: um diretório (nome terminado em .parquet)
+com uma tabela por estrutura, para montar o índice em um servidor e abri-lo
+em outros. IndiceNotas.salvar e carregar usam este formato quando o caminho
+termina em .parquet. As estruturas são as mesmas que o .idx guarda
+(IndiceNotas.colunas()); só o recipiente muda.
+
+    instantaneo.json     formato, versão e totais
+    documentos.parquet   tabela dos documentos, com o texto comprimido de
+                         cada um e o fim dos seus tokens
+    itens.parquet        itens das NFes
+    arquivos.parquet     estado dos arquivos da pasta indexada
+    tokens.parquet       vocabulário em ordem, com a lista de postings de cada token
+    posicoes.parquet     início de cada token no texto, documento após documento
+    palavras.parquet     palavras do índice de trigramas
+    trigramas.parquet    lista de palavras de cada trigrama
+    filtros.parquet      documentos de cada CNPJ, NCM e chave de acesso
+    datas.parquet        documentos em ordem de data de emissão
+    valores.parquet      documentos em ordem de valor total
+    agregados.parquet    totais de compra por nota e produto
+    vocabularios.parquet valores dos códigos dos totais de compra
+
+Na abertura as colunas são lidas direto em arrays, sem um objeto Python por
+valor, e nada é reindexado; os postings de um token só são convertidos
+quando ele é buscado. Os vínculos ainda pendentes (documento principal
+ausente) não são gravados.
+"""
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from extracao import concatenar_itens
+from filtros import CAMPOS_HASH
+
+FORMATO = 'busca-notas-fiscais'
+DESCRICAO = 'instantaneo.json'
+
+# Compressão das tabelas; o texto dos documentos já vem comprimido
+COMPRESSAO = 'zstd'
+
+# As listas de inteiros (postings, documentos de cada filtro) são gravadas
+# como valores binários com os inteiros em little-endian: a leitura é uma
+# cópia de bytes, bem mais rápida que a de uma coluna de listas
+TIPO_POSTINGS = np.dtype('<u4')
+TIPO_DOCS = np.dtype('<i8')
+
+
+def _binario(offsets, dados):
+    """
+    Coluna binária a partir dos dados concatenados e dos offsets (em bytes)
+    de cada valor, sem copiar os dados
+    """
+    return pa.LargeBinaryArray.from_buffers(
+        pa.large_binary(), len(offsets) - 1,
+        [None, pa.py_buffer(np.ascontiguousarray(offsets, dtype=np.int64)), pa.py_buffer(dados)]
+    )
+
+
+def _lista(fins, valores, tipo=TIPO_POSTINGS):
+    """
+    Coluna de listas de inteiros a partir dos valores concatenados e do fim
+    de cada lista (fins[0] == 0)
+    """
+    return _binario(np.asarray(fins, dtype=np.int64) * tipo.itemsize, np.ascontiguousarray(valores, dtype=tipo))
+
+
+def _textos(valores):
+    """
+    Coluna de texto de valores vindos do pandas: NaN (valor ausente) vira
+    nulo, como None
+    """
+    return pa.array(valores, pa.string(), from_pandas=True)
+
+
+def _gravar(tabela, diretorio, nome, compressao=COMPRESSAO):
+    pq.write_table(tabela, os.path.join(diretorio, nome), compression=compressao)
+
+
+def _gravar_tabelas(colunas, diretorio, versao):
+    busca = colunas['busca']
+    trigramas = busca['trigramas']
+    textos = colunas['textos']
+    documentos = colunas['documentos']
+    ocultos = np.zeros(len(documentos), dtype=bool)
+    ocultos[list(colunas['ocultos'])] = True
+
+    copias = documentos['copias']
+    documentos = pa.Table.from_pandas(documentos.drop(columns='copias'), preserve_index=False)
+    documentos = documentos.append_column(
+        'copias', pa.array([json.dumps(lista, ensure_ascii=False) for lista in copias], pa.string())
+    )
+    documentos = documentos.append_column('oculto', pa.array(ocultos))
+    documentos = documentos.append_column('fim_tokens', pa.array(busca['limites'][1:]))
+    documentos = documentos.append_column(
+        'texto', _binario(np.concatenate([np.zeros(1, dtype=np.uint64), textos['fins']]), textos['dados'])
+    )
+    _gravar(documentos, diretorio, 'documentos.parquet',
+            {coluna: 'none' if coluna == 'texto' else COMPRESSAO for coluna in documentos.column_names})
+
+    _gravar(pa.Table.from_pandas(colunas['itens'], preserve_index=False), diretorio, 'itens.parquet')
+    arquivos = list(colunas['manifesto'].items())
+    _gravar(pa.table({
+        'caminho': pa.array([caminho for caminho, _ in arquivos], pa.string()),
+        'mtime_ns': pa.array([estado[0] for _, estado in arquivos], pa.int64()),
+        'tamanho': pa.array([estado[1] for _, estado in arquivos], pa.int64()),
+        'hash': pa.array([estado[2] for _, estado in arquivos], pa.string()),
+    }), diretorio, 'arquivos.parquet')
+
+    _gravar(pa.table({
+        'token': pa.array(busca['tokens'], pa.string()),
+        'postings': _lista(busca['fins'], busca['valores']),
+    }), diretorio, 'tokens.parquet')
+    _gravar(pa.table({'inicio': pa.array(busca['inicios'], pa.uint32())}), diretorio, 'posicoes.parquet')
+    _gravar(pa.table({
+        'palavra': pa.array(trigramas['palavras'], pa.string()),
+        'num_trigramas': pa.array(trigramas['num_trigramas'], pa.uint32()),
+    }), diretorio, 'palavras.parquet')
+    _gravar(pa.table({
+        'trigrama': pa.array(trigramas['trigramas'], pa.string()),
+        'palavras': _lista(trigramas['fins'], trigramas['valores']),
+    }), diretorio, 'trigramas.parquet')
+
+    filtros = colunas['filtros']
+    campos = filtros['campos']
+    fins = np.zeros(sum(len(campos[campo][0]) for campo in CAMPOS_HASH) + 1, dtype=np.int64)
+    np.cumsum(np.concatenate([np.diff(campos[campo][1]) for campo in CAMPOS_HASH]), out=fins[1:])
+    _gravar(pa.table({
+        'campo': pa.array([campo for campo in CAMPOS_HASH for _ in campos[campo][0]], pa.string()),
+        'valor': _textos([valor for campo in CAMPOS_HASH for valor in campos[campo][0]]),
+        'docs': _lista(fins, np.concatenate([campos[campo][2] for campo in CAMPOS_HASH]), TIPO_DOCS),
+    }), diretorio, 'filtros.parquet')
+    _gravar(pa.table({'data': pa.array(filtros['datas']), 'doc': pa.array(filtros['docs_por_data'])}),
+            diretorio, 'datas.parquet')
+    _gravar(pa.table({'valor': pa.array(filtros['valores']), 'doc': pa.array(filtros['docs_por_valor'])}),
+            diretorio, 'valores.parquet')
+
+    agregados = colunas['agregados']
+    _gravar(pa.Table.from_pandas(agregados['tabela'], preserve_index=False), diretorio, 'agregados.parquet')
+    vocabularios = [
+        (nome, valor) for nome, valores in agregados['vocabularios'].items() for valor in valores
+    ]
+    _gravar(pa.table({
+        'dimensao': pa.array([nome for nome, _ in vocabularios], pa.string()),
+        # O produto é o par (cProd, xProd)
+        'valor': _textos([valor[0] if isinstance(valor, tuple) else valor for _, valor in vocabularios]),
+        'descricao': _textos([valor[1] if isinstance(valor, tuple) else None for _, valor in vocabularios]),
+    }), diretorio, 'vocabularios.parquet')
+
+    # Gravado por último: um diretório sem ele está incompleto
+    with open(os.path.join(diretorio, DESCRICAO), 'w', encoding='utf-8') as arquivo:
+        json.dump({
+            'formato': FORMATO,
+            'versao': versao,
+            'criado_em': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'documentos': len(ocultos),
+            'itens': len(colunas['itens']),
+            'tokens': len(busca['tokens']),
+            'nivel_compressao_texto': textos['nivel'],
+            'tamanho_original_textos': textos['tamanho_original'],
+        }, arquivo, ensure_ascii=False, indent=2)
+
+
+def salvar_instantaneo(colunas, caminho, versao):
+    """
+    Grava as colunas do índice (IndiceNotas.colunas()) no diretório
+    caminho. As tabelas são gravadas em um diretório temporário ao lado,
+    que então toma o lugar do anterior
+    """
+    caminho = os.path.abspath(caminho)
+    temporario = tempfile.mkdtemp(prefix='.instantaneo-', dir=os.path.dirname(caminho))
+    try:
+        _gravar_tabelas(colunas, temporario, versao)
+        anterior = None
+        if os.path.exists(caminho):
+            anterior = tempfile.mkdtemp(prefix='.instantaneo-anterior-', dir=os.path.dirname(caminho))
+            os.replace(caminho, os.path.join(anterior, 'indice'))
+        os.replace(temporario, caminho)
+    except BaseException:
+        shutil.rmtree(temporario, ignore_errors=True)
+        raise
+    if anterior:
+        shutil.rmtree(anterior, ignore_errors=True)
+
+
+def _ler(caminho, nome):
+    return pq.read_table(os.path.join(caminho, nome), memory_map=True)
+
+
+def _numeros(coluna, tipo):
+    return coluna.combine_chunks().to_numpy(zero_copy_only=False).astype(tipo, copy=False)
+
+
+def _binarios(coluna):
+    """
+    (offsets, dados) de uma coluna binária: os valores concatenados, sem
+    cópia, e o início de cada um em bytes (offsets[0] == 0)
+    """
+    valores = coluna.combine_chunks()
+    if len(valores) == 0:
+        return np.zeros(1, dtype=np.int64), memoryview(b'')
+    _, offsets, dados = valores.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int64)[valores.offset:valores.offset + len(valores) + 1]
+    return offsets - offsets[0], memoryview(dados)[offsets[0]:offsets[-1]]
+
+
+def _listas(coluna, tipo=TIPO_POSTINGS):
+    """
+    (fins, valores) de uma coluna gravada por _lista
+    """
+    offsets, dados = _binarios(coluna)
+    return offsets // tipo.itemsize, np.frombuffer(dados, dtype=tipo)
+
+
+def carregar_instantaneo(caminho, versao):
+    """
+    Lê as colunas gravadas por salvar_instantaneo, no formato de
+    IndiceNotas.colunas()
+    """
+    try:
+        with open(os.path.join(caminho, DESCRICAO), encoding='utf-8') as arquivo:
+            descricao = json.load(arquivo)
+    except FileNotFoundError:
+        raise ValueError(f"Instantâneo incompleto ou inexistente: {caminho}")
+    if descricao.get('formato') != FORMATO or descricao.get('versao') != versao:
+        raise ValueError(f"Versão do índice incompatível: {descricao.get('versao')}")
+
+    documentos = _ler(caminho, 'documentos.parquet')
+    offsets, dados = _binarios(documentos.column('texto'))
+    textos = {
+        'dados': dados, 'fins': offsets[1:],
+        'tamanho_original': descricao['tamanho_original_textos'], 'nivel': descricao['nivel_compressao_texto'],
+    }
+    limites = np.zeros(len(documentos) + 1, dtype=np.uint64)
+    limites[1:] = _numeros(documentos.column('fim_tokens'), np.uint64)
+    ocultos = np.flatnonzero(_numeros(documentos.column('oculto'), bool))
+
+    df_index = documentos.select(
+        [coluna for coluna in documentos.column_names if coluna not in ('copias', 'oculto', 'fim_tokens', 'texto')]
+    ).to_pandas()
+    df_index['copias'] = [
+        json.loads(copias) if copias != '[]' else [] for copias in documentos.column('copias').to_pylist()
+    ]
+    df_itens = concatenar_itens([_ler(caminho, 'itens.parquet').to_pandas()])
+
+    arquivos = _ler(caminho, 'arquivos.parquet').to_pydict()
+    manifesto = {
+        caminho_arquivo: (mtime_ns, tamanho, hash_arquivo)
+        for caminho_arquivo, mtime_ns, tamanho, hash_arquivo in zip(
+            arquivos['caminho'], arquivos['mtime_ns'], arquivos['tamanho'], arquivos['hash']
+        )
+    }
+
+    tokens = _ler(caminho, 'tokens.parquet')
+    fins, valores = _listas(tokens.column('postings'))
+    palavras = _ler(caminho, 'palavras.parquet')
+    trigramas = _ler(caminho, 'trigramas.parquet')
+    fins_trigramas, valores_trigramas = _listas(trigramas.column('palavras'))
+    busca = {
+        'tokens': tokens.column('token').to_pylist(),
+        'fins': fins,
+        'valores': valores,
+        'inicios': _numeros(_ler(caminho, 'posicoes.parquet').column('inicio'), np.uint32),
+        'limites': limites,
+        'trigramas': {
+            'palavras': palavras.column('palavra').to_pylist(),
+            'num_trigramas': _numeros(palavras.column('num_trigramas'), np.uint32),
+            'trigramas': trigramas.column('trigrama').to_pylist(),
+            'fins': fins_trigramas,
+            'valores': valores_trigramas,
+        },
+    }
+
+    tabela = _ler(caminho, 'filtros.parquet')
+    campo_por_linha = tabela.column('campo').to_numpy(zero_copy_only=False)
+    valores = tabela.column('valor').to_pylist()
+    fins, docs = _listas(tabela.column('docs'), TIPO_DOCS)
+    campos = {}
+    for campo in CAMPOS_HASH:
+        linhas = np.flatnonzero(campo_por_linha == campo)
+        inicio, fim = (linhas[0], linhas[-1] + 1) if len(linhas) else (0, 0)
+        campos[campo] = (valores[inicio:fim], fins[inicio:fim + 1] - fins[inicio], docs[fins[inicio]:fins[fim]])
+    datas = _ler(caminho, 'datas.parquet')
+    por_valor = _ler(caminho, 'valores.parquet')
+    filtros = {
+        'campos': campos,
+        'datas': datas.column('data').combine_chunks().to_numpy(zero_copy_only=False),
+        'docs_por_data': _numeros(datas.column('doc'), np.int64),
+        'valores': _numeros(por_valor.column('valor'), np.float64),
+        'docs_por_valor': _numeros(por_valor.column('doc'), np.int64),
+    }
+
+    vocabularios = {}
+    tabela = _ler(caminho, 'vocabularios.parquet').to_pydict()
+    for nome, valor, descricao in zip(tabela['dimensao'], tabela['valor'], tabela['descricao']):
+        if nome == 'produto' and (valor is not None or descricao is not None):
+            valor = (valor, descricao)
+        vocabularios.setdefault(nome, []).append(valor)
+
+    return {
+        'documentos': df_index,
+        'itens': df_itens,
+        'manifesto': manifesto,
+        'ocultos': ocultos,
+        'textos': textos,
+        'busca': busca,
+        'filtros': filtros,
+        'agregados': {'tabela': _ler(caminho, 'agregados.parquet').to_pandas(), 'vocabularios': vocabularios},
+    }
@@ -0,0 +1,177 @@
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Etapas medidas dentro de outras (não entram na soma por arquivo)
+SUBETAPAS = {
+    'pdf_texto': 'extrair_texto_pdf',
+    'rasterizacao': 'extrair_texto_pdf',
+    'tesseract': 'extrair_texto_pdf',
+}
+
+COLUNAS_MEDICOES = ['etapa', 'arquivo', 'segundos', 'cpu_segundos', 'rss_max_processo_mb']
+
+# Medições do processo atual feitas fora de arquivo_em_medicao(); limitadas
+# para não crescer indefinidamente
+_medicoes = deque(maxlen=100_000)
+_lock = threading.Lock()
+# Arquivo em medição no contexto atual (thread ou tarefa) e a lista que
+# recebe as medições feitas para ele
+_arquivo_atual = contextvars.ContextVar('arquivo_em_medicao', default=None)
+
+
+def _cpu():
+    """
+    Tempo de CPU do processo e dos subprocessos já encerrados (Tesseract,
+    pdftoppm)
+    """
+    if resource is None:
+        return time.process_time()
+    filhos = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + filhos.ru_utime + filhos.ru_stime
+
+
+def _rss_max_processo_mb():
+    """
+    Maior memória residente que o processo (ou o maior subprocesso) já
+    ocupou, em MB. É o pico desde o início do processo, não o da etapa: nos
+    processos reaproveitados pelo pool, só cresce
+    """
+    if resource is None:
+        return None
+    proprio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    filhos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(proprio, filhos) / 1024
+
+
+@contextmanager
+def arquivo_em_medicao(nome):
+    """
+    Associa ao arquivo informado as medições feitas dentro do bloco, na
+    mesma thread ou nas que rodam com em_contexto(), e entrega a lista
+    delas. Essas medições não entram nas do processo: quem abriu o bloco
+    decide o que fazer com elas
+    """
+    medicoes = []
+    token = _arquivo_atual.set((nome, medicoes))
+    try:
+        yield medicoes
+    finally:
+        _arquivo_atual.reset(token)
+
+
+def em_contexto(funcao):
+    """
+    Retorna a função para rodar em outra thread (como no ThreadPoolExecutor)
+    com o arquivo em medição de quem a chamou
+    """
+    contexto = contextvars.copy_context()
+    return functools.wraps(funcao)(lambda *args, **kwargs: contexto.copy().run(funcao, *args, **kwargs))
+
+
+@contextmanager
+def medir_etapa(etapa):
+    """
+    Mede o tempo de relógio, o tempo de CPU e o pico de memória do bloco
+    """
+    inicio, cpu_inicio = time.perf_counter(), _cpu()
+    try:
+        yield
+    finally:
+        arquivo, medicoes = _arquivo_atual.get() or (None, None)
+        registro = {
+            'etapa': etapa,
+            'arquivo': arquivo,
+            'segundos': time.perf_counter() - inicio,
+            'cpu_segundos': _cpu() - cpu_inicio,
+            'rss_max_processo_mb': _rss_max_processo_mb(),
+        }
+        if medicoes is not None:
+            medicoes.append(registro)
+        else:
+            with _lock:
+                _medicoes.append(registro)
+
+
+def medir(etapa):
+    """
+    Decorador que mede cada chamada da função como uma etapa
+    """
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def medida(*args, **kwargs):
+            with medir_etapa(etapa):
+                return funcao(*args, **kwargs)
+        return medida
+    return decorador
+
+
+def incluir(medicoes):
+    """
+    Acrescenta medições feitas em outros processos às do processo atual
+    """
+    with _lock:
+        _medicoes.extend(medicoes)
+
+
+def registros(etapas=None):
+    """
+    Retorna uma cópia das medições acumuladas, opcionalmente só das etapas
+    informadas
+    """
+    with _lock:
+        return [r for r in _medicoes if etapas is None or r['etapa'] in etapas]
+
+
+def tabela_medicoes(medicoes):
+    """
+    Converte a lista de medições em DataFrame
+    """
+    return pd.DataFrame(list(medicoes), columns=COLUNAS_MEDICOES)
+
+
+def resumo_por_etapa(df):
+    """
+    Soma, média e máximo do tempo de cada etapa
+    """
+    if df.empty:
+        return df
+    resumo = df.groupby('etapa').agg(
+        chamadas=('segundos', 'size'),
+        segundos=('segundos', 'sum'),
+        media_segundos=('segundos', 'mean'),
+        max_segundos=('segundos', 'max'),
+        cpu_segundos=('cpu_segundos', 'sum'),
+        rss_max_processo_mb=('rss_max_processo_mb', 'max'),
+    )
+    resumo['subetapa_de'] = [SUBETAPAS.get(etapa, '') for etapa in resumo.index]
+    return resumo.sort_values('segundos', ascending=False)
+
+
+def arquivos_mais_lentos(df, quantidade=10):
+    """
+    Arquivos com maior tempo total de extração (sem contar as subetapas duas vezes)
+    """
+    if df.empty:
+        return df
+    principais = df[df['arquivo'].notna() & ~df['etapa'].isin(list(SUBETAPAS))]
+    return (
+        principais.groupby('arquivo')
+        .agg(
+            segundos=('segundos', 'sum'),
+            cpu_segundos=('cpu_segundos', 'sum'),
+            rss_max_processo_mb=('rss_max_processo_mb', 'max'),
+        )
+        .sort_values('segundos', ascending=False)
+        .head(quantidade)
+    )
@@ -0,0 +1,146 @@
+import pdf2image
+import pytesseract
+
+from indice_busca import dobrar_texto
+from instrumentacao import medir_etapa
+
+# Resolução da passagem rápida de layout e da leitura das regiões
+DPI_LAYOUT = 72
+DPI_REGIOES = 300
+
+# Títulos impressos no DANFE que marcam o início de cada região buscada
+ANCORAS = {
+    'emitente': ['identificacao do emitente', 'emitente'],
+    'chave': ['chave de acesso'],
+    'destinatario': ['destinatario/remetente', 'destinatario'],
+    'produtos': ['dados do produto', 'dados dos produtos'],
+}
+
+# Títulos que encerram a região anterior sem serem lidos
+FIM_REGIAO = ['calculo do imposto', 'transportador', 'calculo do issqn', 'dados adicionais']
+
+# Altura da faixa da chave de acesso, em fração da altura da página
+ALTURA_CHAVE = 0.05
+
+
+def _linhas_layout(imagem):
+    """
+    Retorna as linhas reconhecidas na imagem como (texto dobrado, topo, base),
+    com as posições em fração da altura da imagem
+    """
+    with medir_etapa('tesseract'):
+        dados = pytesseract.image_to_data(imagem, lang='por', output_type=pytesseract.Output.DICT)
+    linhas = {}
+    for i, palavra in enumerate(dados['text']):
+        if not palavra.strip():
+            continue
+        chave = (dados['block_num'][i], dados['par_num'][i], dados['line_num'][i])
+        topo = dados['top'][i]
+        base = topo + dados['height'][i]
+        if chave in linhas:
+            texto, t, b = linhas[chave]
+            linhas[chave] = (f"{texto} {palavra}", min(t, topo), max(b, base))
+        else:
+            linhas[chave] = (palavra, topo, base)
+
+    altura = imagem.height
+    return sorted(
+        (dobrar_texto(texto), topo / altura, base / altura)
+        for texto, topo, base in linhas.values()
+    )
+
+
+def localizar_regioes(imagem):
+    """
+    Localiza as regiões do DANFE a partir da imagem em baixa resolução.
+    Retorna [(nome, topo, base)] em frações da altura da página
+    """
+    marcos = []
+    for texto, topo, base in _linhas_layout(imagem):
+        for nome, termos in ANCORAS.items():
+            if any(termo in texto for termo in termos):
+                marcos.append((topo, base, nome))
+                break
+        else:
+            if any(termo in texto for termo in FIM_REGIAO):
+                marcos.append((topo, base, None))
+    marcos.sort()
+
+    regioes = []
+    vistas = set()
+    for i, (topo, base, nome) in enumerate(marcos):
+        if nome is None or nome in vistas:
+            continue
+        vistas.add(nome)
+        if nome == 'chave':
+            fim = base + ALTURA_CHAVE
+        else:
+            fim = next((t for t, _, _ in marcos[i + 1:] if t > base), 1.0)
+        regioes.append((nome, topo, min(fim, 1.0)))
+    return regioes
+
+
+def binarizar(imagem):
+    """
+    Converte a imagem para tons de cinza e binariza pelo limiar de Otsu
+    """
+    cinza = imagem.convert('L')
+    histograma = cinza.histogram()
+    total = sum(histograma)
+    soma_total = sum(i * h for i, h in enumerate(histograma))
+
+    soma_fundo = peso_fundo = 0
+    melhor_limiar, melhor_variancia = 127, -1.0
+    for limiar, quantidade in enumerate(histograma):
+        peso_fundo += quantidade
+        if peso_fundo == 0:
+            continue
+        peso_frente = total - peso_fundo
+        if peso_frente == 0:
+            break
+        soma_fundo += limiar * quantidade
+        media_fundo = soma_fundo / peso_fundo
+        media_frente = (soma_total - soma_fundo) / peso_frente
+        variancia = peso_fundo * peso_frente * (media_fundo - media_frente) ** 2
+        if variancia > melhor_variancia:
+            melhor_limiar, melhor_variancia = limiar, variancia
+
+    return cinza.point(lambda p: 255 if p > melhor_limiar else 0, mode='1')
+
+
+def ocr_regioes_pagina(dados, numero):
+    """
+    Aplica OCR apenas nas regiões buscadas de uma página de DANFE escaneado.
+    Retorna None quando o layout não é reconhecido, para que a página seja
+    lida inteira
+    """
+    with medir_etapa('rasterizacao'):
+        layout = pdf2image.convert_from_bytes(
+            dados, dpi=DPI_LAYOUT, first_page=numero, last_page=numero, grayscale=True
+        )[0]
+    try:
+        regioes = localizar_regioes(layout)
+    finally:
+        layout.close()
+
+    if not regioes:
+        return None
+
+    with medir_etapa('rasterizacao'):
+        pagina = pdf2image.convert_from_bytes(
+            dados, dpi=DPI_REGIOES, first_page=numero, last_page=numero, grayscale=True
+        )[0]
+    try:
+        textos = []
+        for nome, topo, base in regioes:
+            recorte = pagina.crop((0, int(topo * pagina.height), pagina.width, int(base * pagina.height)))
+            imagem = binarizar(recorte)
+            # A tabela de produtos é lida como um bloco uniforme de texto
+            config = '--psm 6' if nome == 'produtos' else ''
+            with medir_etapa('tesseract'):
+                textos.append(pytesseract.image_to_string(imagem, lang='por', config=config))
+            imagem.close()
+            recorte.close()
+        return "\n".join(textos)
+    finally:
+        pagina.close()
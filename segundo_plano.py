@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+from contextlib import closing
+
+from cache_texto import extrair_com_cache
+from duplicados import AgrupadorDuplicados
+from indice_notas import IndiceNotas
+
+# Um segmento é publicado quando junta esta quantidade de documentos ou
+# quando passa este intervalo desde o último, o que vier primeiro
+TAMANHO_SEGMENTO = 64
+INTERVALO_SEGMENTO = 1.0
+
+
+class IndexacaoEmSegundoPlano:
+    """
+    Extrai e indexa os arquivos em uma thread própria. Conforme os arquivos
+    ficam prontos, publica segmentos (IndiceNotas pequenos) que quem lê o
+    índice mescla no seu, de modo que a busca funciona sobre o que já foi
+    indexado. A thread só altera o próprio estado; o índice da sessão é
+    alterado apenas por quem chama segmentos()
+    """
+
+    def __init__(self, entradas, hashes=None, num_processos=None, agrupador=None):
+        self.total = len(entradas)
+        self.concluidos = 0
+        self.erros = []
+        self.medicoes = []
+        self._entradas = entradas
+        self._hashes = hashes
+        self._num_processos = num_processos
+        self._segmentos = queue.Queue()
+        # Compartilhado pelos segmentos (e pelas indexações de um mesmo
+        # índice), para vincular cópias entre eles
+        self._agrupador = agrupador or AgrupadorDuplicados()
+        self._cancelada = threading.Event()
+        self._thread = threading.Thread(target=self._executar, name='indexacao', daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+        return self
+
+    @property
+    def iniciada(self):
+        return self._thread.ident is not None
+
+    @property
+    def terminada(self):
+        return self.iniciada and not self._thread.is_alive() and self._segmentos.empty()
+
+    @property
+    def cancelada(self):
+        return self._cancelada.is_set()
+
+    def cancelar(self):
+        """
+        Interrompe a indexação depois do arquivo em andamento; os que não
+        começaram a ser extraídos são descartados
+        """
+        self._cancelada.set()
+
+    def aguardar(self):
+        """
+        Espera a thread terminar (depois de cancelar(), termina no arquivo em
+        andamento); os segmentos ainda não retirados são descartados
+        """
+        if self.iniciada:
+            self._thread.join()
+        self.segmentos()
+
+    def segmentos(self, espera=None):
+        """
+        Retorna e remove os segmentos publicados desde a última chamada. Com
+        espera, aguarda até essa quantidade de segundos pelo primeiro
+        """
+        publicados = []
+        if espera:
+            try:
+                publicados.append(self._segmentos.get(timeout=espera))
+            except queue.Empty:
+                return publicados
+        while True:
+            try:
+                publicados.append(self._segmentos.get_nowait())
+            except queue.Empty:
+                return publicados
+
+    def _publicar(self, resultados):
+        if resultados:
+            self._segmentos.put(IndiceNotas.de_resultados(resultados, agrupador=self._agrupador))
+
+    def _executar(self):
+        lote = []
+        ultimo = time.monotonic()
+        if self.cancelada:
+            # Cancelada antes de sair da fila
+            return
+        try:
+            extraidos = extrair_com_cache(self._entradas, self._num_processos, hashes=self._hashes)
+            # Fechar o gerador ao cancelar descarta os arquivos que ainda
+            # aguardam o pool de processos
+            with closing(extraidos):
+                for _, resultado, _ in extraidos:
+                    if self._cancelada.is_set():
+                        break
+                    self.medicoes.extend(resultado.get('medicoes', []))
+                    if resultado['erro']:
+                        self.erros.append((resultado['arquivo'], resultado['erro']))
+                    elif not resultado['conteudo'] and not resultado.get('duplicado'):
+                        self.erros.append((resultado['arquivo'], 'nenhum texto extraído'))
+                    else:
+                        lote.append(resultado)
+                    self.concluidos += 1
+
+                    if len(lote) >= TAMANHO_SEGMENTO or time.monotonic() - ultimo >= INTERVALO_SEGMENTO:
+                        self._publicar(lote)
+                        lote = []
+                        ultimo = time.monotonic()
+        except Exception as e:
+            self.erros.append(('', str(e)))
+        finally:
+            self._publicar(lote)
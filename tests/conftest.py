@@ -0,0 +1,55 @@
+import os
+import random
+import sys
+
+import pytest
+
+# Os módulos do app ficam na raiz do repositório, fora de um pacote
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import gerar_fornecedores, gerar_nota, linhas_danfe, nota_para_xml, pdf_digital  # noqa: E402
+
+
+@pytest.fixture
+def gerar_xmls():
+    """
+    Gera [(nome, bytes do XML, nota)] de NFes sintéticas do corpus dos
+    benchmarks, sempre as mesmas para a mesma semente
+    """
+    def gerar(quantidade, semente=1, itens_max=5):
+        rng = random.Random(semente)
+        fornecedores = gerar_fornecedores(rng, 5)
+        notas = [gerar_nota(rng, numero, fornecedores, 1, itens_max) for numero in range(1, quantidade + 1)]
+        return [(f"{nota['chave']}-nfe.xml", nota_para_xml(nota), nota) for nota in notas]
+    return gerar
+
+
+@pytest.fixture
+def gerar_danfe():
+    """
+    Gera o PDF (com camada de texto) do DANFE de uma nota de gerar_xmls,
+    com linhas extras opcionais (anotações, carimbos)
+    """
+    def gerar(nota, extras=()):
+        return pdf_digital(linhas_danfe(nota) + list(extras))
+    return gerar
+
+
+@pytest.fixture
+def extrair():
+    """
+    Extrai [(nome, bytes)] como a indexação faz, com hash e chave de acesso
+    """
+    from cache_texto import hash_conteudo
+    from duplicados import chave_documento
+    from extracao import extrair_arquivo
+
+    def extrair_arquivos(arquivos):
+        resultados = []
+        for nome, dados in arquivos:
+            resultado = extrair_arquivo(nome, dados)
+            resultado['hash'] = hash_conteudo(dados)
+            resultado['chave'] = chave_documento(nome, resultado['conteudo'], resultado['itens'])
+            resultados.append(resultado)
+        return resultados
+    return extrair_arquivos
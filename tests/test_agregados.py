@@ -0,0 +1,38 @@
+import math
+
+import pandas as pd
+
+from benchmarks.corpus import nota_para_xml
+from duplicados import AgrupadorDuplicados
+from indice_notas import IndiceNotas
+
+
+def _sem_codigo(nota):
+    """
+    XML da nota com o primeiro item sem cProd
+    """
+    item = nota['itens'][0]
+    item['xProd'] = 'Prod sem código'
+    return nota_para_xml(nota).replace(f"<cProd>{item['cProd']}</cProd>".encode(), b'')
+
+
+def test_produto_sem_codigo_agrupado_entre_segmentos(gerar_xmls, extrair):
+    arquivos = [(nome, _sem_codigo(nota)) for nome, _, nota in gerar_xmls(4)]
+    resultados = extrair(arquivos)
+    assert resultados[0]['itens']['cProd'].isna().iloc[0]
+
+    agrupador = AgrupadorDuplicados()
+    indice = IndiceNotas()
+    for inicio in (0, 2):
+        indice.mesclar(IndiceNotas.de_resultados(resultados[inicio:inicio + 2], agrupador=agrupador))
+    completo = IndiceNotas.de_resultados(resultados)
+
+    for agregados in (indice.agregados, completo.agregados):
+        resumo = agregados.resumir(['produto'])
+        sem_codigo = resumo[resumo['xProd'] == 'Prod sem código']
+        assert len(sem_codigo) == 1
+        assert pd.isna(sem_codigo['cProd'].iloc[0]) and sem_codigo['notas'].iloc[0] == 4
+        assert not any(isinstance(valor, float) and math.isnan(valor)
+                       for par in agregados._vocabularios['produto'].valores if par for valor in par)
+    pd.testing.assert_frame_equal(indice.agregados.resumir(['produto', 'mes']),
+                                  completo.agregados.resumir(['produto', 'mes']))
@@ -0,0 +1,132 @@
+import http.client
+import io
+import json
+import os
+import threading
+import zipfile
+
+import numpy as np
+import pytest
+
+from api import CacheBuscas, criar_servidor
+from indice_notas import IndiceNotas
+
+
+def _indice(tmp_path, extrair, arquivos):
+    resultados = extrair(arquivos)
+    for resultado, (nome, dados) in zip(resultados, arquivos):
+        caminho = tmp_path / nome
+        caminho.write_bytes(dados)
+        resultado['caminho'] = str(caminho)
+    return IndiceNotas.de_resultados(resultados)
+
+
+@pytest.fixture
+def api(tmp_path, gerar_xmls, extrair):
+    """
+    Servidor da API em uma porta livre, sobre um .idx em tmp_path com 6
+    notas, a primeira removida. Entrega get(caminho) -> (status,
+    cabeçalhos, corpo) e o necessário para regravar o índice
+    """
+    arquivos = [(nome, dados) for nome, dados, _ in gerar_xmls(7)]
+    caminho = tmp_path / 'notas.idx'
+    indice = _indice(tmp_path, extrair, arquivos[:6])
+    indice.remover([0])
+    indice.salvar(caminho)
+
+    servidor = criar_servidor(caminho_indice=str(caminho), porta=0, registrar=False)
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+
+    def get(rota):
+        conexao = http.client.HTTPConnection('127.0.0.1', servidor.server_address[1], timeout=60)
+        try:
+            conexao.request('GET', rota)
+            resposta = conexao.getresponse()
+            return resposta.status, dict(resposta.getheaders()), resposta.read()
+        finally:
+            conexao.close()
+
+    yield {'get': get, 'caminho': caminho, 'arquivos': arquivos, 'indice': indice}
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def test_busca_paginada(api):
+    status, cabecalhos, corpo = api['get']('/buscar?q=hiper+materiais&por_pagina=2&pagina=3')
+    assert status == 200 and cabecalhos['Transfer-Encoding'] == 'chunked'
+    dados = json.loads(corpo)
+    assert (dados['total'], dados['pagina'], dados['por_pagina']) == (5, 3, 2)
+    assert len(dados['resultados']) == 1
+    assert dados['resultados'][0]['trechos'] and dados['resultados'][0]['ocorrencias'] > 0
+
+    docs = [json.loads(api['get'](f'/buscar?q=hiper+materiais&por_pagina=2&pagina={pagina}')[2])['resultados']
+            for pagina in (1, 2, 3)]
+    assert sorted(r['doc'] for pagina in docs for r in pagina) == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.parametrize('rota, status', [
+    ('/buscar', 400),
+    ('/buscar?q=x&pagina=0', 400),
+    ('/buscar?q=x&por_pagina=muitos', 400),
+    ('/buscar?data_inicio=31/12/2024', 400),
+    ('/buscar?q=parafuso+AND', 400),
+    ('/compras?q=x&por=cor', 400),
+    ('/documentos/0', 404),
+    ('/documentos/99', 404),
+    ('/documentos/abc', 404),
+    ('/documentos/1/arquivo?nome=outro.xml', 404),
+    ('/inexistente', 404),
+])
+def test_erros(api, rota, status):
+    resposta, _, corpo = api['get'](rota)
+    assert resposta == status and json.loads(corpo)['erro']
+
+
+def test_documento_e_arquivo(api):
+    nome, dados = api['arquivos'][1]
+    status, _, corpo = api['get']('/documentos/1')
+    assert status == 200 and json.loads(corpo)['arquivo'] == nome
+
+    status, cabecalhos, corpo = api['get']('/documentos/1/arquivo')
+    assert (status, corpo) == (200, dados)
+    assert cabecalhos['Content-Type'] == 'application/xml' and nome in cabecalhos['Content-Disposition']
+
+
+def test_zip_em_partes(api):
+    status, cabecalhos, corpo = api['get']('/zip?q=hiper+materiais')
+    assert status == 200 and cabecalhos['Transfer-Encoding'] == 'chunked'
+    with zipfile.ZipFile(io.BytesIO(corpo)) as zip_file:
+        nomes = zip_file.namelist()
+        assert sorted(nome for nome in nomes if nome.endswith('-nfe.xml')) == sorted(
+            nome for nome, _ in api['arquivos'][1:6]
+        )
+        assert zip_file.read(api['arquivos'][1][0]) == api['arquivos'][1][1]
+
+
+def test_indice_reaberto_quando_o_arquivo_muda(api, tmp_path, extrair):
+    assert json.loads(api['get']('/saude')[2]) == {'documentos': 6}
+    assert json.loads(api['get']('/buscar?q=hiper+materiais')[2])['total'] == 5
+
+    indice = _indice(tmp_path, extrair, api['arquivos'])
+    indice.salvar(api['caminho'])
+    modificado_em = os.stat(api['caminho']).st_mtime_ns + 1_000_000_000
+    os.utime(api['caminho'], ns=(modificado_em, modificado_em))
+    assert json.loads(api['get']('/saude')[2]) == {'documentos': 7}
+    assert json.loads(api['get']('/buscar?q=hiper+materiais')[2])['total'] == 7
+
+
+def test_cache_de_buscas_limitado_em_bytes():
+    ocorrencias = {doc: [(doc, doc + 3), (doc + 10, doc + 12)] for doc in range(100)}
+    docs = np.arange(99, -1, -1)
+    cache = CacheBuscas(tamanho_maximo=10)
+
+    _, compactas = cache.obter('a', lambda: (docs, ocorrencias))
+    assert compactas.get(42) == [(42, 45), (52, 54)] and compactas.get(500) is None
+    assert cache.bytes == docs.nbytes + compactas.nbytes < 10_000
+
+    cache.bytes_maximo = 3 * cache.bytes
+    for chave in 'bcdef':
+        cache.obter(chave, lambda: (docs, ocorrencias))
+    assert len(cache) == 3 and cache.bytes <= cache.bytes_maximo
+    assert cache.obter('x', lambda: None) is None
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from indice_notas import IndiceNotas
+
+AppTest = pytest.importorskip('streamlit.testing.v1').AppTest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+
+@pytest.fixture
+def indice_preconstruido(tmp_path, monkeypatch, gerar_xmls, extrair):
+    caminho = tmp_path / 'notas.idx'
+    arquivos = [(nome, dados) for nome, dados, _ in gerar_xmls(5)]
+    IndiceNotas.de_resultados(extrair(arquivos)).salvar(caminho)
+    monkeypatch.setenv('BUSCA_NF_INDICE', str(caminho))
+    return caminho
+
+
+def _buscar(termo):
+    app = AppTest.from_file(APP, default_timeout=60).run()
+    app.text_input(key='search_input').input(termo)
+    return app.run()
+
+
+def _botoes_zip(app):
+    return [
+        botao.proto.label for botao in app.get('download_button')
+        if botao.proto.label.startswith(('📥 Baixar todas', '📥 Baixar parte'))
+    ]
+
+
+def test_zip_dividido_em_partes(indice_preconstruido, monkeypatch):
+    monkeypatch.setenv('BUSCA_NF_NOTAS_POR_ZIP', '2')
+    app = _buscar('hiper materiais')
+    assert not app.exception
+    assert 'Encontrado em 5 nota(s) fiscal(is)' in [sucesso.value for sucesso in app.success]
+    assert _botoes_zip(app) == [f"📥 Baixar parte {n} de 3" for n in (1, 2, 3)]
+
+
+def test_zip_unico_para_poucas_notas(indice_preconstruido):
+    app = _buscar('hiper materiais')
+    assert not app.exception
+    assert _botoes_zip(app) == ["📥 Baixar todas em ZIP"]
+
+
+def test_zip_pela_api_quando_configurada(indice_preconstruido, monkeypatch):
+    monkeypatch.setenv('BUSCA_NF_NOTAS_POR_ZIP', '2')
+    monkeypatch.setenv('BUSCA_NF_API_URL', 'http://api.local:8765/')
+    app = _buscar('hiper materiais')
+    assert not app.exception
+    assert _botoes_zip(app) == []
+    assert [botao.proto.url for botao in app.get('link_button')] == ['http://api.local:8765/zip?q=hiper+materiais']
@@ -0,0 +1,47 @@
+import io
+import os
+import zipfile
+
+from armazem import ArmazemDocumentos, membros_zip
+
+
+def _zip(arquivos):
+    dados = io.BytesIO()
+    with zipfile.ZipFile(dados, 'w') as zip_file:
+        for nome, conteudo in arquivos.items():
+            zip_file.writestr(nome, conteudo)
+    dados.seek(0)
+    return dados
+
+
+def test_membros_zip_lista_so_notas_e_fecha_o_zip():
+    fonte = _zip({'a/nota.xml': b'<x/>', 'b.PDF': b'%PDF', 'leia.txt': b'x', '__MACOSX/a/._nota.xml': b''})
+    membros = membros_zip(fonte, prefixo='lote')
+    assert [nome for nome, _ in membros] == ['lote/a/nota.xml', 'lote/b.PDF']
+    assert not fonte.closed
+
+    with zipfile.ZipFile(fonte) as zip_file:
+        with zip_file.open(membros[0][1]) as membro:
+            assert membro.read() == b'<x/>'
+
+
+def test_armazem_guarda_por_hash(tmp_path):
+    armazem = ArmazemDocumentos(tmp_path)
+    chave = armazem.guardar(b'conteudo')
+    assert armazem.guardar(io.BytesIO(b'conteudo')) == chave
+    assert bytes(armazem.ler(chave)) == b'conteudo'
+    assert len(list(tmp_path.glob('*/*'))) == 1
+
+    outro = ArmazemDocumentos(tmp_path)
+    assert chave in outro and outro.caminho(chave).read_bytes() == b'conteudo'
+    assert '0' * 64 not in outro and outro.ler('0' * 64) is None
+
+
+def test_limpar_mantem_protegidos_e_recentes(tmp_path):
+    armazem = ArmazemDocumentos(tmp_path, tamanho_maximo_mb=0)
+    antigo, protegido, recente = (armazem.guardar(dados) for dados in (b'antigo', b'protegido', b'recente'))
+    for chave in (antigo, protegido):
+        os.utime(armazem.caminho(chave), (0, 0))
+
+    armazem.limpar(protegidos={protegido})
+    assert (antigo in armazem, protegido in armazem, recente in armazem) == (False, True, True)
@@ -0,0 +1,58 @@
+import pytest
+
+from consulta import analisar, buscar_consulta, composta
+from indice_busca import IndiceInvertido
+
+TEXTOS = [
+    'Parafuso e porca sextavado inox',
+    'Parafuso phillips zincado',
+    'Porca sextavada latão',
+    'Caixa ou gaveta organizadora',
+    'Fechadura tetra inox',
+]
+
+
+@pytest.fixture(scope='module')
+def indice():
+    return IndiceInvertido.construir(TEXTOS)
+
+
+def _docs(indice, consulta):
+    return sorted(buscar_consulta(indice, consulta))
+
+
+def test_operadores_em_ingles(indice):
+    assert _docs(indice, 'parafuso AND (inox OR zincado) NOT phillips') == [0]
+    assert _docs(indice, 'porca OR fechadura') == [0, 2, 4]
+    assert _docs(indice, 'inox NOT parafuso') == [4]
+    assert _docs(indice, 'NOT parafuso') == [2, 3, 4]
+
+
+def test_palavras_em_portugues_sao_texto_em_consulta_simples(indice):
+    assert analisar('PARAFUSO E PORCA') == ('frase', 'PARAFUSO E PORCA', True)
+    assert not composta('CAIXA OU GAVETA')
+    assert _docs(indice, 'PARAFUSO E PORCA') == [0]
+    assert _docs(indice, 'CAIXA OU GAVETA') == [3]
+
+
+def test_palavras_em_portugues_sao_operadores_em_consulta_booleana(indice):
+    assert _docs(indice, '(parafuso OU porca) NÃO inox') == [1, 2]
+    assert _docs(indice, 'porca E latão OR fechadura') == [2, 4]
+
+
+def test_lista_ignora_elementos_vazios(indice):
+    assert _docs(indice, 'fechadura,') == [4]
+    assert _docs(indice, 'phillips,, latão; ') == [1, 2]
+    assert _docs(indice, '(phillips, ) OR , tetra') == [1, 4]
+    assert not composta('fechadura,')
+
+
+@pytest.mark.parametrize('consulta, mensagem', [
+    ('parafuso AND', 'Consulta incompleta'),
+    ('AND parafuso', "perto de 'AND'"),
+    ('parafuso OR )', r"perto de '\)'"),
+    ('(parafuso OU porca) OU', 'Consulta incompleta'),
+])
+def test_erros_mostram_o_texto_digitado(consulta, mensagem):
+    with pytest.raises(ValueError, match=mensagem):
+        analisar(consulta)
@@ -0,0 +1,79 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import danfe_nfe
+from danfe_nfe import CacheDanfe, GeracaoDanfes
+
+
+@pytest.fixture
+def gerados(monkeypatch):
+    """
+    DANFE falso no lugar do PyNFe, com pool de threads no lugar do de
+    processos. gerados['liberar'] segura a geração até ser acionado
+    """
+    estado = {'xmls': [], 'liberar': threading.Event()}
+
+    def gerar_danfe(xml_content):
+        estado['liberar'].wait(10)
+        if b'quebrado' in xml_content:
+            raise ValueError('XML inválido')
+        estado['xmls'].append(xml_content)
+        return b'%PDF ' + xml_content
+
+    monkeypatch.setattr(danfe_nfe, 'gerar_danfe', gerar_danfe)
+    monkeypatch.setattr(danfe_nfe, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    return estado
+
+
+def _todos(geracao):
+    prontos = []
+    limite = time.monotonic() + 10
+    while not geracao.terminada:
+        assert time.monotonic() < limite
+        prontos.extend(geracao.prontos(espera=0.1))
+    return dict(prontos)
+
+
+def test_cache_danfe_remove_o_menos_usado():
+    cache = CacheDanfe(tamanho_maximo=2)
+    cache.guardar('a', b'A')
+    cache.guardar('b', b'B')
+    assert cache.consultar('a') == b'A'
+    cache.guardar('c', b'C')
+    assert (cache.consultar('a'), cache.consultar('b'), cache.consultar('c')) == (b'A', None, b'C')
+
+
+def test_geracao_le_cada_xml_so_quando_entra_no_pool(gerados):
+    lidos = []
+
+    def abridor(numero):
+        def abrir():
+            lidos.append(numero)
+            return b'<nfe quebrado/>' if numero == 3 else f'<nfe n="{numero}"/>'.encode()
+        return abrir
+
+    xmls = [(f'{n}.xml', abridor(n)) for n in range(20)] + [('sumido.xml', lambda: None)]
+    geracao = GeracaoDanfes(xmls, num_processos=2, cache=CacheDanfe()).iniciar()
+    time.sleep(0.2)
+    # Duas notas por processo no pool; as demais ainda não foram lidas
+    assert len(lidos) == 4
+
+    gerados['liberar'].set()
+    prontos = _todos(geracao)
+    assert sorted(prontos) == sorted(f'{n}.xml' for n in range(20) if n != 3)
+    assert prontos['7.xml'] == b'%PDF <nfe n="7"/>'
+    assert geracao.erros == [('3.xml', 'XML inválido')]
+
+
+def test_geracao_usa_o_cache(gerados):
+    gerados['liberar'].set()
+    cache = CacheDanfe()
+    xmls = [(f'{n}.xml', f'<nfe n="{n}"/>'.encode()) for n in range(3)]
+    assert len(_todos(GeracaoDanfes(xmls, num_processos=1, cache=cache).iniciar())) == 3
+
+    gerados['xmls'].clear()
+    assert len(_todos(GeracaoDanfes(xmls, num_processos=2, cache=cache).iniciar())) == 3
+    assert gerados['xmls'] == []
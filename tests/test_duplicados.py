@@ -0,0 +1,48 @@
+from duplicados import AgrupadorDuplicados, chave_no_texto
+from indice_notas import IndiceNotas
+
+CHAVE = '35240339150008000170550010000000011527950290'
+
+
+def _arquivo(hash_conteudo, tipo, chave=CHAVE):
+    return {'hash': hash_conteudo, 'tipo': tipo, 'chave': chave}
+
+
+def test_chave_no_texto_em_grupos_de_quatro():
+    impressa = ' '.join(CHAVE[i:i + 4] for i in range(0, 44, 4))
+    assert chave_no_texto(f'CHAVE DE ACESSO {impressa}') == CHAVE
+    assert chave_no_texto(CHAVE[:-1] + '1') is None
+
+
+def test_copias_identicas_e_danfe_do_xml():
+    agrupador = AgrupadorDuplicados()
+    assert agrupador.classificar(_arquivo('xml', 'XML')) == ('nova', None)
+    assert agrupador.classificar(_arquivo('xml', 'XML')) == ('copia', 'xml')
+    assert agrupador.classificar(_arquivo('danfe', 'PDF')) == ('copia', 'xml')
+    assert agrupador.classificar(_arquivo('outro xml', 'XML')) == ('copia', 'xml')
+
+
+def test_pdfs_diferentes_da_mesma_chave_sao_documentos_proprios():
+    agrupador = AgrupadorDuplicados()
+    assert agrupador.classificar(_arquivo('danfe', 'PDF')) == ('nova', None)
+    assert agrupador.classificar(_arquivo('carimbado', 'PDF')) == ('nova', None)
+    assert agrupador.classificar(_arquivo('danfe', 'PDF')) == ('copia', 'danfe')
+
+    assert agrupador.classificar(_arquivo('xml', 'XML')) == ('substitui', ['danfe', 'carimbado'])
+    assert agrupador.classificar(_arquivo('carimbado', 'PDF')) == ('copia', 'xml')
+    assert agrupador.classificar(_arquivo('terceiro', 'PDF')) == ('copia', 'xml')
+
+
+def test_texto_de_cada_pdf_da_mesma_nota_e_indexado(gerar_xmls, extrair, gerar_danfe):
+    (nome, dados, nota), = gerar_xmls(1)
+    danfe = gerar_danfe(nota)
+    carimbado = gerar_danfe(nota, ['RECEBIDO NO ALMOXARIFADO EM 12/03'])
+    indice = IndiceNotas.de_resultados(extrair([('danfe.pdf', danfe), ('carimbado.pdf', carimbado)]))
+    assert len(indice) == 2 and indice.duplicados == 0
+    assert list(indice.pesquisar('almoxarifado')[0]) == [1]
+
+    agrupador = AgrupadorDuplicados()
+    agrupador.reiniciar(indice.arquivos())
+    indice.mesclar(IndiceNotas.de_resultados(extrair([(nome, dados)]), agrupador=agrupador))
+    assert indice.ocultos == {0, 1}
+    assert sorted(copia['arquivo'] for copia in indice.df_index.at[2, 'copias']) == ['carimbado.pdf', 'danfe.pdf']
@@ -0,0 +1,46 @@
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import danfe_nfe
+from exportacao import iterar_zip, membros_resultado
+
+
+def _abrir(dados):
+    return zipfile.ZipFile(io.BytesIO(b''.join(dados)))
+
+
+def test_iterar_zip_gera_os_membros_em_blocos(monkeypatch):
+    monkeypatch.setattr('exportacao.TAMANHO_BLOCO', 1024)
+    grande = bytes(range(256)) * 64
+
+    def falha():
+        raise OSError('sumiu')
+
+    membros = [('a.xml', b'<a/>'), ('b.pdf', io.BytesIO(grande)), ('c.xml', falha), ('d.xml', lambda: b'<d/>')]
+    blocos = list(iterar_zip(membros))
+    assert len(blocos) > 1
+    with _abrir(blocos) as zip_file:
+        assert zip_file.namelist() == ['a.xml', 'b.pdf', 'd.xml']
+        assert zip_file.read('b.pdf') == grande
+
+
+@pytest.mark.parametrize('num_processos', [1, 2])
+def test_zip_do_resultado_leva_danfes_e_erros(monkeypatch, num_processos):
+    def gerar_danfe(xml_content):
+        if b'quebrado' in xml_content:
+            raise ValueError('XML inválido')
+        return b'%PDF ' + xml_content
+
+    monkeypatch.setattr(danfe_nfe, 'gerar_danfe', gerar_danfe)
+    monkeypatch.setattr(danfe_nfe, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    conteudos = {'1.xml': b'<nfe n="1"/>', '2.xml': b'<nfe quebrado/>', '3.pdf': b'%PDF 3', 'sumido.xml': None}
+    registros = [{'arquivo': nome, 'hash': nome} for nome in conteudos]
+
+    membros = membros_resultado(registros, lambda registro: conteudos[registro['hash']], num_processos)
+    with _abrir(iterar_zip(membros)) as zip_file:
+        assert sorted(zip_file.namelist()) == ['1.xml', '1_danfe.pdf', '2.xml', '3.pdf', 'ERROS_DANFE.txt']
+        assert zip_file.read('1_danfe.pdf') == b'%PDF <nfe n="1"/>'
+        assert zip_file.read('ERROS_DANFE.txt').decode('utf-8') == '2.xml: XML inválido\n'
@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from lxml import etree
+
+import extracao
+
+
+class PoolContado(ThreadPoolExecutor):
+    """
+    Pool de threads no lugar do de processos, contando os envios
+    """
+    enviados = 0
+
+    def submit(self, *args, **kwargs):
+        PoolContado.enviados += 1
+        return super().submit(*args, **kwargs)
+
+
+def test_extracao_em_paralelo_envia_poucos_arquivos_por_vez(gerar_xmls, monkeypatch):
+    monkeypatch.setattr(extracao, 'ProcessPoolExecutor', PoolContado)
+    monkeypatch.setattr(PoolContado, 'enviados', 0)
+    arquivos = [(nome, dados) for nome, dados, _ in gerar_xmls(20)]
+
+    extraidos = extracao.extrair_em_paralelo(arquivos, num_processos=2)
+    i, resultado = next(extraidos)
+    assert resultado['arquivo'] == arquivos[i][0] and resultado['erro'] is None
+    assert PoolContado.enviados <= 4
+
+    extraidos.close()
+    assert PoolContado.enviados <= 5
+
+
+def test_extracao_em_paralelo_entrega_todos_os_arquivos(gerar_xmls, monkeypatch):
+    monkeypatch.setattr(extracao, 'ProcessPoolExecutor', PoolContado)
+    arquivos = [(nome, dados) for nome, dados, _ in gerar_xmls(9)] + [('quebrado.xml', b'<nfe')]
+
+    resultados = dict(extracao.extrair_em_paralelo(arquivos, num_processos=3))
+    assert sorted(resultados) == list(range(10))
+    assert [resultados[i]['arquivo'] for i in range(10)] == [nome for nome, _ in arquivos]
+    assert [i for i, resultado in resultados.items() if resultado['erro']] == [9]
+
+
+def test_xml_lido_uma_vez_para_texto_e_itens(gerar_xmls, monkeypatch):
+    leituras = []
+    iterparse = etree.iterparse
+
+    def contar(*args, **kwargs):
+        leituras.append(1)
+        return iterparse(*args, **kwargs)
+
+    monkeypatch.setattr(extracao.etree, 'iterparse', contar)
+    nome, dados, nota = gerar_xmls(1, itens_max=3)[0]
+
+    resultado = extracao.extrair_arquivo(nome, dados)
+    assert leituras == [1] and resultado['erro'] is None
+    linhas = resultado['conteudo'].split('\n')
+    assert linhas[0] == f"Chave: NFe{nota['chave']}"
+    assert linhas[-1].startswith('Valor Total NF: ')
+    itens = resultado['itens']
+    assert len(itens) == len(nota['itens']) == sum(linha.startswith('Código: ') for linha in linhas)
+    assert set(itens['chave']) == {nota['chave']} and set(itens['arquivo']) == {nome}
+
+
+def test_limite_de_threads_do_tesseract_so_nos_processos_do_pool(monkeypatch):
+    monkeypatch.delenv('OMP_THREAD_LIMIT', raising=False)
+    codigo = 'import os, extracao; print(os.environ.get("OMP_THREAD_LIMIT"))'
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    saida = subprocess.run([sys.executable, '-c', codigo], cwd=raiz, capture_output=True, text=True, check=True)
+    assert saida.stdout.strip() == 'None'
+
+    with ProcessPoolExecutor(max_workers=1, initializer=extracao._iniciar_processo) as executor:
+        assert executor.submit(os.getenv, 'OMP_THREAD_LIMIT').result() == '1'
+    assert 'OMP_THREAD_LIMIT' not in os.environ
@@ -0,0 +1,108 @@
+import pytest
+
+import indexador
+from cache_texto import CacheTexto, extrair_com_cache
+from indice_notas import IndiceNotas
+
+
+@pytest.fixture
+def extraidos(tmp_path, monkeypatch):
+    """
+    Nomes dos arquivos enviados à extração, com o cache em tmp_path
+    """
+    nomes = []
+
+    def extrair(entradas, num_processos=None, hashes=None):
+        nomes.extend(nome for nome, _ in entradas)
+        return extrair_com_cache(entradas, num_processos, CacheTexto(tmp_path / 'cache'), hashes)
+
+    monkeypatch.setattr(indexador, 'extrair_com_cache', extrair)
+    return nomes
+
+
+@pytest.fixture
+def pasta(tmp_path):
+    pasta = tmp_path / 'notas'
+    pasta.mkdir()
+    return pasta
+
+
+def _indexar(pasta, caminho):
+    mensagens = []
+    indice = indexador.indexar_pasta(pasta, caminho, num_processos=1, saida=mensagens.append)
+    assert IndiceNotas.carregar(caminho).manifesto == indice.manifesto
+    return indice, mensagens
+
+
+def _visiveis(indice):
+    return sorted(indice.df_index['arquivo'][doc] for doc in range(len(indice)) if doc not in indice.ocultos)
+
+
+def test_execucao_seguinte_so_extrai_o_que_mudou(pasta, tmp_path, gerar_xmls, extraidos):
+    xmls = gerar_xmls(6)
+    for nome, dados, _ in xmls[:4]:
+        (pasta / nome).write_bytes(dados)
+    caminho = tmp_path / 'notas.idx'
+    indice, _ = _indexar(pasta, caminho)
+    assert len(indice) == 4 and sorted(extraidos) == sorted(nome for nome, _, _ in xmls[:4])
+
+    extraidos.clear()
+    indice, mensagens = _indexar(pasta, caminho)
+    assert extraidos == [] and len(indice) == 4
+    assert mensagens[0].startswith('4 inalterado(s), 0 novo(s)')
+
+    # Um arquivo novo, um apagado e um alterado (com o conteúdo de outra nota)
+    (pasta / xmls[4][0]).write_bytes(xmls[4][1])
+    (pasta / xmls[0][0]).unlink()
+    (pasta / xmls[1][0]).write_bytes(xmls[5][1])
+    indice, _ = _indexar(pasta, caminho)
+    assert sorted(extraidos) == sorted([xmls[4][0], xmls[1][0]])
+    assert _visiveis(indice) == sorted(nome for nome, _, _ in xmls[1:5])
+    assert set(indice.df_itens['arquivo']) == set(_visiveis(indice))
+    assert len(indice.pesquisar(chave=xmls[0][2]['chave'])[0]) == 0
+    assert len(indice.pesquisar(chave=xmls[1][2]['chave'])[0]) == 0
+    docs, _ = indice.pesquisar(chave=xmls[5][2]['chave'])
+    assert [indice.df_index['arquivo'][doc] for doc in docs] == [xmls[1][0]]
+
+    # O resultado é o mesmo de indexar a pasta do zero
+    do_zero, _ = _indexar(pasta, tmp_path / 'do_zero.idx')
+    for termo in ('hiper', 'parafuso OR porca'):
+        encontrados = sorted(indice.df_index['arquivo'][doc] for doc in indice.pesquisar(termo)[0])
+        assert encontrados == sorted(do_zero.df_index['arquivo'][doc] for doc in do_zero.pesquisar(termo)[0])
+
+
+def test_danfe_volta_a_ser_documento_quando_o_xml_sai(pasta, tmp_path, gerar_xmls, gerar_danfe, extraidos):
+    (nome, dados, nota), = gerar_xmls(1)
+    (pasta / nome).write_bytes(dados)
+    (pasta / 'danfe.pdf').write_bytes(gerar_danfe(nota))
+    caminho = tmp_path / 'notas.idx'
+    indice, _ = _indexar(pasta, caminho)
+    assert _visiveis(indice) == [nome] and indice.duplicados == 1
+
+    (pasta / nome).unlink()
+    extraidos.clear()
+    indice, _ = _indexar(pasta, caminho)
+    assert extraidos == ['danfe.pdf']
+    assert _visiveis(indice) == ['danfe.pdf'] and indice.duplicados == 0
+    assert len(indice.pesquisar('hiper')[0]) == 1
+
+
+def test_indice_e_compactado_quando_os_ocultos_se_acumulam(pasta, tmp_path, gerar_xmls, extraidos):
+    xmls = gerar_xmls(8)
+    for nome, dados, _ in xmls:
+        (pasta / nome).write_bytes(dados)
+    caminho = tmp_path / 'notas.idx'
+    _indexar(pasta, caminho)
+
+    (pasta / xmls[0][0]).unlink()
+    indice, _ = _indexar(pasta, caminho)
+    oculto, = indice.ocultos
+    assert len(indice) == 8 and indice.df_index['arquivo'][oculto] == xmls[0][0]
+
+    for nome, _, _ in xmls[1:3]:
+        (pasta / nome).unlink()
+    indice, mensagens = _indexar(pasta, caminho)
+    assert any(mensagem.startswith('Compactando') for mensagem in mensagens)
+    assert (len(indice), indice.ocultos) == (5, set())
+    assert _visiveis(indice) == sorted(nome for nome, _, _ in xmls[3:])
+    assert len(indice.pesquisar('hiper')[0]) == 5
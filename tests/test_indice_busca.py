@@ -0,0 +1,103 @@
+import math
+import random
+
+import pytest
+
+from indice_busca import IndiceInvertido, IndiceTrigramas, dobrar_texto, similaridade_termo, trigramas
+
+TEXTOS = [
+    'Fechadura externa inox lingueta',
+    'Parafuso sextavado zincado; fechadura tetra',
+    'PARAF SEXT INOX M8 X 30',
+]
+
+
+def test_busca_por_prefixo_e_frase():
+    indice = IndiceInvertido.construir(TEXTOS)
+    assert sorted(indice.buscar('fecha')) == [0, 1]
+    assert sorted(indice.buscar('paraf')) == [1, 2]
+    assert sorted(indice.buscar('inox')) == [0, 2]
+    assert list(indice.buscar('parafuso sext')) == [1]
+    assert indice.buscar('fecha', prefixo=False) == {}
+
+
+def test_trechos_no_texto_original():
+    indice = IndiceInvertido.construir(['Dobradiça LATÃO 3 polegadas'])
+    (inicio, fim), = indice.buscar('latao')[0]
+    assert 'Dobradiça LATÃO 3 polegadas'[inicio:fim] == 'LATÃO'
+
+
+def test_prefixo_considera_tokens_incluidos_depois_da_busca():
+    indice = IndiceInvertido.construir(TEXTOS[:1])
+    assert sorted(indice.buscar('paraf')) == []
+    indice.adicionar(TEXTOS[1])
+    assert sorted(indice.buscar('paraf')) == [1]
+
+    segmento = IndiceInvertido.construir(['Parafusadeira a bateria', 'fecho'])
+    indice.mesclar(segmento)
+    assert sorted(indice.buscar('paraf')) == [1, 2]
+    assert sorted(indice.buscar('fech')) == [0, 1, 3]
+    vocabulario, incluidos = indice._vocabulario
+    assert vocabulario == sorted(indice._postings) and incluidos == len(indice._postings)
+
+
+def test_colunas_e_mesclar_depois_de_reabrir():
+    original = IndiceInvertido.construir(TEXTOS)
+    colunas = original.colunas()
+    reaberto = IndiceInvertido.de_colunas(**colunas)
+    for termo in ('fecha', 'inox', 'parafuso sext', '30'):
+        assert reaberto.buscar(termo) == original.buscar(termo)
+
+    reaberto.mesclar(IndiceInvertido.construir(['Parafusadeira zincada']))
+    assert sorted(reaberto.buscar('paraf')) == [1, 2, 3]
+    assert sorted(reaberto.buscar('zinc')) == [1, 3]
+
+
+def test_dobrar_texto_mantem_comprimento():
+    texto = 'Ação Çedilha ÁÉÍÓÚ ü'
+    assert dobrar_texto(texto) == 'acao cedilha aeiou u'
+    assert len(dobrar_texto(texto)) == len(texto)
+
+
+def _similares_por_forca_bruta(indice, termo, similaridade_minima):
+    consulta = trigramas(termo)
+    minimo = math.ceil(similaridade_minima * len(consulta) - 1e-9)
+    pontos = {}
+    for token in indice.tokens:
+        conjunto = trigramas(token)
+        comuns = len(consulta & conjunto)
+        if comuns < max(1, minimo):
+            continue
+        similaridade = similaridade_termo(termo, token, comuns, len(consulta), len(conjunto))
+        if similaridade >= similaridade_minima:
+            pontos[token] = similaridade
+    return pontos
+
+
+def test_similares_igual_a_comparar_com_todo_o_vocabulario():
+    rng = random.Random(7)
+    indice = IndiceTrigramas()
+    vocabulario = {''.join(rng.choice('aeioprstnc') for _ in range(rng.randint(2, 10))) for _ in range(3000)}
+    for token in sorted(vocabulario):
+        indice.adicionar(token)
+
+    for termo in ['parafuso', 'porca', 'cano', 'ta', 'rosetnaci', 'xyz']:
+        for minimo in (0.2, 0.4, 0.6):
+            esperado = _similares_por_forca_bruta(indice, termo, minimo)
+            encontrados = indice.similares(termo, minimo, limite=len(vocabulario))
+            assert {token: pytest.approx(s) for token, s in encontrados} == esperado
+            assert [s for _, s in encontrados] == sorted((s for _, s in encontrados), reverse=True)
+
+
+def test_busca_aproximada_tolera_erros():
+    indice = IndiceInvertido.construir(TEXTOS)
+    assert list(indice.buscar_aproximado('fechadora'))[:2] == [0, 1]
+    assert 2 in indice.buscar_aproximado('sextavdo inox')
+
+
+def test_busca_aproximada_acha_abreviacoes_e_letras_trocadas():
+    indice = IndiceInvertido.construir(TEXTOS + ['Porca sextavada', 'Arruela lisa'])
+    assert list(IndiceInvertido.construir(TEXTOS[1:2]).buscar_aproximado('PARAF SEXT')) == [0]
+    assert list(indice.buscar_aproximado('PARAF SEXT'))[:2] == [2, 1]
+    assert list(indice.buscar_aproximado('parafsuo'))[0] == 1
+    assert dict(indice._trigramas.similares('sext'))['sextavado'] == pytest.approx(0.8)
@@ -0,0 +1,116 @@
+import os
+import time
+
+import pytest
+
+from armazem import ArmazemDocumentos
+from indice_compartilhado import IndiceCompartilhado
+
+
+def _enviar(compartilhado, arquivos):
+    entradas, hashes = [], []
+    for nome, dados in arquivos:
+        hashes.append(compartilhado.armazem.guardar(dados))
+        entradas.append((nome, compartilhado.armazem.caminho(hashes[-1])))
+    lote, ignorados = compartilhado.enviar(entradas, hashes)
+    _aguardar(compartilhado, lote)
+    return lote, ignorados
+
+
+def _aguardar(compartilhado, lote):
+    limite = time.monotonic() + 60
+    while not compartilhado.concluida(lote):
+        assert time.monotonic() < limite
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def compartilhado(tmp_path):
+    return IndiceCompartilhado(num_processos=1, armazem=ArmazemDocumentos(tmp_path / 'armazem'),
+                               caminho_instantaneo=None)
+
+
+def test_arquivos_ja_enviados_sao_ignorados(compartilhado, gerar_xmls):
+    arquivos = [(nome, dados) for nome, dados, _ in gerar_xmls(4)]
+    lote, ignorados = _enviar(compartilhado, arquivos[:3])
+    assert (lote.erros, ignorados, len(compartilhado.indice)) == ([], 0, 3)
+
+    lote, ignorados = _enviar(compartilhado, arquivos)
+    assert (lote.erros, ignorados, len(compartilhado.indice)) == ([], 3, 4)
+    with compartilhado.leitura():
+        assert len(compartilhado.indice.pesquisar('hiper')[0]) == 4
+
+
+def test_arquivo_com_erro_pode_ser_enviado_de_novo(compartilhado, gerar_xmls):
+    arquivos = [(nome, dados) for nome, dados, _ in gerar_xmls(2)] + [('quebrado.xml', b'<nfe')]
+    lote, _ = _enviar(compartilhado, arquivos)
+    assert [arquivo for arquivo, _ in lote.erros] == ['quebrado.xml']
+
+    lote, ignorados = _enviar(compartilhado, arquivos)
+    assert ignorados == 2
+    assert [arquivo for arquivo, _ in lote.erros] == ['quebrado.xml']
+
+
+def test_falha_do_lote_libera_os_arquivos_nao_indexados(compartilhado, gerar_xmls, monkeypatch):
+    arquivos = [(nome, dados) for nome, dados, _ in gerar_xmls(3)]
+
+    def falhar(segmento):
+        raise RuntimeError('disco cheio')
+
+    monkeypatch.setattr(compartilhado.indice, 'mesclar', falhar)
+    lote, _ = _enviar(compartilhado, arquivos)
+    assert lote.erros == [('', 'disco cheio')]
+    assert len(compartilhado.indice) == 0
+
+    monkeypatch.undo()
+    lote, ignorados = _enviar(compartilhado, arquivos)
+    assert (lote.erros, ignorados, len(compartilhado.indice)) == ([], 0, 3)
+
+
+def test_lote_cancelado_na_fila_pode_ser_enviado_de_novo(compartilhado, gerar_xmls):
+    arquivos = [(nome, dados) for nome, dados, _ in gerar_xmls(4)]
+    entradas, hashes = [], []
+    for nome, dados in arquivos:
+        hashes.append(compartilhado.armazem.guardar(dados))
+        entradas.append((nome, compartilhado.armazem.caminho(hashes[-1])))
+
+    with compartilhado.trava.escrita():
+        # O primeiro lote prende a escritora até a trava ser liberada,
+        # e o segundo é cancelado ainda na fila
+        primeiro, _ = compartilhado.enviar(entradas[:1], hashes[:1])
+        segundo, _ = compartilhado.enviar(entradas[1:], hashes[1:])
+        segundo.cancelar()
+    _aguardar(compartilhado, primeiro)
+    _aguardar(compartilhado, segundo)
+    assert (segundo.concluidos, len(compartilhado.indice)) == (0, 1)
+
+    lote, ignorados = _enviar(compartilhado, arquivos)
+    assert (lote.erros, ignorados, len(compartilhado.indice)) == ([], 1, 4)
+
+
+def test_arquivos_com_o_mesmo_nome_sao_baixados_pelo_hash(compartilhado, gerar_xmls):
+    from app import abridor_de_arquivos
+
+    (_, primeiro, _), (_, segundo, _) = gerar_xmls(2)
+    _enviar(compartilhado, [('nota.xml', primeiro)])
+    _enviar(compartilhado, [('nota.xml', segundo)])
+    assert len(compartilhado.indice) == 2
+
+    obter = abridor_de_arquivos(compartilhado.armazem)
+    registros = [registros[0] for registros in compartilhado.indice.arquivos_das_notas([0, 1])]
+    assert [bytes(obter(registro)) for registro in registros] == [primeiro, segundo]
+
+
+def test_limpar_armazem_remove_os_ja_indexados(tmp_path, gerar_xmls):
+    armazem = ArmazemDocumentos(tmp_path / 'armazem', tamanho_maximo_mb=0)
+    compartilhado = IndiceCompartilhado(num_processos=1, armazem=armazem, caminho_instantaneo=None)
+    _enviar(compartilhado, [(nome, dados) for nome, dados, _ in gerar_xmls(2)])
+
+    # Os gravados há pouco ficam, por poderem ser de um envio em andamento
+    compartilhado.limpar_armazem()
+    assert len(list(armazem.diretorio.glob('*/*'))) == 2
+
+    for caminho in armazem.diretorio.glob('*/*'):
+        os.utime(caminho, (0, 0))
+    compartilhado.limpar_armazem()
+    assert list(armazem.diretorio.glob('*/*')) == []
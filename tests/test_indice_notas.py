@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from duplicados import AgrupadorDuplicados
+from indice_notas import IndiceNotas
+
+
+def _segmentos(resultados, tamanho):
+    return [resultados[i:i + tamanho] for i in range(0, len(resultados), tamanho)]
+
+
+@pytest.fixture
+def resultados(gerar_xmls, extrair):
+    return extrair([(nome, dados) for nome, dados, _ in gerar_xmls(12)])
+
+
+def test_mesclar_segmentos_igual_a_indexar_tudo(resultados):
+    completo = IndiceNotas.de_resultados(resultados)
+    mesclado = IndiceNotas()
+    for parte in _segmentos(resultados, 5):
+        mesclado.mesclar(IndiceNotas.de_resultados(parte))
+
+    assert len(mesclado) == len(completo) == 12
+    pd.testing.assert_frame_equal(mesclado.df_index, completo.df_index)
+    pd.testing.assert_frame_equal(mesclado.df_itens, completo.df_itens)
+    for termo in ('hiper', 'parafuso OR porca', '"fechadura tetra"'):
+        docs, ocorrencias = mesclado.pesquisar(termo)
+        docs_completo, ocorrencias_completo = completo.pesquisar(termo)
+        assert np.array_equal(docs, docs_completo) and ocorrencias == ocorrencias_completo
+    docs, _ = mesclado.pesquisar(ncm='7318*', valor_minimo=10)
+    assert np.array_equal(docs, completo.pesquisar(ncm='7318*', valor_minimo=10)[0])
+    pd.testing.assert_frame_equal(mesclado.agregados.resumir(['ncm', 'mes']), completo.agregados.resumir(['ncm', 'mes']))
+    assert [mesclado.texto(doc) for doc in range(12)] == [completo.texto(doc) for doc in range(12)]
+
+
+def test_mesclar_nao_concatena_as_tabelas_a_cada_segmento(resultados):
+    indice = IndiceNotas()
+    for parte in _segmentos(resultados, 3):
+        indice.mesclar(IndiceNotas.de_resultados(parte))
+    assert len(indice._partes_index) == 4 and len(indice._partes_itens) == 4
+    assert len(indice) == 12
+
+    assert len(indice.df_index) == 12 and len(indice._partes_index) == 1
+    assert indice.df_itens['arquivo'].nunique() == 12 and len(indice._partes_itens) == 1
+
+
+def test_copias_vinculadas_entre_segmentos(gerar_xmls, extrair, gerar_danfe):
+    (nome, dados, nota), = gerar_xmls(1)
+    primeiro = extrair([(nome, dados)])
+    segundo = extrair([('reenvio/' + nome, dados), ('danfe.pdf', gerar_danfe(nota))])
+
+    agrupador = AgrupadorDuplicados()
+    indice = IndiceNotas.de_resultados(primeiro, agrupador=agrupador)
+    indice.mesclar(IndiceNotas.de_resultados(segundo, agrupador=agrupador))
+    assert len(indice) == 1 and indice.duplicados == 2
+    assert [copia['arquivo'] for copia in indice.df_index.at[0, 'copias']] == ['reenvio/' + nome, 'danfe.pdf']
+    assert indice.hashes() == {resultado['hash'] for resultado in primeiro + segundo}
+
+
+def test_xml_depois_do_danfe_substitui_o_pdf(gerar_xmls, extrair, gerar_danfe):
+    (nome, dados, nota), = gerar_xmls(1)
+    agrupador = AgrupadorDuplicados()
+    indice = IndiceNotas.de_resultados(extrair([('danfe.pdf', gerar_danfe(nota))]), agrupador=agrupador)
+    indice.mesclar(IndiceNotas.de_resultados(extrair([(nome, dados)]), agrupador=agrupador))
+
+    assert indice.ocultos == {0}
+    assert [copia['arquivo'] for copia in indice.df_index.at[1, 'copias']] == ['danfe.pdf']
+    assert list(indice.pesquisar('hiper')[0]) == [1]
+    assert [arquivo['arquivo'] for arquivo in indice.arquivos()] == [nome, 'danfe.pdf']
+
+
+def test_prefixo_de_ncm_curto_nao_filtra(resultados):
+    indice = IndiceNotas.de_resultados(resultados)
+    todos, _ = indice.pesquisar('parafuso OR porca')
+    for ncm in ('*', ' * ', '7*'):
+        docs, _ = indice.pesquisar('parafuso OR porca', ncm=ncm)
+        assert np.array_equal(docs, todos)
+
+    # Com dois dígitos o prefixo já filtra
+    docs, _ = indice.pesquisar(ncm='73*')
+    esperados = indice.df_itens.loc[indice.df_itens['NCM'].astype(str).str.startswith('73'), 'arquivo']
+    assert 0 < len(docs) < len(indice)
+    assert set(indice.df_index['arquivo'].iloc[docs]) == set(esperados)
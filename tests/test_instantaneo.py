@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from armazem import ArmazemDocumentos
+from benchmarks.corpus import nota_para_xml
+from indice_compartilhado import IndiceCompartilhado
+from indice_notas import IndiceNotas
+from test_indice_compartilhado import _enviar
+
+
+def _incompleta(nota):
+    """
+    XML da nota sem cProd no primeiro item, sem NCM no último e sem o
+    CNPJ do destinatário
+    """
+    xml = nota_para_xml(nota)
+    primeiro, segundo = nota['itens'][0], nota['itens'][-1]
+    xml = xml.replace(f"<cProd>{primeiro['cProd']}</cProd>".encode(), b'')
+    xml = xml.replace(f"<NCM>{segundo['NCM']}</NCM>".encode(), b'')
+    return xml.replace(b'<dest><CNPJ>98765432000110</CNPJ>', b'<dest>')
+
+
+@pytest.fixture
+def indice(gerar_xmls, extrair):
+    xmls = gerar_xmls(6, itens_max=4)
+    arquivos = [(nome, _incompleta(nota) if i % 2 else dados) for i, (nome, dados, nota) in enumerate(xmls)]
+    return IndiceNotas.de_resultados(extrair(arquivos))
+
+
+@pytest.mark.parametrize('nome', ['notas.parquet', 'notas.idx'])
+def test_ida_e_volta_com_campos_ausentes(indice, tmp_path, nome):
+    assert indice.df_itens['cProd'].isna().any() and indice.df_itens['NCM'].isna().any()
+    indice.salvar(tmp_path / nome)
+    aberto = IndiceNotas.carregar(tmp_path / nome)
+
+    pd.testing.assert_frame_equal(aberto.df_index, indice.df_index)
+    pd.testing.assert_frame_equal(aberto.df_itens, indice.df_itens)
+    assert [aberto.texto(doc) for doc in range(len(aberto))] == [indice.texto(doc) for doc in range(len(indice))]
+    for termo in ('hiper', 'parafuso OR porca', 'argamasa'):
+        aproximada = termo == 'argamasa'
+        esperado = indice.pesquisar(termo, aproximada=aproximada)
+        encontrado = aberto.pesquisar(termo, aproximada=aproximada)
+        assert np.array_equal(encontrado[0], esperado[0]) and encontrado[1] == esperado[1]
+    for por in (['produto'], ['ncm', 'emitente', 'mes']):
+        pd.testing.assert_frame_equal(aberto.agregados.resumir(por), indice.agregados.resumir(por))
+    docs, _ = aberto.pesquisar(cnpj_destinatario='98765432000110')
+    assert np.array_equal(docs, indice.pesquisar(cnpj_destinatario='98765432000110')[0]) and len(docs) == 3
+
+    # O índice aberto continua recebendo segmentos
+    aberto.mesclar(IndiceNotas.de_resultados([]))
+    aberto.salvar(tmp_path / nome)
+    assert len(IndiceNotas.carregar(tmp_path / nome)) == 6
+
+
+def test_indice_compartilhado_restaurado_do_instantaneo(tmp_path, gerar_xmls):
+    caminho = tmp_path / 'compartilhado.parquet'
+    xmls = gerar_xmls(3)
+    arquivos = [(nome, _incompleta(nota)) for nome, _, nota in xmls]
+
+    def criar():
+        return IndiceCompartilhado(num_processos=1, armazem=ArmazemDocumentos(tmp_path / 'armazem'),
+                                   caminho_instantaneo=str(caminho))
+
+    compartilhado = criar()
+    lote, _ = _enviar(compartilhado, arquivos)
+    assert lote.erros == [] and compartilhado.aviso is None and caminho.exists()
+
+    restaurado = criar()
+    assert len(restaurado.indice) == 3
+    _, ignorados = _enviar(restaurado, arquivos)
+    assert ignorados == 3
+
+
+def test_valores_nan_gravados_como_nulos(indice, tmp_path):
+    # Valores ausentes que chegam como NaN aos vocabulários
+    indice.agregados._vocabularios['ncm'].codigo(float('nan'))
+    indice.agregados._vocabularios['produto'].codigo((float('nan'), 'Prod sem código'))
+    indice.salvar(tmp_path / 'notas.parquet')
+
+    aberto = IndiceNotas.carregar(tmp_path / 'notas.parquet')
+    assert aberto.agregados._vocabularios['ncm'].valores[-1] is None
+    assert aberto.agregados._vocabularios['produto'].valores[-1] == (None, 'Prod sem código')
+    assert len(aberto) == len(indice)
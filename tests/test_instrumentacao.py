@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from extracao import extrair_arquivo
+from instrumentacao import (
+    arquivo_em_medicao, em_contexto, medir_etapa, registros, resumo_por_etapa, tabela_medicoes,
+)
+
+
+def _medir(etapa):
+    with medir_etapa(etapa):
+        pass
+
+
+def test_medicoes_do_arquivo_ficam_fora_das_do_processo():
+    _medir('teste_fora')
+    with arquivo_em_medicao('a.xml') as medicoes:
+        _medir('teste_dentro')
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            executor.submit(em_contexto(_medir), 'teste_thread').result()
+            # Sem em_contexto(), a thread do pool não sabe do arquivo
+            executor.submit(_medir, 'teste_thread_solta').result()
+
+    assert [(r['etapa'], r['arquivo']) for r in medicoes] == [('teste_dentro', 'a.xml'), ('teste_thread', 'a.xml')]
+    etapas = {'teste_fora', 'teste_dentro', 'teste_thread', 'teste_thread_solta'}
+    assert sorted((r['etapa'], r['arquivo']) for r in registros(etapas)) == [
+        ('teste_fora', None), ('teste_thread_solta', None)
+    ]
+
+
+def test_arquivos_medidos_em_threads_nao_se_misturam():
+    barreira = threading.Barrier(2)
+    resultados = {}
+
+    def medir_arquivo(nome):
+        with arquivo_em_medicao(nome) as medicoes:
+            barreira.wait()
+            _medir('teste_concorrente')
+            barreira.wait()
+        resultados[nome] = [r['arquivo'] for r in medicoes]
+
+    threads = [threading.Thread(target=medir_arquivo, args=(nome,)) for nome in ('a.xml', 'b.xml')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert resultados == {'a.xml': ['a.xml'], 'b.xml': ['b.xml']}
+
+
+def test_extracao_no_processo_devolve_so_as_medicoes_do_arquivo(gerar_xmls):
+    _medir('criar_zip_resultado')
+    antes = len(registros({'criar_zip_resultado'}))
+    nome, dados, _ = gerar_xmls(1)[0]
+
+    resultado = extrair_arquivo(nome, dados)
+    assert resultado['medicoes'] and {r['arquivo'] for r in resultado['medicoes']} == {nome}
+    assert len(registros({'criar_zip_resultado'})) == antes
+
+    resumo = resumo_por_etapa(tabela_medicoes(resultado['medicoes']))
+    assert set(resumo.index) == {r['etapa'] for r in resultado['medicoes']}
+    assert 'rss_max_processo_mb' in resumo.columns
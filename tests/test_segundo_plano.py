@@ -0,0 +1,57 @@
+import types
+
+import pytest
+
+import segundo_plano
+from segundo_plano import IndexacaoEmSegundoPlano
+
+
+@pytest.fixture
+def extraidos(monkeypatch, gerar_xmls, extrair):
+    """
+    Troca a extração pelos resultados prontos de 7 XMLs, entregues um a um
+    com o relógio avançando relogio['passo'] segundos a cada arquivo
+    """
+    resultados = extrair([(nome, dados) for nome, dados, _ in gerar_xmls(7)])
+    relogio = {'agora': 0.0, 'passo': 0.0}
+
+    def extrair_com_cache(entradas, num_processos=None, hashes=None):
+        for i, resultado in enumerate(resultados):
+            relogio['agora'] += relogio['passo']
+            yield i, dict(resultado), False
+
+    monkeypatch.setattr(segundo_plano, 'extrair_com_cache', extrair_com_cache)
+    monkeypatch.setattr(segundo_plano, 'time', types.SimpleNamespace(monotonic=lambda: relogio['agora']))
+    return resultados, relogio
+
+
+def _segmentos(indexacao):
+    indexacao.iniciar()._thread.join()
+    return [len(segmento) for segmento in indexacao.segmentos()]
+
+
+def test_segmentos_publicados_pela_quantidade(extraidos, monkeypatch):
+    resultados, _ = extraidos
+    monkeypatch.setattr(segundo_plano, 'TAMANHO_SEGMENTO', 3)
+    indexacao = IndexacaoEmSegundoPlano([(r['arquivo'], b'') for r in resultados])
+    assert _segmentos(indexacao) == [3, 3, 1]
+    assert (indexacao.concluidos, indexacao.erros, indexacao.terminada) == (7, [], True)
+
+
+def test_segmentos_publicados_pelo_tempo(extraidos, monkeypatch):
+    resultados, relogio = extraidos
+    monkeypatch.setattr(segundo_plano, 'INTERVALO_SEGMENTO', 1.0)
+    # Um arquivo a cada 0,4 s: publica quando passa 1 s desde o último segmento
+    relogio['passo'] = 0.4
+    indexacao = IndexacaoEmSegundoPlano([(r['arquivo'], b'') for r in resultados])
+    assert _segmentos(indexacao) == [3, 3, 1]
+
+    relogio.update(agora=0.0, passo=0.0)
+    assert _segmentos(IndexacaoEmSegundoPlano([(r['arquivo'], b'') for r in resultados])) == [7]
+
+
+def test_cancelada_antes_de_iniciar_nao_publica(extraidos):
+    resultados, _ = extraidos
+    indexacao = IndexacaoEmSegundoPlano([(r['arquivo'], b'') for r in resultados])
+    indexacao.cancelar()
+    assert _segmentos(indexacao) == [] and indexacao.concluidos == 0